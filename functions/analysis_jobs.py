@@ -0,0 +1,512 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+# Job mode settings, overridable through environment variables. Jobs are
+# dispatched through Cloud Tasks to the run_analysis_job task function;
+# JOB_DISPATCH=local runs them on in-process threads instead (tests and
+# local development only: nothing drains the queue once the instance idles)
+JOB_DISPATCH = os.environ.get("JOB_DISPATCH", "cloud_tasks")
+JOB_TASK_FUNCTION = os.environ.get("JOB_TASK_FUNCTION", "run_analysis_job")
+JOB_MAX_CONCURRENT_DISPATCHES = int(os.environ.get("JOB_MAX_CONCURRENT_DISPATCHES", "10"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_IMAGE_PREFIX = os.environ.get("JOB_IMAGE_PREFIX", "analysis_jobs/")
+JOB_QUEUE_DB = os.environ.get("JOB_QUEUE_DB", "")
+JOB_RESULT_STORE = os.environ.get("JOB_RESULT_STORE", "firestore")
+JOB_COLLECTION = os.environ.get("JOB_COLLECTION", "analysis_jobs")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX_DEPTH = int(os.environ.get("JOB_QUEUE_MAX_DEPTH", "200"))
+JOB_RESULT_TTL_SECONDS = int(os.environ.get("JOB_RESULT_TTL_SECONDS", str(24 * 60 * 60)))
+
+# SQLite jobs claimed but never acknowledged (worker crashed) are redelivered after this long
+JOB_CLAIM_TIMEOUT_SECONDS = float(os.environ.get("JOB_CLAIM_TIMEOUT_SECONDS", "300"))
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit"""
+
+
+class ImageStore:
+    """Interface for where uploaded images wait until their job runs"""
+
+    def put(self, job_id, image_bytes):
+        """Store a job's image and return the path to load it from"""
+        raise NotImplementedError
+
+    def get(self, path):
+        """Return the image bytes stored at path"""
+        raise NotImplementedError
+
+    def delete(self, path):
+        """Remove the image once its job has finished"""
+        raise NotImplementedError
+
+
+class InMemoryImageStore(ImageStore):
+    """Process-local images, for tests and the local worker pool"""
+
+    def __init__(self):
+        self._images = {}
+        self._lock = threading.Lock()
+
+    def put(self, job_id, image_bytes):
+        with self._lock:
+            self._images[job_id] = bytes(image_bytes)
+        return job_id
+
+    def get(self, path):
+        with self._lock:
+            return self._images[path]
+
+    def delete(self, path):
+        with self._lock:
+            self._images.pop(path, None)
+
+
+class CloudStorageImageStore(ImageStore):
+    """
+    Images as objects under a prefix of the default Cloud Storage bucket
+
+    Objects are deleted when their job finishes; a lifecycle rule on the
+    prefix cleans up after jobs that never ran.
+    """
+
+    def __init__(self, prefix=JOB_IMAGE_PREFIX):
+        self.prefix = prefix
+
+    def _blob(self, path):
+        from dependencies import get_storage_bucket
+        return get_storage_bucket().blob(path)
+
+    def put(self, job_id, image_bytes):
+        path = f"{self.prefix}{job_id}"
+        self._blob(path).upload_from_string(bytes(image_bytes), content_type="application/octet-stream")
+        return path
+
+    def get(self, path):
+        return self._blob(path).download_as_bytes()
+
+    def delete(self, path):
+        self._blob(path).delete()
+
+
+class JobQueue:
+    """Interface for the in-process queue feeding JobWorkerPool (tests and local runs)"""
+
+    def put(self, job):
+        """Enqueue a job dict with 'id', 'kwargs' and optional 'image_path'"""
+        raise NotImplementedError
+
+    def get(self, timeout):
+        """Claim the oldest job, waiting up to timeout seconds; return None if there is none"""
+        raise NotImplementedError
+
+    def ack(self, job_id):
+        """Mark a claimed job as finished so it is never redelivered"""
+        raise NotImplementedError
+
+    def depth(self):
+        """Return the number of jobs not yet acknowledged"""
+        raise NotImplementedError
+
+
+class InMemoryJobQueue(JobQueue):
+    """Process-local queue; jobs are lost if the instance goes away"""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._unacked = 0
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            self._unacked += 1
+        self._queue.put(job)
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def ack(self, job_id):
+        with self._lock:
+            self._unacked -= 1
+
+    def depth(self):
+        with self._lock:
+            return self._unacked
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Queue backed by a local SQLite file
+
+    Jobs survive a worker restart on the same machine: a claimed job that is not acknowledged
+    within claim_timeout seconds is handed out again.
+    """
+
+    def __init__(self, path, claim_timeout=JOB_CLAIM_TIMEOUT_SECONDS, poll_seconds=0.2):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_queue ("
+            "id TEXT PRIMARY KEY, kwargs TEXT NOT NULL, image_path TEXT, enqueued_at REAL NOT NULL, claimed_at REAL)"
+        )
+        self._conn.commit()
+
+    def put(self, job):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO job_queue (id, kwargs, image_path, enqueued_at) VALUES (?, ?, ?, ?)",
+                (job["id"], json.dumps(job["kwargs"]), job.get("image_path"), time.time()),
+            )
+            self._conn.commit()
+            self._available.notify()
+
+    def get(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT id, kwargs, image_path FROM job_queue WHERE claimed_at IS NULL OR claimed_at < ? "
+                    "ORDER BY enqueued_at LIMIT 1",
+                    (now - self.claim_timeout,),
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute("UPDATE job_queue SET claimed_at = ? WHERE id = ?", (now, row[0]))
+                    self._conn.commit()
+                    return {"id": row[0], "kwargs": json.loads(row[1]), "image_path": row[2]}
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Other processes may share the file, so poll as well as wait for local puts
+                self._available.wait(min(remaining, self.poll_seconds))
+
+    def ack(self, job_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM job_queue WHERE id = ?", (job_id,))
+            self._conn.commit()
+
+    def depth(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM job_queue").fetchone()[0]
+
+
+class ResultStore:
+    """Interface for where job status and results are published"""
+
+    def create(self, job_id, record):
+        """Store the initial record for a new job"""
+        raise NotImplementedError
+
+    def update(self, job_id, fields):
+        """Merge fields into an existing job record"""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return the job record, or None if unknown or expired"""
+        raise NotImplementedError
+
+
+class InMemoryResultStore(ResultStore):
+    """Process-local job records, dropped ttl_seconds after creation"""
+
+    def __init__(self, ttl_seconds=JOB_RESULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job_id, record):
+        with self._lock:
+            now = time.monotonic()
+            while self._records:
+                _, (_, expires_at) = next(iter(self._records.items()))
+                if expires_at > now:
+                    break
+                self._records.popitem(last=False)
+            self._records[job_id] = (dict(record), now + self.ttl_seconds)
+
+    def update(self, job_id, fields):
+        with self._lock:
+            entry = self._records.get(job_id)
+            if entry is not None:
+                entry[0].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._records.get(job_id)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            return dict(entry[0])
+
+
+class FirestoreResultStore(ResultStore):
+    """
+    Job records as documents in a Firestore collection
+
+    Clients can listen to analysis_jobs/{jobId} instead of polling. Each
+    document carries an 'expireAt' timestamp for a Firestore TTL policy.
+    Set FIRESTORE_EMULATOR_HOST to run against the emulator.
+    """
+
+    def __init__(self, collection=JOB_COLLECTION, ttl_seconds=JOB_RESULT_TTL_SECONDS):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    def _document(self, job_id):
+        from dependencies import get_firestore
+        return get_firestore().collection(self.collection).document(job_id)
+
+    def create(self, job_id, record):
+        expire_at = datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds)
+        self._document(job_id).set(dict(record, expireAt=expire_at))
+
+    def update(self, job_id, fields):
+        self._document(job_id).update(fields)
+
+    def get(self, job_id):
+        snapshot = self._document(job_id).get()
+        if not snapshot.exists:
+            return None
+        record = snapshot.to_dict()
+        record.pop("expireAt", None)
+        return record
+
+
+class AnalysisJobs:
+    """
+    Submit-and-poll analysis jobs: records in a ResultStore, uploads in an
+    ImageStore, and a handler that runs each job once it is dispatched
+
+    Subclasses decide how a submitted job reaches run().
+    """
+
+    def __init__(self, store, images, handler):
+        self.store = store
+        self.images = images
+        self.handler = handler
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.running = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def submit(self, kwargs, image_bytes=None, user_id=None):
+        """
+        Record and dispatch an analysis job
+
+        Args:
+            kwargs (dict): JSON-serializable keyword arguments for the handler
+            image_bytes (bytes-like, optional): Raw image, kept in the image store
+                and passed to the handler as image_bytes
+            user_id (str, optional): Stored on the job record for listeners
+
+        Returns:
+            str: The new job id
+
+        Raises:
+            JobQueueFullError: If the dispatcher is at its depth limit
+        """
+        self._check_capacity()
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        image_path = self.images.put(job_id, image_bytes) if image_bytes is not None else None
+        self.store.create(job_id, {"status": "queued", "userId": user_id, "createdAt": now, "updatedAt": now})
+        try:
+            self._dispatch({"id": job_id, "kwargs": dict(kwargs, enqueued_at=now), "image_path": image_path})
+        except Exception as e:
+            self._update(job_id, {"status": "failed", "error": str(e), "updatedAt": time.time()})
+            self._delete_image(job_id, image_path)
+            raise
+        with self._lock:
+            self.submitted += 1
+        return job_id
+
+    def _check_capacity(self):
+        pass
+
+    def _dispatch(self, job):
+        raise NotImplementedError
+
+    def run(self, job):
+        """
+        Run a dispatched job and publish its outcome to the store
+
+        Redelivered jobs that already finished are skipped. Failures of the
+        analysis are recorded on the job; a failure to record the outcome is
+        raised so the dispatcher can deliver the job again.
+
+        Args:
+            job (dict): Job with 'id', 'kwargs' and optional 'image_path'
+        """
+        job_id = job["id"]
+        record = self.store.get(job_id)
+        if record is not None and record.get("status") in ("done", "failed"):
+            with self._lock:
+                self.skipped += 1
+            return
+
+        kwargs = dict(job["kwargs"])
+        enqueued_at = kwargs.pop("enqueued_at", None)
+        image_path = job.get("image_path")
+        started = time.time()
+        with self._lock:
+            self.running += 1
+            if enqueued_at is not None:
+                self.wait_seconds += started - enqueued_at
+        try:
+            self._update(job_id, {"status": "running", "updatedAt": started})
+            image_bytes = self.images.get(image_path) if image_path else None
+            payload_str, cache_status = self.handler(image_bytes=image_bytes, **kwargs)
+            result = json.loads(payload_str)
+            if isinstance(result, dict) and "error" in result:
+                # Upstream failures come back as an error payload rather than an exception
+                raise RuntimeError(str(result["error"]))
+            fields = {"status": "done", "result": result, "cache": cache_status, "updatedAt": time.time()}
+            outcome = "completed"
+        except Exception as e:
+            print(f"❌ Analysis job {job_id} failed: {str(e)}")
+            fields = {"status": "failed", "error": str(e), "updatedAt": time.time()}
+            outcome = "failed"
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_seconds += time.time() - started
+
+        self.store.update(job_id, fields)
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        self._delete_image(job_id, image_path)
+
+    def _update(self, job_id, fields):
+        # Progress updates are best effort; run() records the outcome itself
+        try:
+            self.store.update(job_id, fields)
+        except Exception as e:
+            print(f"⚠️ Analysis job {job_id} status update failed: {str(e)}")
+
+    def _delete_image(self, job_id, image_path):
+        if not image_path:
+            return
+        try:
+            self.images.delete(image_path)
+        except Exception as e:
+            print(f"⚠️ Analysis job {job_id} image cleanup failed: {str(e)}")
+
+    def stats(self):
+        """Return job counters and average queue wait and run time"""
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "completed": self.completed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "running": self.running,
+                "avg_wait_ms": self.wait_seconds * 1000 / finished if finished else 0.0,
+                "avg_run_ms": self.run_seconds * 1000 / finished if finished else 0.0,
+            }
+
+
+class CloudTasksJobs(AnalysisJobs):
+    """
+    Jobs dispatched as Cloud Tasks to the task function named function_name
+
+    Cloud Tasks holds queued jobs outside the instance, redelivers a job
+    whose attempt fails or is cut short, and its max_concurrent_dispatches
+    rate limit bounds how many analyses run at once. Set
+    CLOUD_TASKS_EMULATOR_HOST to run against the emulator.
+    """
+
+    def __init__(self, store, images, handler, function_name=JOB_TASK_FUNCTION):
+        super().__init__(store, images, handler)
+        self.function_name = function_name
+
+    def _dispatch(self, job):
+        from firebase_admin import functions
+        from dependencies import get_firebase_app
+        task_queue = functions.task_queue(self.function_name, app=get_firebase_app())
+        task_queue.enqueue(job, functions.TaskOptions(task_id=job["id"]))
+
+
+class JobWorkerPool(AnalysisJobs):
+    """
+    Bounded pool of threads draining a JobQueue, for tests and local runs
+
+    Threads start on the first submit. The queue depth limit provides
+    backpressure: submit raises JobQueueFullError instead of letting queued
+    jobs pile up. Not for deployment: Cloud Functions gives an instance no
+    CPU between requests and drops its queue on scale-down.
+    """
+
+    def __init__(self, job_queue, store, handler, images=None, workers=JOB_WORKERS, max_depth=JOB_QUEUE_MAX_DEPTH):
+        super().__init__(store, images if images is not None else InMemoryImageStore(), handler)
+        self.queue = job_queue
+        self.workers = workers
+        self.max_depth = max_depth
+        self._threads = []
+
+    def _check_capacity(self):
+        if self.queue.depth() >= self.max_depth:
+            with self._lock:
+                self.rejected += 1
+            raise JobQueueFullError(f"Job queue is full ({self.max_depth} jobs waiting)")
+
+    def _dispatch(self, job):
+        self.queue.put(job)
+        self._ensure_started()
+
+    def _ensure_started(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"analysis-job-{len(self._threads)}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self.queue.get(timeout=1.0)
+            if job is None:
+                continue
+            # A store outage must not kill the worker thread
+            try:
+                self.run(job)
+            except Exception as e:
+                print(f"⚠️ Analysis job {job['id']} status update failed: {str(e)}")
+            finally:
+                self.queue.ack(job["id"])
+
+    def stats(self):
+        """Return job counters, queue depth, worker count and average queue wait and run time"""
+        stats = super().stats()
+        stats["depth"] = self.queue.depth()
+        stats["workers"] = len(self._threads)
+        return stats
+
+
+def create_default_jobs(handler):
+    """Create the job dispatcher configured by the JOB_* environment variables"""
+    store = InMemoryResultStore() if JOB_RESULT_STORE == "memory" else FirestoreResultStore()
+    if JOB_DISPATCH == "local":
+        job_queue = SQLiteJobQueue(JOB_QUEUE_DB) if JOB_QUEUE_DB else InMemoryJobQueue()
+        return JobWorkerPool(job_queue, store, handler)
+    return CloudTasksJobs(store, CloudStorageImageStore(), handler)
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import importlib.util
+
+from instrumentation import log_debug
+from openai_helper import (
+    DEFAULT_BASE_URL,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_POOL_MAXSIZE,
+    DEFAULT_READ_TIMEOUT,
+    VISION_MODEL,
+    build_vision_payload,
+    encode_request_body,
+    load_environment,
+)
+from resilience import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    RetryPolicy,
+    parse_retry_after,
+)
+
+# Concurrency and deadline settings, overridable through environment variables
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("OPENAI_ASYNC_MAX_CONCURRENCY", "64"))
+ASYNC_REQUEST_DEADLINE = float(os.environ.get("OPENAI_REQUEST_DEADLINE", "40"))
+
+
+def async_available():
+    """Return True when aiohttp is installed and the async client can be used"""
+    return importlib.util.find_spec("aiohttp") is not None
+
+
+class AsyncVisionClient:
+    """
+    OpenAI Vision client on aiohttp for multiplexing many analyses per instance
+
+    The aiohttp session and concurrency semaphore are created on first use
+    and bound to that event loop, so use one client per loop (see
+    get_async_vision_client for the shared background loop).
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=VISION_MODEL, max_tokens=1000,
+                 pool_maxsize=None, max_concurrency=ASYNC_MAX_CONCURRENCY, deadline=ASYNC_REQUEST_DEADLINE,
+                 connect_timeout=None, read_timeout=None,
+                 retry_policy=None, retry_budget=None, circuit_breaker=None):
+        """
+        Args:
+            api_key (str, optional): OpenAI API key, defaults to OPENAI_API_KEY
+            base_url (str, optional): API base URL, e.g. a local stub server for benchmarks
+            model (str): Vision model name
+            max_tokens (int): Completion token limit
+            pool_maxsize (int): Maximum open connections to the API host
+            max_concurrency (int): Maximum analyses in flight; others wait their turn
+            deadline (float): Default seconds allowed per analysis, including the wait for a slot
+            connect_timeout (float): Seconds allowed to establish a connection
+            read_timeout (float): Seconds allowed between bytes of the response
+            retry_policy (RetryPolicy, optional): Backoff settings for retryable failures
+            retry_budget (RetryBudget, optional): Limits retries to a share of traffic
+            circuit_breaker (CircuitBreaker, optional): Fails fast while OpenAI is unhealthy
+        """
+        load_environment()
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "")
+        self.base_url = (base_url or os.environ.get("OPENAI_BASE_URL", DEFAULT_BASE_URL)).rstrip("/")
+        self.model = model
+        self.max_tokens = max_tokens
+        self.pool_maxsize = pool_maxsize or int(os.environ.get("OPENAI_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+        self.max_concurrency = max_concurrency
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout or float(os.environ.get("OPENAI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = read_timeout or float(os.environ.get("OPENAI_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))
+
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        self._session = None
+        self._semaphore = None
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.deadline_exceeded = 0
+        self.retries = 0
+        self.retries_exhausted = 0
+        self.budget_denied = 0
+
+    @property
+    def completions_url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def _get_session(self):
+        if self._session is None:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}",
+                },
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """Release pooled connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        """Return concurrency, deadline and retry counters plus circuit breaker state"""
+        return {
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "deadline_exceeded": self.deadline_exceeded,
+            "retries": self.retries,
+            "retries_exhausted": self.retries_exhausted,
+            "budget_denied": self.budget_denied,
+            "budget_tokens": self.retry_budget.tokens,
+            "breaker": self.circuit_breaker.stats(),
+        }
+
+    async def send(self, payload, image_bytes=None, image_mime_type="image/jpeg"):
+        """
+        POST a completion request through the circuit breaker and retry policy
+
+        Same retry rules as VisionClient.send, sleeping with asyncio instead
+        of blocking the thread.
+
+        Returns:
+            tuple: (HTTP status, response text) of the final attempt
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            aiohttp.ClientError or asyncio.TimeoutError: If the last attempt failed to connect or timed out
+        """
+        import aiohttp
+
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("OpenAI circuit breaker is open; failing fast")
+
+        session = self._get_session()
+        body = encode_request_body(payload, image_bytes, image_mime_type)
+        self.retry_budget.deposit()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with session.post(self.completions_url, data=body) as response:
+                    status = response.status
+                    retry_after = response.headers.get("Retry-After")
+                    text = await response.text()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.circuit_breaker.record_failure()
+                delay = self.retry_policy.delay(attempt)
+                if not self._may_retry(attempt, started, delay):
+                    raise
+                print(f"🔁 OpenAI request failed to complete, retrying in {delay:.2f}s (attempt {attempt})")
+                await asyncio.sleep(delay)
+                continue
+            except (Exception, asyncio.CancelledError):
+                # A call cancelled by its deadline counts as a failure, which
+                # also releases a half-open probe slot
+                self.circuit_breaker.record_failure()
+                raise
+
+            if status not in RETRYABLE_STATUS_CODES:
+                self.circuit_breaker.record_success()
+                return status, text
+
+            self.circuit_breaker.record_failure()
+            delay = self.retry_policy.delay(attempt, parse_retry_after(retry_after))
+            if not self._may_retry(attempt, started, delay):
+                return status, text
+            print(f"🔁 OpenAI returned {status}, retrying in {delay:.2f}s (attempt {attempt})")
+            await asyncio.sleep(delay)
+
+    def _may_retry(self, attempt, started, delay):
+        # Only touched from the client's event loop thread, so no lock is needed
+        if not self.retry_policy.can_retry(attempt, started, delay):
+            self.retries_exhausted += 1
+            return False
+        if not self.circuit_breaker.allow_request():
+            return False
+        if not self.retry_budget.try_spend():
+            self.budget_denied += 1
+            return False
+        self.retries += 1
+        return True
+
+    async def analyze(self, image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                      response_format=None, usage_callback=None, image_bytes=None, deadline=None):
+        """
+        Analyze an image using OpenAI's Vision capabilities without blocking the loop
+
+        Args:
+            image_url (str, optional): URL of the image to analyze
+            prompt (str): Instructions for the analysis
+            image_base64 (str, optional): Base64 encoded image data
+            image_mime_type (str): MIME type of the base64 image data or image bytes
+            response_format (dict, optional): OpenAI response_format, e.g. a JSON schema
+            usage_callback (callable, optional): Called with the OpenAI usage dict
+            image_bytes (bytes-like, optional): Raw image data, used instead of image_base64
+            deadline (float, optional): Seconds allowed for this analysis, defaults to the client deadline
+
+        Returns:
+            str or dict: The analysis result from OpenAI, or {"error": ...} on failure
+        """
+        import aiohttp
+
+        if not self.api_key:
+            error_msg = "OpenAI API key not configured in environment variables"
+            print(f"❌ {error_msg}")
+            return {"error": error_msg}
+        if not image_url and not image_base64 and not image_bytes:
+            return {"error": "Either image_url or image_base64 must be provided"}
+
+        payload = build_vision_payload(self.model, self.max_tokens, prompt, image_url=image_url,
+                                       image_base64=image_base64, image_mime_type=image_mime_type,
+                                       response_format=response_format, image_bytes=image_bytes)
+        deadline = deadline or self.deadline
+        try:
+            status, text = await asyncio.wait_for(
+                self._send_when_slot_free(payload, image_bytes, image_mime_type), deadline
+            )
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            error_msg = f"OpenAI API request exceeded its {deadline}s deadline"
+            print(f"❌ {error_msg}")
+            return {"error": error_msg}
+        except CircuitOpenError as e:
+            error_msg = str(e)
+            print(f"❌ {error_msg}: {self.stats()}")
+            return {"error": error_msg}
+        except aiohttp.ClientError as e:
+            error_msg = f"Failed to connect to OpenAI API - {type(e).__name__}"
+            print(f"❌ {error_msg}")
+            return {"error": error_msg}
+
+        return _completion_content(status, text, usage_callback)
+
+    async def _send_when_slot_free(self, payload, image_bytes, image_mime_type):
+        self._get_session()
+        async with self._semaphore:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await self.send(payload, image_bytes=image_bytes, image_mime_type=image_mime_type)
+            finally:
+                self.in_flight -= 1
+
+
+def _completion_content(status, text, usage_callback=None):
+    # Mirrors VisionClient.post_completion's handling of a finished response
+    print(f"📥 OpenAI API response status: {status}")
+    try:
+        result = json.loads(text)
+    except ValueError:
+        result = None
+
+    if status != 200:
+        error = result.get("error") if isinstance(result, dict) else None
+        if isinstance(error, dict):
+            return {"error": f"OpenAI API Error ({error.get('type', 'unknown')}): {error.get('message', 'Unknown error')}"}
+        return {"error": f"API call failed with status {status}: {text[:200]}"}
+
+    if not isinstance(result, dict):
+        return {"error": "OpenAI response was not valid JSON"}
+    if usage_callback is not None and result.get("usage"):
+        usage_callback(result["usage"])
+    if result.get("choices"):
+        content = result["choices"][0]["message"]["content"]
+        log_debug(f"✅ Got content from OpenAI (length: {len(content)})")
+        return content
+    return {"error": "No content in OpenAI response"}
+
+
+class BackgroundLoop:
+    """
+    An asyncio event loop running on a daemon thread
+
+    Lets the synchronous Cloud Functions handlers hand upstream I/O to one
+    shared loop, so concurrent requests on an instance are multiplexed over
+    the async client's connection pool instead of each holding a socket.
+    """
+
+    def __init__(self, name="async-vision-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """Run a coroutine on the loop and block the calling thread for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+
+_background_loop = None
+_async_client = None
+_async_lock = threading.Lock()
+
+
+def get_async_vision_client():
+    """
+    Return the per-instance BackgroundLoop and the AsyncVisionClient bound to it
+
+    Returns:
+        tuple: (BackgroundLoop, AsyncVisionClient), created on first use
+    """
+    global _background_loop, _async_client
+    if _async_client is None:
+        with _async_lock:
+            if _async_client is None:
+                _background_loop = BackgroundLoop()
+                _async_client = AsyncVisionClient()
+    return _background_loop, _async_client
+
+
+def run_image_analysis(image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                       response_format=None, usage_callback=None, image_bytes=None, deadline=None):
+    """
+    Analyze an image on the shared background loop from synchronous code
+
+    Drop-in for openai_helper.analyze_image_with_vision: the calling thread
+    waits, but the request itself shares the async client's pool and
+    concurrency limit with every other in-flight analysis on the instance.
+
+    Returns:
+        str or dict: The analysis result from OpenAI
+    """
+    background_loop, client = get_async_vision_client()
+    return background_loop.run(client.analyze(
+        image_url=image_url,
+        prompt=prompt,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        response_format=response_format,
+        usage_callback=usage_callback,
+        image_bytes=image_bytes,
+        deadline=deadline
+    ))
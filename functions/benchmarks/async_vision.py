@@ -0,0 +1,122 @@
+"""
+Compare sync and async vision client throughput against a local stub
+
+The sync client is driven by one thread per concurrent request, the way
+threaded request handlers use it; the async client by the same number of
+worker tasks on one event loop. In both modes a worker takes the next
+request when it is free and its latency is timed from that pickup, so the
+percentiles compare like with like. Both send the same payload to a stub
+upstream that answers after a fixed latency, so the difference is how many
+analyses one instance keeps in flight.
+
+Usage:
+    python benchmarks/async_vision.py --requests 200 --concurrency 1 16 64 --latency 0.5
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, FUNCTIONS_DIR)
+
+from openai_helper import VisionClient  # noqa: E402
+from async_openai_helper import AsyncVisionClient  # noqa: E402
+
+PROMPT = "Analyze this meal image and return nutritional information as JSON."
+IMAGE_URL = "https://example.com/meal.jpg"
+API_KEY = "sk-benchmark-" + "x" * 32
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _report(latencies, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+    }
+
+
+def run_sync(base_url, requests, concurrency):
+    client = VisionClient(api_key=API_KEY, base_url=base_url, pool_maxsize=concurrency)
+
+    def one(_):
+        started = time.perf_counter()
+        result = client.analyze(image_url=IMAGE_URL, prompt=PROMPT)
+        return time.perf_counter() - started, isinstance(result, dict)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    client.close()
+    return _report([o[0] for o in outcomes], sum(o[1] for o in outcomes), elapsed)
+
+
+async def _run_async(base_url, requests, concurrency):
+    client = AsyncVisionClient(api_key=API_KEY, base_url=base_url, pool_maxsize=concurrency,
+                               max_concurrency=concurrency)
+
+    remaining = iter(range(requests))
+    outcomes = []
+
+    async def worker():
+        # Like a pool thread: take the next request and time it from pickup
+        for _ in remaining:
+            started = time.perf_counter()
+            result = await client.analyze(image_url=IMAGE_URL, prompt=PROMPT)
+            outcomes.append((time.perf_counter() - started, isinstance(result, dict)))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    return _report([o[0] for o in outcomes], sum(o[1] for o in outcomes), elapsed)
+
+
+def run_async(base_url, requests, concurrency):
+    return asyncio.run(_run_async(base_url, requests, concurrency))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--latency", type=float, default=0.5, help="Stub upstream latency in seconds")
+    parser.add_argument("--port", type=int, default=8901)
+    args = parser.parse_args()
+
+    # The stub runs in its own process so it does not compete for the GIL
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(FUNCTIONS_DIR, "benchmarks", "stub_openai.py"),
+         "--port", str(args.port), "--latency", str(args.latency)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        stub.stdout.readline()
+        base_url = f"http://127.0.0.1:{args.port}/v1"
+        results = []
+        for concurrency in args.concurrency:
+            for mode, run in (("sync", run_sync), ("async", run_async)):
+                result = run(base_url, args.requests, concurrency)
+                results.append({"mode": mode, "concurrency": concurrency, **result})
+                print(f"{mode:5} concurrency={concurrency:<4} {result['requests_per_second']:.1f} req/s", file=sys.stderr)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print(json.dumps({"latency_s": args.latency, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cold-start benchmark for the Cloud Functions entry points
+
+Each run starts a fresh interpreter, imports main and performs the first-use
+initialization of one entry point, so module-level work shows up the same
+way it does on a new Cloud Functions instance.
+
+Usage:
+    python benchmarks/cold_start.py --repeats 10
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Code run in the child after `import main` to trigger each entry point's lazy setup
+ENTRY_POINTS = {
+    "analyze_meal_image": "main.get_vision_client(); import image_preprocess; image_preprocess.preprocessing_available()",
+    "create_payment_intent": "main.get_stripe()",
+    "functions_metrics": "pass",
+}
+
+CHILD_TEMPLATE = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+{first_use}
+finished = time.perf_counter()
+print("COLD_START", imported - started, finished - started)
+"""
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_once(entry_point, env):
+    """Return (import_seconds, total_seconds) for one fresh process"""
+    code = CHILD_TEMPLATE.format(first_use=ENTRY_POINTS[entry_point])
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith("COLD_START "):
+            _, import_seconds, total_seconds = line.split()
+            return float(import_seconds), float(total_seconds)
+    raise RuntimeError(f"No timing line from {entry_point}: {completed.stderr[-500:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--entry-point", choices=sorted(ENTRY_POINTS), action="append")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # The clients only need syntactically valid keys to initialize
+    env.setdefault("STRIPE_SECRET_KEY", "sk_test_cold_start_benchmark")
+    env.setdefault("OPENAI_API_KEY", "sk-cold-start-benchmark")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    results = {}
+    for entry_point in args.entry_point or sorted(ENTRY_POINTS):
+        runs = [run_once(entry_point, env) for _ in range(args.repeats)]
+        imports_ms = [run[0] * 1000 for run in runs]
+        totals_ms = [run[1] * 1000 for run in runs]
+        results[entry_point] = {
+            "repeats": args.repeats,
+            "import_median_ms": statistics.median(imports_ms),
+            "total_median_ms": statistics.median(totals_ms),
+            "total_p95_ms": _percentile(totals_ms, 0.95),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
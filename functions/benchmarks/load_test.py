@@ -0,0 +1,279 @@
+"""
+Drive analyze_meal_image and create_payment_intent against local stub upstreams
+
+Starts the OpenAI and Stripe stubs in their own processes, points the
+handlers at them and calls the handlers in-process through a Flask test
+client from a pool of threads. Prints one JSON document with throughput,
+latency percentiles, memory high-water mark and parse outcomes, suitable
+for diffing between versions.
+
+Usage:
+    python benchmarks/load_test.py --target analyze --requests 500 --concurrency 16 \\
+        --openai-latency 0.5 --malformed-rate 0.1 --output before.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import threading
+import contextlib
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+# Bearer tokens with this prefix are accepted as the uid they spell out
+BENCHMARK_TOKEN_PREFIX = "benchmark-user-"
+
+
+def _percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_stub(script, port, *args):
+    # Stubs run in separate processes so they do not compete with the handlers for the GIL
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, script), "--port", str(port), *map(str, args)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    process.stdout.readline()
+    return process
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=FUNCTIONS_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_image(edge):
+    """Return a JPEG of roughly photo-like entropy, or placeholder bytes without Pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + os.urandom(edge * edge // 4) + b"\xff\xd9"
+    output = io.BytesIO()
+    Image.effect_noise((edge, edge), 64).convert("RGB").save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class LoadTest:
+    """Builds requests for each target and records per-request outcomes"""
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.image = sample_image(args.image_edge) if args.image_mode != "url" else None
+        self._clients = threading.local()
+
+    def client(self):
+        if not hasattr(self._clients, "client"):
+            self._clients.client = self.app.test_client()
+        return self._clients.client
+
+    def analyze_request(self, index):
+        image_id = index % self.args.distinct_images
+        if self.args.image_mode == "url":
+            return {"path": "/analyze_meal_image", "json": {"image_url": f"https://example.com/meals/{image_id}.jpg"}}
+        # Bytes after the JPEG end marker are ignored by decoders but make each image distinct for the cache
+        image = self.image + image_id.to_bytes(4, "big")
+        if self.args.image_mode == "binary":
+            return {"path": "/analyze_meal_image", "data": image, "content_type": "image/jpeg"}
+        import base64
+        return {"path": "/analyze_meal_image", "json": {"image_base64": base64.b64encode(image).decode("ascii")}}
+
+    def payment_request(self, index):
+        # Requests sharing a nonce model a client retrying the same checkout
+        checkout = index % self.args.distinct_payments
+        return {"path": "/create_payment_intent",
+                "headers": {"Authorization": f"Bearer {BENCHMARK_TOKEN_PREFIX}{checkout % 10}"},
+                "json": {"data": {"amount": 1000 + checkout % 50, "currency": "usd", "nonce": f"checkout-{checkout}"}}}
+
+    def run_one(self, target, index):
+        build = self.analyze_request if target == "analyze" else self.payment_request
+        request = build(index)
+        path = request.pop("path")
+        started = time.perf_counter()
+        response = self.client().post(path, **request)
+        elapsed = time.perf_counter() - started
+        try:
+            body = json.loads(response.get_data())
+        except ValueError:
+            body = None
+        if target == "analyze":
+            ok = response.status_code == 200 and isinstance(body, dict) and "error" not in body
+        else:
+            ok = response.status_code == 200 and isinstance(body, dict) and "result" in body
+        return target, elapsed, ok
+
+
+def accept_benchmark_tokens():
+    """Treat benchmark bearer tokens as signed-in users, since there is no Auth emulator here"""
+    from firebase_functions.private import util
+
+    verify_id_token = util._auth.verify_id_token
+
+    def verify(token, *args, **kwargs):
+        if token.startswith(BENCHMARK_TOKEN_PREFIX):
+            return {"uid": token}
+        return verify_id_token(token, *args, **kwargs)
+
+    util._auth.verify_id_token = verify
+
+
+def build_app(main):
+    """Expose the handlers on a Flask app, as the Functions emulator does"""
+    import flask
+
+    app = flask.Flask("meal_tracker_benchmark")
+    app.add_url_rule("/analyze_meal_image", "analyze_meal_image",
+                     lambda: main.analyze_meal_image(flask.request), methods=["POST"])
+    app.add_url_rule("/create_payment_intent", "create_payment_intent",
+                     lambda: main.create_payment_intent(flask.request), methods=["POST"])
+    return app
+
+
+def summarize(outcomes, elapsed):
+    latencies = [outcome[1] for outcome in outcomes]
+    errors = sum(1 for outcome in outcomes if not outcome[2])
+    return {
+        "requests": len(outcomes),
+        "errors": errors,
+        "error_rate": errors / len(outcomes) if outcomes else 0.0,
+        "throughput_rps": len(outcomes) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "mean": sum(latencies) * 1000 / len(latencies) if latencies else 0.0,
+            "p50": _percentile(latencies, 0.50) * 1000,
+            "p90": _percentile(latencies, 0.90) * 1000,
+            "p95": _percentile(latencies, 0.95) * 1000,
+            "p99": _percentile(latencies, 0.99) * 1000,
+            "max": max(latencies) * 1000 if latencies else 0.0,
+        },
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--target", choices=["analyze", "payment", "both"], default="both")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per target")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests per target before the run")
+    parser.add_argument("--image-mode", choices=["url", "base64", "binary"], default="url")
+    parser.add_argument("--image-edge", type=int, default=1600, help="Pixel edge of the generated test image")
+    parser.add_argument("--distinct-images", type=int, default=None,
+                        help="Distinct images to cycle through; defaults to one per request (no cache hits)")
+    parser.add_argument("--openai-latency", type=float, default=0.5)
+    parser.add_argument("--openai-jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="OpenAI stub error rate")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="OpenAI stub malformed-JSON rate")
+    parser.add_argument("--distinct-payments", type=int, default=None,
+                        help="Distinct checkout nonces to cycle through; defaults to one per request (no retries)")
+    parser.add_argument("--stripe-latency", type=float, default=0.3)
+    parser.add_argument("--stripe-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also report the Python heap peak via tracemalloc (slows the run)")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.distinct_images is None:
+        args.distinct_images = args.requests + args.warmup
+    if args.distinct_payments is None:
+        args.distinct_payments = args.requests + args.warmup
+    return args
+
+
+def main():
+    args = parse_args()
+    openai_port, stripe_port = _free_port(), _free_port()
+    stubs = [
+        _start_stub("stub_openai.py", openai_port, "--latency", args.openai_latency, "--jitter", args.openai_jitter,
+                    "--error-rate", args.error_rate, "--malformed-rate", args.malformed_rate, "--seed", args.seed),
+        _start_stub("stub_stripe.py", stripe_port, "--latency", args.stripe_latency,
+                    "--error-rate", args.stripe_error_rate, "--seed", args.seed),
+    ]
+
+    # Never send real credentials anywhere, even to the local stubs
+    os.environ.update(
+        OPENAI_API_KEY="sk-benchmark-" + "x" * 32,
+        OPENAI_BASE_URL=f"http://127.0.0.1:{openai_port}/v1",
+        STRIPE_SECRET_KEY="sk_test_benchmark",
+        STRIPE_API_BASE=f"http://127.0.0.1:{stripe_port}",
+    )
+    sys.path.insert(0, FUNCTIONS_DIR)
+    real_stdout = sys.stdout
+    targets = ["analyze", "payment"] if args.target == "both" else [args.target]
+    try:
+        # The handlers print per request; keep that cost but not the noise
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            baseline_rss = _max_rss_mb()
+            import main as functions_main
+            accept_benchmark_tokens()
+            load_test = LoadTest(build_app(functions_main), args)
+
+            for target in targets:
+                for index in range(args.warmup):
+                    load_test.run_one(target, args.requests + index)
+
+            if args.trace_memory:
+                tracemalloc.start()
+            results = {}
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                for target in targets:
+                    started = time.perf_counter()
+                    outcomes = list(executor.map(lambda index: load_test.run_one(target, index), range(args.requests)))
+                    results[target] = summarize(outcomes, time.perf_counter() - started)
+            heap_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+            if args.trace_memory:
+                tracemalloc.stop()
+
+            metrics_snapshot = functions_main.metrics.snapshot()
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+
+    report = {
+        "revision": _git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+        "memory": {
+            "baseline_rss_mb": baseline_rss,
+            "max_rss_mb": _max_rss_mb(),
+            "python_heap_peak_mb": heap_peak / (1024 * 1024) if heap_peak is not None else None,
+        },
+        "parse": metrics_snapshot["collectors"].get("parse", {}),
+        "payment_intents": metrics_snapshot["collectors"].get("payment_intents", {}),
+        "stages": metrics_snapshot["stages"],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        real_stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
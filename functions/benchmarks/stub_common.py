@@ -0,0 +1,83 @@
+"""Shared HTTP server plumbing for the local stub upstreams"""
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops SYNs when a client opens many
+    # connections at once, showing up as one-second connect stalls
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Keep-alive JSON handler with the knobs every stub shares"""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # client's delayed ACK adds ~40 ms to every keep-alive response
+    disable_nagle_algorithm = True
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    rng = random.Random()
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def delay(self):
+        """Seconds to wait before answering: latency plus uniform jitter"""
+        return max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+
+    def should_fail(self):
+        return self.rng.random() < self.error_rate
+
+    def send_bytes(self, status, body, content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(handler_class, port=0, seed=None, **settings):
+    """
+    Serve a stub handler on a background thread
+
+    Args:
+        handler_class (type): StubHandler subclass to serve
+        port (int): Port to bind on 127.0.0.1, 0 for any free port
+        seed (int, optional): Seed for the latency, error and malformed-output draws
+        **settings: Class attributes to override, e.g. latency=0.5
+
+    Returns:
+        StubServer: The running server
+    """
+    settings["rng"] = random.Random(seed)
+    handler = type(f"Configured{handler_class.__name__}", (handler_class,), settings)
+    server = StubServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_common_arguments(parser, default_port, default_latency):
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--latency", type=float, default=default_latency, help="Seconds to wait before answering")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def serve_forever(server, name):
+    """Announce the server on stdout, then block until interrupted"""
+    print(f"{name} listening on http://127.0.0.1:{server.server_port}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,118 @@
+"""
+Local stand-in for the OpenAI chat completions endpoint
+
+Replays recorded vision completions with configurable latency, error rate
+and malformed-JSON rate, so client and handler throughput can be measured
+without calling OpenAI. Streaming requests are answered as server-sent
+events.
+
+Usage:
+    python benchmarks/stub_openai.py --port 8900 --latency 0.5 --error-rate 0.05 --malformed-rate 0.1
+"""
+import os
+import json
+import time
+import argparse
+import threading
+
+from stub_common import StubHandler, add_common_arguments, serve_forever, start_stub
+
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recordings", "vision_completions.jsonl")
+
+
+def load_recordings(path=DEFAULT_RECORDINGS):
+    """
+    Load recorded completions
+
+    Each JSONL line holds {"analysis": {...}, "usage": {...}}; the analysis
+    is what the model returned as message content.
+
+    Returns:
+        list: (content string, usage dict) pairs
+    """
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [(json.dumps(record["analysis"], ensure_ascii=False), record.get("usage", {})) for record in records]
+
+
+class StubOpenAIHandler(StubHandler):
+    recordings = []
+    malformed_rate = 0.0
+    _counter = 0
+    _counter_lock = threading.Lock()
+
+    def do_POST(self):
+        request = json.loads(self.read_body() or b"{}")
+        time.sleep(self.delay())
+
+        if self.should_fail():
+            # Alternate rate limiting and server errors, as OpenAI does under load
+            status = 429 if self.rng.random() < 0.5 else 500
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            body = json.dumps({"error": {"type": error_type, "message": "Stub upstream error", "code": status}})
+            self.send_bytes(status, body.encode("utf-8"))
+            return
+
+        content, usage = self.next_recording()
+        if self.rng.random() < self.malformed_rate:
+            # Cut the JSON off part-way, like a completion that hit max_tokens
+            content = content[: self.rng.randint(1, max(1, len(content) - 1))]
+
+        if request.get("stream"):
+            self.stream_content(content, usage)
+            return
+
+        body = json.dumps({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }, ensure_ascii=False)
+        self.send_bytes(200, body.encode("utf-8"))
+
+    def next_recording(self):
+        with self._counter_lock:
+            index = StubOpenAIHandler._counter
+            StubOpenAIHandler._counter += 1
+        return self.recordings[index % len(self.recordings)]
+
+    def stream_content(self, content, usage, chunk_size=16):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for start in range(0, len(content), chunk_size):
+            event = {"choices": [{"index": 0, "delta": {"content": content[start:start + chunk_size]}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def start_stub_server(port=0, latency=0.0, jitter=0.0, error_rate=0.0, malformed_rate=0.0,
+                      recordings_path=DEFAULT_RECORDINGS, seed=None):
+    """
+    Serve the OpenAI stub on a background thread
+
+    Returns:
+        StubServer: The running server; its base URL is
+        http://127.0.0.1:<server_port>/v1
+    """
+    return start_stub(StubOpenAIHandler, port=port, seed=seed, latency=latency, jitter=jitter,
+                      error_rate=error_rate, malformed_rate=malformed_rate,
+                      recordings=load_recordings(recordings_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_common_arguments(parser, default_port=8900, default_latency=0.5)
+    parser.add_argument("--malformed-rate", type=float, default=0.0,
+                        help="Fraction of completions whose JSON content is truncated")
+    parser.add_argument("--recordings", default=DEFAULT_RECORDINGS, help="JSONL file of recorded completions")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port, args.latency, args.jitter, args.error_rate, args.malformed_rate,
+                               args.recordings, args.seed)
+    serve_forever(server, "Stub OpenAI")
+
+
+if __name__ == "__main__":
+    main()
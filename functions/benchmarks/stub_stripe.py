@@ -0,0 +1,89 @@
+"""
+Local stand-in for the Stripe PaymentIntents API
+
+Answers POST /v1/payment_intents like Stripe test mode, honoring the
+Idempotency-Key header, with configurable latency and error rate. Point the
+stripe library at it with stripe.api_base = "http://127.0.0.1:<port>".
+
+Usage:
+    python benchmarks/stub_stripe.py --port 8910 --latency 0.3
+"""
+import json
+import time
+import uuid
+import argparse
+import threading
+from urllib.parse import parse_qs
+
+from stub_common import StubHandler, add_common_arguments, serve_forever, start_stub
+
+
+class StubStripeHandler(StubHandler):
+    _idempotent_responses = {}
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        form = {key: values[0] for key, values in parse_qs(self.read_body().decode("utf-8")).items()}
+        time.sleep(self.delay())
+
+        if not self.path.startswith("/v1/payment_intents"):
+            self.send_error_body(404, "invalid_request_error", f"Unrecognized request URL (POST: {self.path})")
+            return
+        if self.should_fail():
+            self.send_error_body(500, "api_error", "Stub Stripe error")
+            return
+
+        idempotency_key = self.headers.get("Idempotency-Key")
+        with self._lock:
+            body = self._idempotent_responses.get(idempotency_key) if idempotency_key else None
+            replayed = body is not None
+            if body is None:
+                body = json.dumps(self.payment_intent(form)).encode("utf-8")
+                if idempotency_key:
+                    self._idempotent_responses[idempotency_key] = body
+        headers = {"Request-Id": f"req_{uuid.uuid4().hex[:14]}"}
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+        self.send_bytes(200, body, headers=headers)
+
+    @staticmethod
+    def payment_intent(form):
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        return {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(form.get("amount", 0)),
+            "currency": form.get("currency", "usd"),
+            "automatic_payment_methods": {"enabled": form.get("automatic_payment_methods[enabled]") == "true"},
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:24]}",
+            "created": int(time.time()),
+            "livemode": False,
+            "status": "requires_payment_method",
+        }
+
+    def send_error_body(self, status, error_type, message):
+        body = json.dumps({"error": {"type": error_type, "message": message}}).encode("utf-8")
+        self.send_bytes(status, body)
+
+
+def start_stub_server(port=0, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+    """
+    Serve the Stripe stub on a background thread
+
+    Returns:
+        StubServer: The running server; use http://127.0.0.1:<server_port> as stripe.api_base
+    """
+    return start_stub(StubStripeHandler, port=port, seed=seed, latency=latency, jitter=jitter, error_rate=error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_common_arguments(parser, default_port=8910, default_latency=0.3)
+    args = parser.parse_args()
+
+    server = start_stub_server(args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    serve_forever(server, "Stub Stripe")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import threading
+
+# Stripe HTTP settings: one pooled session for all calls, with the SDK's
+# own retries (which reuse the request's idempotency key) for network errors
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get('STRIPE_MAX_NETWORK_RETRIES', '2'))
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get('STRIPE_CONNECT_TIMEOUT', '5'))
+STRIPE_READ_TIMEOUT = float(os.environ.get('STRIPE_READ_TIMEOUT', '20'))
+STRIPE_POOL_MAXSIZE = int(os.environ.get('STRIPE_POOL_MAXSIZE', '10'))
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', '')
+
+# Bucket for queued job uploads; empty uses the app's default storageBucket
+STORAGE_BUCKET = os.environ.get('STORAGE_BUCKET', '')
+
+# Heavy SDKs are imported and configured on first use so each entry point
+# only pays for what its code path touches on a cold start
+_lock = threading.Lock()
+_firebase_app = None
+_stripe = None
+_firestore = None
+_storage_bucket = None
+
+
+def get_firebase_app():
+    """Return the default Firebase app, initializing it if no one has yet"""
+    global _firebase_app
+    if _firebase_app is None:
+        with _lock:
+            if _firebase_app is None:
+                import firebase_admin
+                try:
+                    _firebase_app = firebase_admin.get_app()
+                except ValueError:
+                    _firebase_app = firebase_admin.initialize_app()
+    return _firebase_app
+
+
+def get_firestore():
+    """Return a Firestore client for the default app; honors FIRESTORE_EMULATOR_HOST"""
+    global _firestore
+    if _firestore is None:
+        app = get_firebase_app()
+        with _lock:
+            if _firestore is None:
+                from firebase_admin import firestore
+                _firestore = firestore.client(app)
+    return _firestore
+
+
+def get_storage_bucket():
+    """Return the Cloud Storage bucket for the default app; honors STORAGE_EMULATOR_HOST"""
+    global _storage_bucket
+    if _storage_bucket is None:
+        app = get_firebase_app()
+        with _lock:
+            if _storage_bucket is None:
+                from firebase_admin import storage
+                _storage_bucket = storage.bucket(STORAGE_BUCKET or None, app=app)
+    return _storage_bucket
+
+
+def get_stripe():
+    """
+    Return the configured stripe module, importing it on first use
+
+    Raises:
+        ValueError: If STRIPE_SECRET_KEY is not set
+    """
+    global _stripe
+    if _stripe is None:
+        with _lock:
+            if _stripe is None:
+                # For Firebase Functions, you can also use: functions_config.get('stripe.secret_key')
+                stripe_key = os.environ.get('STRIPE_SECRET_KEY')
+                if not stripe_key:
+                    raise ValueError("STRIPE_SECRET_KEY environment variable is required")
+                import stripe
+                import requests
+                from requests.adapters import HTTPAdapter
+                stripe.api_key = stripe_key
+                stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_maxsize=STRIPE_POOL_MAXSIZE, max_retries=0))
+                session.mount('http://', HTTPAdapter(pool_maxsize=STRIPE_POOL_MAXSIZE, max_retries=0))
+                stripe.default_http_client = stripe.RequestsClient(
+                    timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT), session=session
+                )
+                if STRIPE_API_BASE:
+                    stripe.api_base = STRIPE_API_BASE
+                print(f"🔑 Stripe API key configured: {stripe_key[:12]}...")
+                _stripe = stripe
+    return _stripe
@@ -0,0 +1,208 @@
+import io
+import os
+import time
+import base64
+import binascii
+import requests
+
+# Preprocessing settings, overridable through environment variables
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", "1024"))
+IMAGE_QUALITY = int(os.environ.get("IMAGE_QUALITY", "80"))
+IMAGE_FORMAT = os.environ.get("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_FETCH_URLS = os.environ.get("IMAGE_FETCH_URLS", "false").lower() in ("1", "true", "yes")
+IMAGE_FETCH_MAX_BYTES = int(os.environ.get("IMAGE_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("IMAGE_FETCH_TIMEOUT", "10"))
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# Leading bytes of the upload formats the vision API accepts
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+# Session reused for fetching image_url inputs
+_fetch_session = requests.Session()
+
+# Pillow is optional and imported on first use: without it images are
+# forwarded unchanged
+_pil_modules = None
+
+
+def _pil():
+    """Return (Image, ImageOps), or (None, None) when Pillow is not installed"""
+    global _pil_modules
+    if _pil_modules is None:
+        try:
+            from PIL import Image, ImageOps
+            _pil_modules = (Image, ImageOps)
+        except ImportError:  # pragma: no cover - depends on deployment
+            _pil_modules = (None, None)
+    return _pil_modules
+
+
+def preprocessing_available():
+    """Return True when Pillow is installed and images can be re-encoded"""
+    return _pil()[0] is not None
+
+
+def sniff_image_mime(image_bytes):
+    """
+    Identify an image format from its leading bytes without copying the buffer
+
+    Args:
+        image_bytes (bytes-like): Encoded image
+
+    Returns:
+        str or None: MIME type, or None if the format is not recognized
+    """
+    head = bytes(memoryview(image_bytes)[:12])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def shrink_image_bytes(image_bytes, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_QUALITY, image_format=IMAGE_FORMAT,
+                       original_mime_type="image/jpeg"):
+    """
+    Downscale and re-encode an image, dropping EXIF and other metadata
+
+    Args:
+        image_bytes (bytes-like): Original encoded image
+        max_edge (int): Maximum length in pixels of the longest edge
+        quality (int): Target encoder quality (1-95)
+        image_format (str): 'JPEG' or 'WEBP'
+        original_mime_type (str): MIME type reported when the original is kept
+
+    Returns:
+        tuple: (encoded bytes, MIME type). The original bytes are returned
+        when Pillow is missing, decoding fails, or re-encoding would not make
+        the image smaller.
+    """
+    Image, ImageOps = _pil()
+    if Image is None:
+        return image_bytes, original_mime_type
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Apply the EXIF orientation before the metadata is discarded
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            output = io.BytesIO()
+            image.save(output, format=image_format, quality=quality, optimize=True)
+            shrunk = output.getvalue()
+    except Exception as e:
+        print(f"⚠️ Image preprocessing skipped: {str(e)}")
+        return image_bytes, original_mime_type
+
+    if len(shrunk) >= len(image_bytes):
+        return image_bytes, original_mime_type
+    return shrunk, MIME_TYPES.get(image_format, "image/jpeg")
+
+
+def preprocess_base64_image(image_base64):
+    """
+    Shrink a base64 encoded image before it is sent to the vision API
+
+    Args:
+        image_base64 (str): Base64 encoded image data from the client
+
+    Returns:
+        tuple: (base64 string, MIME type)
+    """
+    if not preprocessing_available():
+        return image_base64, "image/jpeg"
+
+    started = time.perf_counter()
+    try:
+        image_bytes = base64.b64decode(image_base64, validate=False)
+    except (binascii.Error, ValueError) as e:
+        print(f"⚠️ Could not decode base64 image, forwarding as-is: {str(e)}")
+        return image_base64, "image/jpeg"
+
+    shrunk, mime_type = shrink_image_bytes(image_bytes)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"🗜️ Image preprocessed: {len(image_bytes)} -> {len(shrunk)} bytes ({mime_type}, {elapsed_ms:.1f} ms)")
+
+    if shrunk is image_bytes:
+        return image_base64, mime_type
+    return base64.b64encode(shrunk).decode("ascii"), mime_type
+
+
+def preprocess_image_bytes(image_bytes, mime_type="image/jpeg"):
+    """
+    Shrink raw uploaded image bytes before they are sent to the vision API
+
+    Args:
+        image_bytes (bytes-like): Encoded image from a binary upload
+        mime_type (str): MIME type of the upload
+
+    Returns:
+        tuple: (bytes-like, MIME type); the input buffer itself when it is kept
+    """
+    if not preprocessing_available():
+        return image_bytes, mime_type
+
+    started = time.perf_counter()
+    shrunk, shrunk_mime_type = shrink_image_bytes(image_bytes, original_mime_type=mime_type)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"🗜️ Image preprocessed: {len(image_bytes)} -> {len(shrunk)} bytes ({shrunk_mime_type}, {elapsed_ms:.1f} ms)")
+    return shrunk, shrunk_mime_type
+
+
+def fetch_and_preprocess_url(image_url):
+    """
+    Download an image URL and shrink it so it can be sent inline
+
+    Args:
+        image_url (str): http(s) URL of the image
+
+    Redirects are not followed, so a URL that passed validation cannot lead
+    the fetch to another scheme or host; redirected URLs are forwarded.
+
+    Returns:
+        tuple or None: (image bytes, MIME type), or None if the image could
+        not be fetched or is not a recognized image format and the URL
+        should be forwarded unchanged
+    """
+    if not preprocessing_available():
+        return None
+
+    started = time.perf_counter()
+    try:
+        with _fetch_session.get(image_url, stream=True, timeout=IMAGE_FETCH_TIMEOUT,
+                                allow_redirects=False) as response:
+            response.raise_for_status()
+            if response.is_redirect:
+                print(f"⚠️ Image URL redirects (HTTP {response.status_code}), forwarding URL instead")
+                return None
+            chunks = []
+            size = 0
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if size > IMAGE_FETCH_MAX_BYTES:
+                    print(f"⚠️ Image at URL exceeds {IMAGE_FETCH_MAX_BYTES} bytes, forwarding URL instead")
+                    return None
+                chunks.append(chunk)
+        image_bytes = b"".join(chunks)
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️ Could not fetch image URL, forwarding URL instead: {str(e)}")
+        return None
+
+    original_mime_type = sniff_image_mime(image_bytes)
+    if original_mime_type is None:
+        print("⚠️ Image URL did not return a recognized image format, forwarding URL instead")
+        return None
+
+    shrunk, mime_type = shrink_image_bytes(image_bytes, original_mime_type=original_mime_type)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"🗜️ Image URL fetched and preprocessed: {len(image_bytes)} -> {len(shrunk)} bytes ({mime_type}, {elapsed_ms:.1f} ms)")
+    return shrunk, mime_type
@@ -0,0 +1,184 @@
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# LOG_LEVEL=DEBUG enables verbose payload dumps; the default keeps the hot path quiet
+LOG_LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get("LOG_LEVEL", "INFO").upper(), 20)
+
+# Latency histogram buckets in seconds, matching typical Prometheus defaults
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Recent samples kept per stage for percentile estimates
+SAMPLE_WINDOW = int(os.environ.get("METRICS_SAMPLE_WINDOW", "1024"))
+
+
+def debug_enabled():
+    return LOG_LEVEL <= LOG_LEVELS["DEBUG"]
+
+
+def log_debug(message):
+    """Print a verbose diagnostic only when LOG_LEVEL is DEBUG"""
+    if LOG_LEVEL <= LOG_LEVELS["DEBUG"]:
+        print(message)
+
+
+def log_json(event, **fields):
+    """Write one structured JSON log line, which Cloud Logging parses as jsonPayload"""
+    if LOG_LEVEL <= LOG_LEVELS["INFO"]:
+        sys.stdout.write(json.dumps({"event": event, **fields}, default=str) + "\n")
+
+
+def _percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+class Histogram:
+    """Cumulative bucket counts plus a window of recent samples for percentiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=SAMPLE_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "p50": _percentile(ordered, 0.50),
+            "p95": _percentile(ordered, 0.95),
+            "p99": _percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0,
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and per-stage latency histograms
+
+    Stats objects that already keep their own counters (caches, breakers)
+    are exported through collectors instead of being duplicated here.
+    """
+
+    def __init__(self, prefix="meal_tracker"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the enclosed block as one observation of stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def register_collector(self, name, collect):
+        """Export a callable returning a (possibly nested) dict of numeric stats"""
+        with self._lock:
+            self._collectors[name] = collect
+
+    def snapshot(self):
+        """Return counters, per-stage percentiles in milliseconds and collector output"""
+        with self._lock:
+            counters = dict(self._counters)
+            stages = {}
+            for stage, histogram in self._histograms.items():
+                summary = histogram.summary()
+                stages[stage] = {
+                    "count": summary["count"],
+                    "p50_ms": summary["p50"] * 1000,
+                    "p95_ms": summary["p95"] * 1000,
+                    "p99_ms": summary["p99"] * 1000,
+                    "max_ms": summary["max"] * 1000,
+                }
+            collectors = dict(self._collectors)
+        return {
+            "counters": counters,
+            "stages": stages,
+            "collectors": {name: _safe_collect(collect) for name, collect in collectors.items()},
+        }
+
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, value in sorted(self._counters.items()):
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                lines.append(f"{metric} {value}")
+
+            metric = f"{self.prefix}_stage_duration_seconds"
+            if self._histograms:
+                lines.append(f"# TYPE {metric} histogram")
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+            collectors = dict(self._collectors)
+
+        for name, collect in sorted(collectors.items()):
+            for key, value in _flatten(_safe_collect(collect)):
+                lines.append(f"{self.prefix}_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _safe_collect(collect):
+    try:
+        return collect()
+    except Exception as e:
+        return {"collect_error": str(e)}
+
+
+def _flatten(stats, prefix=""):
+    # Yield (metric_suffix, value) for numeric leaves; strings such as a
+    # breaker state become a labelled info-style gauge
+    for key, value in stats.items():
+        name = re.sub(r"[^a-zA-Z0-9_]", "_", f"{prefix}{key}")
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{name}_")
+        elif isinstance(value, bool):
+            yield name, int(value)
+        elif isinstance(value, (int, float)):
+            yield name, value
+        elif isinstance(value, str):
+            yield f'{name}{{value="{value}"}}', 1
+
+
+metrics = MetricsRegistry()
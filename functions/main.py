@@ -2,197 +2,711 @@
 # To get started, simply uncomment the below code or create your own.
 # Deploy with `firebase deploy`
 
-from firebase_functions import https_fn
-from firebase_admin import initialize_app
+from firebase_functions import https_fn, tasks_fn
+from firebase_functions.options import RateLimits, RetryConfig
 import json
 import time
-import stripe
 import os
+import base64
+import binascii
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor, wait
+from werkzeug.exceptions import RequestEntityTooLarge
 
-# Initialize Firebase app
-app = initialize_app()
+# Stripe and the OpenAI client are initialized lazily on first use (see
+# dependencies.py and openai_helper.get_vision_client). The default Firebase
+# app is created at import: firebase_functions verifies callable ID tokens
+# with firebase_admin.auth before any handler code runs, and that needs it.
+from dependencies import get_firebase_app, get_stripe
 
-# Initialize Stripe with your secret key from environment variable
-# For Firebase Functions, you can also use: functions_config.get('stripe.secret_key')
-stripe_key = os.environ.get('STRIPE_SECRET_KEY')
-if not stripe_key:
-    raise ValueError("STRIPE_SECRET_KEY environment variable is required")
-stripe.api_key = stripe_key
-print(f"🔑 Stripe API key configured: {stripe_key[:12]}...")
+get_firebase_app()
 
 # Import our custom helper module
-from openai_helper import analyze_image_with_vision
+from openai_helper import (
+    VISION_MODEL,
+    analyze_image_with_vision,
+    get_vision_client,
+    repair_analysis_output,
+    stream_image_analysis,
+)
+from async_openai_helper import async_available, get_async_vision_client, run_image_analysis
+from stream_json import IncrementalObjectParser
+from meal_schema import MealAnalysis, MealAnalysisValidationError, decode_meal_analysis, parse_metrics
+from prompts import get_prompt_variant, prompt_usage, valid_locales
+from result_cache import AnalysisCache, create_default_cache, make_cache_key
+from single_flight import SingleFlight
+from perceptual_hash import PHASH_ENABLED, NearDuplicateIndex, phash
+from nutrient_index import get_nutrient_index
+from meal_text import estimate_meal
+from analysis_jobs import JOB_MAX_ATTEMPTS, JOB_MAX_CONCURRENT_DISPATCHES, JobQueueFullError, create_default_jobs
+from image_preprocess import (
+    IMAGE_FETCH_URLS,
+    fetch_and_preprocess_url,
+    preprocess_base64_image,
+    preprocess_image_bytes,
+    sniff_image_mime,
+)
+from instrumentation import metrics, debug_enabled, log_debug, log_json
+
+# Content-addressed cache of successful analyses, shared across warm invocations
+analysis_cache = create_default_cache()
+
+# Single-flight guard so concurrent identical analyses make one upstream call
+in_flight_analyses = SingleFlight()
+
+# Recent photos per user by perceptual hash, so retakes of the same plate reuse an analysis
+near_duplicates = NearDuplicateIndex()
+
+# Submit-and-poll jobs; run_analysis_job runs the same cached analysis path as analyze_meal_image
+analysis_jobs = create_default_jobs(lambda **job: run_meal_analysis(**job))
+
+# Recently issued PaymentIntents by idempotency key, so a client retry is answered
+# without another Stripe round trip; concurrent retries share one Stripe call
+PAYMENT_INTENT_CACHE_SIZE = int(os.environ.get('PAYMENT_INTENT_CACHE_SIZE', '1024'))
+PAYMENT_INTENT_CACHE_TTL_SECONDS = int(os.environ.get('PAYMENT_INTENT_CACHE_TTL_SECONDS', '600'))
+issued_payment_intents = AnalysisCache(max_entries=PAYMENT_INTENT_CACHE_SIZE,
+                                       ttl_seconds=PAYMENT_INTENT_CACHE_TTL_SECONDS)
+in_flight_payments = SingleFlight()
+
+# Limits for the batch analysis endpoint
+BATCH_MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', '20'))
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', '5'))
+BATCH_DEADLINE_SECONDS = float(os.environ.get('BATCH_DEADLINE_SECONDS', '45'))
+
+# Largest binary upload (multipart/form-data or raw image/* body) accepted
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+
+# Route upstream vision calls through the shared aiohttp event loop so one
+# instance multiplexes its concurrent requests (requires aiohttp)
+ASYNC_VISION = os.environ.get('ASYNC_VISION', 'false').lower() in ('1', 'true', 'yes') and async_available()
+
+# Ask OpenAI for schema-constrained JSON instead of scraping free text
+STRUCTURED_OUTPUT = os.environ.get('STRUCTURED_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+
+# Shared secret the metrics scraper sends; functions_metrics refuses every request without it
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Export the stats the helper modules already keep alongside stage timings
+metrics.register_collector('analysis_cache', analysis_cache.stats)
+metrics.register_collector('single_flight', in_flight_analyses.stats)
+metrics.register_collector('near_duplicates', near_duplicates.stats)
+metrics.register_collector('parse', parse_metrics.snapshot)
+metrics.register_collector('prompt_usage', prompt_usage.snapshot)
+metrics.register_collector('openai', lambda: get_vision_client().resilience_stats())
+metrics.register_collector('payment_intents', issued_payment_intents.stats)
+metrics.register_collector('payment_single_flight', in_flight_payments.stats)
+metrics.register_collector('analysis_jobs', analysis_jobs.stats)
+metrics.register_collector('nutrients', lambda: get_nutrient_index().stats() if get_nutrient_index() else {})
+if ASYNC_VISION:
+    metrics.register_collector('openai_async', lambda: get_async_vision_client()[1].stats())
+
+
+def strip_markdown_fences(text):
+    """Remove a surrounding ```json ... ``` (or bare ```) fence from model output"""
+    text = text.strip()
+    if text.startswith("```json") and text.endswith("```"):
+        # Slice from after "```json" (length 7) to before "```" (length 3 from end)
+        text = text[len("```json"):-len("```")].strip()
+    elif text.startswith("```") and text.endswith("```"):
+        # Slice from after "```" (length 3) to before "```" (length 3 from end)
+        text = text[len("```"):-len("```")].strip()
+    return text
+
+
+def json_object_text(text):
+    """Strip markdown fences and any prose around the outermost {...} of model output"""
+    text = strip_markdown_fences(text)
+    json_start_index = text.find('{')
+    json_end_index = text.rfind('}')
+    if json_start_index != -1 and json_end_index > json_start_index:
+        return text[json_start_index:json_end_index + 1]
+    return text
+
+
+def parse_analysis_output(raw_analysis_output):
+    """
+    Turn raw vision output into a clean JSON payload string
+
+    Args:
+        raw_analysis_output (str or dict): Result of analyze_image_with_vision
+
+    Returns:
+        str: Serialized JSON analysis
+
+    Raises:
+        Exception: If the output cannot be parsed as a JSON object
+    """
+    if isinstance(raw_analysis_output, str):
+        text_to_parse = strip_markdown_fences(raw_analysis_output)
+
+        # After attempting to strip markdown, find the JSON object
+        json_start_index = text_to_parse.find('{')
+        json_end_index = text_to_parse.rfind('}')
+
+        if json_start_index != -1 and json_end_index != -1 and json_end_index > json_start_index:
+            json_str_candidate = text_to_parse[json_start_index : json_end_index + 1]
+            try:
+                parsed_json = json.loads(json_str_candidate)
+
+                # Debug: Check if healthiness is in the parsed JSON
+                log_debug(f"🔍 Parsed JSON keys: {list(parsed_json.keys())}")
+                if 'healthiness' in parsed_json:
+                    log_debug(f"✅ Found healthiness in parsed JSON: {parsed_json['healthiness']}")
+                else:
+                    log_debug("❌ No healthiness field found in parsed JSON")
+                    if debug_enabled():
+                        log_debug(f"🔍 Full parsed JSON: {parsed_json}")
+                    # Add default healthiness if missing
+                    parsed_json['healthiness'] = 'N/A'
+                    log_debug("🔧 Added default healthiness: N/A")
+
+                final_json_payload_str = json.dumps(parsed_json) # Re-serialize for clean output
+            except json.JSONDecodeError as e:
+                error_message = f"Could not parse extracted JSON (from braces) from vision API output. Error: {str(e)}. Candidate snippet: {json_str_candidate[:200]}"
+                print(error_message)
+                raise Exception(error_message) from e
+        else:
+            # If no '{...}' found, try to parse the text_to_parse directly
+            try:
+                parsed_json = json.loads(text_to_parse)
+
+                # Debug: Check if healthiness is in the parsed JSON
+                log_debug(f"🔍 Direct parse JSON keys: {list(parsed_json.keys())}")
+                if 'healthiness' in parsed_json:
+                    log_debug(f"✅ Found healthiness in direct parsed JSON: {parsed_json['healthiness']}")
+                else:
+                    log_debug("❌ No healthiness field found in direct parsed JSON")
+                    if debug_enabled():
+                        log_debug(f"🔍 Full direct parsed JSON: {parsed_json}")
+                    # Add default healthiness if missing
+                    parsed_json['healthiness'] = 'N/A'
+                    log_debug("🔧 Added default healthiness: N/A")
+
+                final_json_payload_str = json.dumps(parsed_json) 
+            except json.JSONDecodeError as e:
+                error_message = f"Vision API output is not a recognized JSON object (no braces found) and not a simple JSON string after stripping. Error: {str(e)}. Output snippet: {text_to_parse[:200]}"
+                print(error_message)
+                raise Exception(error_message) from e
+    elif isinstance(raw_analysis_output, (dict, list)):
+        final_json_payload_str = json.dumps(raw_analysis_output)
+    else:
+        error_message = f"Unexpected data type from image analysis service: {type(raw_analysis_output)}. Output snippet: {str(raw_analysis_output)[:200]}"
+        print(error_message)
+        raise Exception(error_message)
+
+    return final_json_payload_str
+
+
+def decode_analysis_output(raw_analysis_output, response_format=None):
+    """
+    Validate vision output against the MealAnalysis schema
+
+    Tries a structured decode of the output (with any markdown fence and
+    surrounding prose removed) first, then one repair round trip, and
+    finally the legacy free-text parser. Outcomes and timings are recorded
+    in parse_metrics.
+
+    Args:
+        raw_analysis_output (str or dict): Result of analyze_image_with_vision
+        response_format (dict, optional): Response format to enforce on the repair request
+
+    Returns:
+        str: Serialized JSON analysis
+
+    Raises:
+        Exception: If every strategy fails
+    """
+    started = time.perf_counter()
+
+    # Upstream failures are already {"error": ...} dicts; pass them through
+    if not isinstance(raw_analysis_output, str):
+        return parse_analysis_output(raw_analysis_output)
+
+    try:
+        analysis = decode_meal_analysis(json_object_text(raw_analysis_output))
+        parse_metrics.record('structured', time.perf_counter() - started)
+        with metrics.timer('serialize'):
+            return json.dumps(analysis.to_response())
+    except MealAnalysisValidationError as validation_error:
+        print(f"⚠️ Structured decode failed: {str(validation_error)}")
+        repaired_output = repair_analysis_output(raw_analysis_output, str(validation_error), response_format)
+        if isinstance(repaired_output, str):
+            try:
+                analysis = decode_meal_analysis(repaired_output)
+                parse_metrics.record('repaired', time.perf_counter() - started)
+                with metrics.timer('serialize'):
+                    return json.dumps(analysis.to_response())
+            except MealAnalysisValidationError as repair_error:
+                print(f"⚠️ Repaired output still invalid: {str(repair_error)}")
+
+    try:
+        final_json_payload_str = parse_analysis_output(raw_analysis_output)
+    except Exception:
+        parse_metrics.record('failed', time.perf_counter() - started)
+        print(f"📊 Parse metrics: {parse_metrics.snapshot()}")
+        raise
+    parse_metrics.record('legacy', time.perf_counter() - started)
+
+    # Keep the wire format ('Xg' macro strings) whenever the loose parse is a valid analysis
+    try:
+        analysis = MealAnalysis.from_dict(json.loads(final_json_payload_str))
+    except MealAnalysisValidationError:
+        return final_json_payload_str
+    with metrics.timer('serialize'):
+        return json.dumps(analysis.to_response())
+
+
+def _flag(value):
+    # Form fields and query parameters arrive as strings
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+
+def read_image_upload(req):
+    """
+    Read an analysis request as JSON, multipart/form-data or a raw image body
+
+    Multipart requests carry the image in an 'image' file field (or the first
+    file) and options as form fields; raw image/* bodies take options from
+    the query string. Binary images stay as a memoryview over the uploaded
+    bytes and are only base64-encoded when the OpenAI request is serialized.
+
+    Returns:
+        tuple: (options dict, image bytes or None, image MIME type or None)
+
+    Raises:
+        ValueError: If a binary upload is empty or its bytes are not a
+            supported image format, whatever Content-Type it declares
+        RequestEntityTooLarge: If the body is larger than UPLOAD_MAX_BYTES
+    """
+    content_type = req.mimetype or ''
+    if content_type == 'multipart/form-data':
+        req.max_content_length = UPLOAD_MAX_BYTES
+        data = req.form.to_dict()
+        upload = req.files.get('image') or next(iter(req.files.values()), None)
+        if upload is None:
+            return data, None, None
+        image_bytes = memoryview(upload.stream.read())
+    elif content_type.startswith('image/') or content_type == 'application/octet-stream':
+        req.max_content_length = UPLOAD_MAX_BYTES
+        data = req.args.to_dict()
+        image_bytes = memoryview(req.get_data(cache=False))
+    else:
+        return req.get_json(), None, None
+
+    if not image_bytes:
+        raise ValueError('Uploaded image is empty')
+    # The declared Content-Type is not trusted; only formats recognized from the bytes are accepted
+    image_mime_type = sniff_image_mime(image_bytes)
+    if image_mime_type is None:
+        raise ValueError('Unsupported image format')
+    return data, image_bytes, image_mime_type
+
+
+def read_analysis_request(req):
+    """
+    Decode and validate the image inputs of an analysis request
+
+    Shared by analyze_meal_image and submit_meal_analysis.
+
+    Returns:
+        tuple: (inputs, None) with inputs holding the decoded 'data' plus
+        'image_url', 'image_base64', 'image_bytes', 'image_mime_type',
+        'locales' and 'user_id'; or (None, error response) for a 413 or 400
+    """
+    with metrics.timer('request_decode'):
+        try:
+            data, image_bytes, image_mime_type = read_image_upload(req)
+        except RequestEntityTooLarge:
+            return None, https_fn.Response(
+                json.dumps({'error': f'Uploaded image exceeds {UPLOAD_MAX_BYTES} bytes'}),
+                status=413,
+                headers={'Content-Type': 'application/json'}
+            )
+        except ValueError as upload_error:
+            return None, https_fn.Response(
+                json.dumps({'error': str(upload_error)}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+    image_url = data.get('image_url')
+    image_base64 = data.get('image_base64')
+
+    # Validate that we have either URL or base64
+    if not image_url and not image_base64 and image_bytes is None:
+        return None, https_fn.Response(
+            json.dumps({'error': 'Either image_url or image_base64 must be provided'}),
+            status=400,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    # Validate URL format if provided
+    if image_url and not image_url.startswith(('http://', 'https://')):
+        return None, https_fn.Response(
+            json.dumps({'error': 'Invalid image URL format. Must start with http:// or https://'}),
+            status=400,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    if not valid_locales(data.get('locales')):
+        return None, https_fn.Response(
+            json.dumps({'error': 'locales must be a list of language codes or a comma-separated string'}),
+            status=400,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    return {
+        'data': data,
+        'image_url': image_url,
+        'image_base64': image_base64,
+        'image_bytes': image_bytes,
+        'image_mime_type': image_mime_type,
+        'locales': data.get('locales'),
+        'user_id': verified_user_id(req),
+    }, None
+
+
+def prepare_image(image_url=None, image_base64=None, image_bytes=None, image_mime_type='image/jpeg'):
+    """
+    Shrink the image before upload
+
+    Returns:
+        tuple: (image_url, image_base64, image_bytes, image_mime_type) to send upstream
+    """
+    if image_bytes is not None:
+        image_bytes, image_mime_type = preprocess_image_bytes(image_bytes, image_mime_type)
+    elif image_base64:
+        image_base64, image_mime_type = preprocess_base64_image(image_base64)
+    elif IMAGE_FETCH_URLS:
+        fetched = fetch_and_preprocess_url(image_url)
+        if fetched is not None:
+            image_bytes, image_mime_type = fetched
+            image_url = None
+    return image_url, image_base64, image_bytes, image_mime_type
+
+
+def verified_user_id(req):
+    """
+    UID of the caller from a Firebase ID token in the Authorization header
+
+    Per-user state such as the near-duplicate index is keyed by this, never
+    by a user id taken from the request body.
+
+    Returns:
+        str or None: The verified uid, or None for anonymous callers and invalid tokens
+    """
+    authorization = req.headers.get('Authorization', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    try:
+        from firebase_admin import auth
+        with metrics.timer('auth_verify'):
+            return auth.verify_id_token(authorization[len('Bearer '):], app=get_firebase_app())['uid']
+    except Exception as e:
+        print(f"⚠️ Ignoring invalid ID token: {str(e)}")
+        metrics.increment('auth_invalid_tokens')
+        return None
+
+
+def near_duplicate_key(user_id, variant, image_base64=None, image_bytes=None):
+    """
+    Perceptual hash and index scope for a user's uploaded image
+
+    Analyses differ by output languages, so each user and prompt variant
+    pair is its own scope. URL inputs are not hashed.
+
+    Returns:
+        tuple: (scope, image_hash), or (None, None) when the check does not apply
+    """
+    if not PHASH_ENABLED or not user_id or (image_bytes is None and not image_base64):
+        return None, None
+    with metrics.timer('phash'):
+        if image_bytes is None:
+            try:
+                image_bytes = base64.b64decode(image_base64, validate=False)
+            except (binascii.Error, ValueError):
+                return None, None
+        image_hash = phash(image_bytes)
+    if image_hash is None:
+        return None, None
+    return f"{user_id}:{variant.name}", image_hash
+
+
+def run_meal_analysis(image_url=None, image_base64=None, locales=None, image_bytes=None, image_mime_type='image/jpeg',
+                      user_id=None):
+    """
+    Analyze one meal image, serving repeats from the analysis cache
+
+    Args:
+        image_url (str, optional): URL of the image to analyze
+        image_base64 (str, optional): Base64 encoded image data
+        locales (list, optional): Output languages; English is always included
+        image_bytes (bytes-like, optional): Raw uploaded image, used instead of image_base64
+        image_mime_type (str): MIME type of image_bytes
+        user_id (str, optional): Verified uid; enables reuse of the user's recent near-identical photos
+
+    Returns:
+        tuple: (JSON payload string, 'HIT', 'NEAR', 'MISS' or 'COALESCED')
+
+    Raises:
+        Exception: If the vision output cannot be parsed
+    """
+    variant = get_prompt_variant(locales)
+    response_format = variant.response_format if STRUCTURED_OUTPUT else None
+
+    # Serve repeated uploads of the same image from the cache; hashing
+    # decodes the base64 payload, so it is timed as base64 handling
+    with metrics.timer('base64_handling'):
+        cache_key = make_cache_key(variant.text, VISION_MODEL, image_url=image_url,
+                                   image_base64=image_base64, image_bytes=image_bytes)
+    cached_payload = analysis_cache.get(cache_key)
+    if cached_payload is not None:
+        log_debug(f"⚡ Analysis cache hit: {analysis_cache.stats()}")
+        return cached_payload, 'HIT'
+
+    # A retake of a plate the user just photographed reuses that analysis
+    scope, image_hash = near_duplicate_key(user_id, variant, image_base64, image_bytes)
+    if scope is not None:
+        near_match = near_duplicates.lookup(scope, image_hash)
+        if near_match is not None:
+            log_debug(f"🪞 Near-duplicate photo (distance {near_match[1]}): {near_duplicates.stats()}")
+            return near_match[0], 'NEAR'
+
+    # Identical requests already in flight share one upstream call
+    final_json_payload_str, shared = in_flight_analyses.do(
+        cache_key, _analyze_uncached, cache_key, variant, response_format,
+        image_url, image_base64, image_bytes, image_mime_type, scope, image_hash
+    )
+    if shared:
+        log_debug(f"🔗 Coalesced with in-flight analysis: {in_flight_analyses.stats()}")
+        return final_json_payload_str, 'COALESCED'
+    return final_json_payload_str, 'MISS'
+
+
+def _analyze_uncached(cache_key, variant, response_format, image_url, image_base64, image_bytes, image_mime_type,
+                      scope=None, image_hash=None):
+    # Shrink the image before upload; the cache key above stays on the original
+    with metrics.timer('image_preprocess'):
+        image_url, image_base64, image_bytes, image_mime_type = prepare_image(
+            image_url, image_base64, image_bytes, image_mime_type
+        )
+
+    # Using the custom analyze_image_with_vision function from openai_helper,
+    # or its async counterpart on the shared event loop
+    analyze = run_image_analysis if ASYNC_VISION else analyze_image_with_vision
+    with metrics.timer('upstream_call'):
+        raw_analysis_output = analyze(
+            image_url=image_url,
+            prompt=variant.text,
+            image_base64=image_base64,
+            image_mime_type=image_mime_type,
+            response_format=response_format,
+            usage_callback=lambda usage: prompt_usage.record(variant.name, usage),
+            image_bytes=image_bytes
+        )
+
+    # Debug: Log what OpenAI actually returned
+    if debug_enabled():
+        log_debug(f"🔍 Raw OpenAI output type: {type(raw_analysis_output)}")
+        if isinstance(raw_analysis_output, str):
+            log_debug(f"🔍 Raw OpenAI output (first 500 chars): {raw_analysis_output[:500]}")
+        else:
+            log_debug(f"🔍 Raw OpenAI output: {raw_analysis_output}")
+
+    with metrics.timer('parse_validate'):
+        final_json_payload_str = decode_analysis_output(raw_analysis_output, response_format)
+
+    # Upstream errors come back as {"error": ...} dicts and must not be cached
+    if not (isinstance(raw_analysis_output, dict) and 'error' in raw_analysis_output):
+        analysis_cache.set(cache_key, final_json_payload_str)
+        log_debug(f"📦 Analysis cached: {analysis_cache.stats()}")
+        if scope is not None:
+            near_duplicates.add(scope, image_hash, final_json_payload_str)
+
+    return final_json_payload_str
+
+
+def attach_ingredient_nutrients(payload_str):
+    """
+    Add USDA per-100g macros for each English ingredient to an analysis payload
+
+    Args:
+        payload_str (str): JSON analysis as returned by run_meal_analysis
+
+    Returns:
+        str: The payload with an 'ingredientNutrients' list (None for unmatched
+        ingredients), or unchanged if no nutrient index is deployed
+    """
+    nutrient_index = get_nutrient_index()
+    if nutrient_index is None:
+        return payload_str
+    payload = json.loads(payload_str)
+    ingredients = payload.get('ingredients')
+    if isinstance(ingredients, dict):
+        ingredients = ingredients.get('en', [])
+    with metrics.timer('nutrient_lookup'):
+        payload['ingredientNutrients'] = [
+            dict(food, ingredient=name) if food else None
+            for name, food in zip(ingredients or [], nutrient_index.lookup_many(ingredients or []))
+        ]
+    return json.dumps(payload)
+
+
+def _ndjson(event):
+    return json.dumps(event) + '\n'
+
+
+def _replay_events(payload, cache_status):
+    analysis = json.loads(payload)
+    for key, value in analysis.items():
+        yield _ndjson({'type': 'field', 'key': key, 'value': value})
+    yield _ndjson({'type': 'done', 'cache': cache_status, 'analysis': analysis})
+
+
+def stream_meal_analysis(image_url=None, image_base64=None, locales=None, image_bytes=None, image_mime_type='image/jpeg',
+                         user_id=None):
+    """
+    Analyze one meal image, yielding NDJSON events as fields become available
+
+    Emits {"type": "field", "key": ..., "value": ...} for each top-level
+    field as soon as the model finishes writing it, then a final
+    {"type": "done", "analysis": {...}} or {"type": "error", ...} event.
+    """
+    variant = get_prompt_variant(locales)
+    response_format = variant.response_format if STRUCTURED_OUTPUT else None
+    cache_key = make_cache_key(variant.text, VISION_MODEL, image_url=image_url,
+                               image_base64=image_base64, image_bytes=image_bytes)
+    cached_payload = analysis_cache.get(cache_key)
+    if cached_payload is not None:
+        log_debug(f"⚡ Analysis cache hit (stream): {analysis_cache.stats()}")
+        yield from _replay_events(cached_payload, 'HIT')
+        return
+
+    scope, image_hash = near_duplicate_key(user_id, variant, image_base64, image_bytes)
+    if scope is not None:
+        near_match = near_duplicates.lookup(scope, image_hash)
+        if near_match is not None:
+            log_debug(f"🪞 Near-duplicate photo (stream, distance {near_match[1]}): {near_duplicates.stats()}")
+            yield from _replay_events(near_match[0], 'NEAR')
+            return
+
+    try:
+        image_url, image_base64, image_bytes, image_mime_type = prepare_image(
+            image_url, image_base64, image_bytes, image_mime_type
+        )
+
+        parser = IncrementalObjectParser()
+        chunks = []
+        for delta in stream_image_analysis(
+            image_url=image_url,
+            prompt=variant.text,
+            image_base64=image_base64,
+            image_mime_type=image_mime_type,
+            response_format=response_format,
+            usage_callback=lambda usage: prompt_usage.record(variant.name, usage),
+            image_bytes=image_bytes
+        ):
+            chunks.append(delta)
+            for key, value in parser.feed(delta):
+                yield _ndjson({'type': 'field', 'key': key, 'value': value})
+
+        # The validated parse is authoritative; re-send fields it normalized or filled in
+        final_json_payload_str = decode_analysis_output(''.join(chunks), response_format)
+        analysis = json.loads(final_json_payload_str)
+        for key, value in analysis.items():
+            if parser.fields.get(key) != value:
+                yield _ndjson({'type': 'field', 'key': key, 'value': value})
+
+        analysis_cache.set(cache_key, final_json_payload_str)
+        if scope is not None:
+            near_duplicates.add(scope, image_hash, final_json_payload_str)
+        yield _ndjson({'type': 'done', 'cache': 'MISS', 'analysis': analysis})
+
+    except Exception as vision_error:
+        print(f"OpenAI Vision API streaming error: {str(vision_error)}")
+        yield _ndjson({
+            'type': 'error',
+            'error': 'Failed to analyze image with OpenAI Vision API',
+            'message': str(vision_error)
+        })
+
 
 # OpenAI function for analyzing meal images
 @https_fn.on_request()
 def analyze_meal_image(req: https_fn.Request) -> https_fn.Response:
-    """Analyze meal image using OpenAI Vision API"""
+    """
+    Analyze meal image using OpenAI Vision API
+
+    Accepts a JSON body with image_url or image_base64, a multipart/form-data
+    upload with an 'image' file, or a raw image/* body.
+    """
+    request_started = time.perf_counter()
+    metrics.increment('analyze_requests')
     try:
         # Get data from request
-        data = req.get_json()
-        image_url = data.get('image_url')
-        image_base64 = data.get('image_base64')
+        inputs, error_response = read_analysis_request(req)
+        if error_response is not None:
+            return error_response
+        data = inputs['data']
+        image_url = inputs['image_url']
+        image_base64 = inputs['image_base64']
+        image_bytes = inputs['image_bytes']
+        image_mime_type = inputs['image_mime_type']
+        locales = inputs['locales']
+        user_id = inputs['user_id']
         image_name = data.get('image_name', 'unknown.jpg')
         function_info = data.get('function_info', {})
         
         print(f"Received analysis request for image: {image_name}")
         
         if image_url:
-            print(f"Image URL length: {len(image_url)}")
+            log_debug(f"Image URL length: {len(image_url)}")
         if image_base64:
-            print(f"Image base64 length: {len(image_base64)}")
-        
-        # Validate that we have either URL or base64
-        if not image_url and not image_base64:
-            return https_fn.Response(
-                json.dumps({'error': 'Either image_url or image_base64 must be provided'}),
-                status=400,
-                headers={'Content-Type': 'application/json'}
-            )
-            
-        # Validate URL format if provided
-        if image_url and not image_url.startswith(('http://', 'https://')):
-            return https_fn.Response(
-                json.dumps({'error': 'Invalid image URL format. Must start with http:// or https://'}),
-                status=400,
-                headers={'Content-Type': 'application/json'}
-            )
+            log_debug(f"Image base64 length: {len(image_base64)}")
+        if image_bytes is not None:
+            log_debug(f"Image upload: {len(image_bytes)} bytes ({image_mime_type})")
 
         if image_url:
-            print(f"Processing image URL: {image_url[:50]}...")
-        else:
-            print(f"Processing base64 image data ({len(image_base64)} characters)")
-        
-        prompt = """
-Analyze this meal image and provide detailed nutritional information in JSON format. Include:
-1. Meal identification
-2. Accurate calorie estimation
-3. Detailed macro breakdown (in grams)
-4. List of ingredients
-5. A categorical healthiness value (e.g., 'healthy', 'medium', 'unhealthy')
-6. Detailed health assessment text
-7. Source URL for more information
-
-Additionally, return the meal name and the list of ingredients in three languages: English, Hebrew, and Russian.
-
-Format the response as:
-{
-  'mealName': {'en': '...', 'he': '...', 'ru': '...'},
-  'estimatedCalories': number (e.g., 670),
-  'macros': {
-    'proteins': 'Xg (e.g., 30g)',
-    'carbohydrates': 'Xg (e.g., 50g)',
-    'fats': 'Xg (e.g., 40g)'
-  },
-  'ingredients': {
-    'en': ['...', '...'],
-    'he': ['...', '...'],
-    'ru': ['...', '...']
-  },
-  'healthiness': 'healthy' | 'medium' | 'unhealthy' | 'N/A',
-  'health_assessment': 'Detailed health assessment of the meal',
-  'source': 'A valid URL (starting with http or https) for more information about this meal'
-}
-
-Important:
-- Provide realistic calorie and macro values based on visible portions.
-- Ensure 'estimatedCalories' is a number.
-- Ensure macros (proteins, carbohydrates, fats) are strings ending with 'g'.
-- The 'healthiness' field should be one of 'healthy', 'medium', 'unhealthy', or 'N/A'.
-- Provide a comprehensive 'health_assessment' string.
-- The source field MUST be a valid URL, defaulting to https://fdc.nal.usda.gov/ if needed.
-- All translations must be accurate and contextually appropriate for food.
-"""
+            log_debug(f"Processing image URL: {image_url[:50]}...")
+        elif image_base64:
+            log_debug(f"Processing base64 image data ({len(image_base64)} characters)")
+
+        # Optional streaming mode: NDJSON field events instead of one JSON body
+        if _flag(data.get('stream')):
+            return https_fn.Response(
+                stream_meal_analysis(image_url=image_url, image_base64=image_base64, locales=locales,
+                                     image_bytes=image_bytes, image_mime_type=image_mime_type, user_id=user_id),
+                status=200,
+                headers={'Content-Type': 'application/x-ndjson', 'Cache-Control': 'no-cache'}
+            )
 
         try:
-            # Using the custom analyze_image_with_vision function from openai_helper
-            raw_analysis_output = analyze_image_with_vision(
-                image_url=image_url, 
-                prompt=prompt, 
-                image_base64=image_base64
+            final_json_payload_str, cache_status = run_meal_analysis(
+                image_url=image_url,
+                image_base64=image_base64,
+                locales=locales,
+                image_bytes=image_bytes,
+                image_mime_type=image_mime_type,
+                user_id=user_id
             )
-            
-            # Debug: Log what OpenAI actually returned
-            print(f"🔍 Raw OpenAI output type: {type(raw_analysis_output)}")
-            if isinstance(raw_analysis_output, str):
-                print(f"🔍 Raw OpenAI output (first 500 chars): {raw_analysis_output[:500]}")
-            else:
-                print(f"🔍 Raw OpenAI output: {raw_analysis_output}")
-            
-            final_json_payload_str: str
-
-            if isinstance(raw_analysis_output, str):
-                text_to_parse = raw_analysis_output.strip()
-
-                # Try to remove markdown fences
-                if text_to_parse.startswith("```json") and text_to_parse.endswith("```"):
-                    # Slice from after "```json" (length 7) to before "```" (length 3 from end)
-                    text_to_parse = text_to_parse[len("```json"):-len("```")].strip()
-                elif text_to_parse.startswith("```") and text_to_parse.endswith("```"):
-                    # Slice from after "```" (length 3) to before "```" (length 3 from end)
-                    text_to_parse = text_to_parse[len("```"):-len("```")].strip()
-
-                # After attempting to strip markdown, find the JSON object
-                json_start_index = text_to_parse.find('{')
-                json_end_index = text_to_parse.rfind('}')
-
-                if json_start_index != -1 and json_end_index != -1 and json_end_index > json_start_index:
-                    json_str_candidate = text_to_parse[json_start_index : json_end_index + 1]
-                    try:
-                        parsed_json = json.loads(json_str_candidate)
-                        
-                        # Debug: Check if healthiness is in the parsed JSON
-                        print(f"🔍 Parsed JSON keys: {list(parsed_json.keys())}")
-                        if 'healthiness' in parsed_json:
-                            print(f"✅ Found healthiness in parsed JSON: {parsed_json['healthiness']}")
-                        else:
-                            print("❌ No healthiness field found in parsed JSON")
-                            print(f"🔍 Full parsed JSON: {parsed_json}")
-                            # Add default healthiness if missing
-                            parsed_json['healthiness'] = 'N/A'
-                            print("🔧 Added default healthiness: N/A")
-                        
-                        final_json_payload_str = json.dumps(parsed_json) # Re-serialize for clean output
-                    except json.JSONDecodeError as e:
-                        error_message = f"Could not parse extracted JSON (from braces) from vision API output. Error: {str(e)}. Candidate snippet: {json_str_candidate[:200]}"
-                        print(error_message)
-                        raise Exception(error_message) from e
-                else:
-                    # If no '{...}' found, try to parse the text_to_parse directly
-                    try:
-                        parsed_json = json.loads(text_to_parse)
-                        
-                        # Debug: Check if healthiness is in the parsed JSON
-                        print(f"🔍 Direct parse JSON keys: {list(parsed_json.keys())}")
-                        if 'healthiness' in parsed_json:
-                            print(f"✅ Found healthiness in direct parsed JSON: {parsed_json['healthiness']}")
-                        else:
-                            print("❌ No healthiness field found in direct parsed JSON")
-                            print(f"🔍 Full direct parsed JSON: {parsed_json}")
-                            # Add default healthiness if missing
-                            parsed_json['healthiness'] = 'N/A'
-                            print("🔧 Added default healthiness: N/A")
-                        
-                        final_json_payload_str = json.dumps(parsed_json) 
-                    except json.JSONDecodeError as e:
-                        error_message = f"Vision API output is not a recognized JSON object (no braces found) and not a simple JSON string after stripping. Error: {str(e)}. Output snippet: {text_to_parse[:200]}"
-                        print(error_message)
-                        raise Exception(error_message) from e
-            elif isinstance(raw_analysis_output, (dict, list)):
-                final_json_payload_str = json.dumps(raw_analysis_output)
-            else:
-                error_message = f"Unexpected data type from image analysis service: {type(raw_analysis_output)}. Output snippet: {str(raw_analysis_output)[:200]}"
-                print(error_message)
-                raise Exception(error_message)
+            if _flag(data.get('include_nutrients')):
+                final_json_payload_str = attach_ingredient_nutrients(final_json_payload_str)
+
+            duration = time.perf_counter() - request_started
+            metrics.observe('analyze_total', duration)
+            log_json('analyze_meal_image', status=200, cache=cache_status, duration_ms=round(duration * 1000, 1))
 
             # Return the cleaned and validated analysis result
             return https_fn.Response(
                 final_json_payload_str,
                 status=200,
-                headers={'Content-Type': 'application/json'}
+                headers={'Content-Type': 'application/json', 'X-Cache': cache_status}
             )
         except Exception as vision_error:
             print(f"OpenAI Vision API error: {str(vision_error)}")
+            metrics.increment('analyze_failures')
             # Return a more helpful error message
             error_response = {
                 "error": "Failed to analyze image with OpenAI Vision API",
@@ -218,6 +732,7 @@ Important:
         
     except Exception as e:
         print(f"Error in analyze_meal_image: {str(e)}")
+        metrics.increment('analyze_failures')
         return https_fn.Response(
             json.dumps({
                 "error": "General error occurred",
@@ -239,22 +754,348 @@ Important:
             headers={'Content-Type': 'application/json'}
         )
 
+# Batch variant of analyze_meal_image for multi-photo imports
+@https_fn.on_request()
+def analyze_meal_images_batch(req: https_fn.Request) -> https_fn.Response:
+    """Analyze several meal images concurrently, returning per-image results in order"""
+    try:
+        data = req.get_json()
+        images = data.get('images')
+        locales = data.get('locales')
+        user_id = verified_user_id(req)
+
+        if not isinstance(images, list) or not images:
+            return https_fn.Response(
+                json.dumps({'error': 'images must be a non-empty list'}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        if not valid_locales(locales):
+            return https_fn.Response(
+                json.dumps({'error': 'locales must be a list of language codes or a comma-separated string'}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        if len(images) > BATCH_MAX_IMAGES:
+            return https_fn.Response(
+                json.dumps({'error': f'Too many images: {len(images)}. Maximum is {BATCH_MAX_IMAGES}'}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        try:
+            deadline = min(float(data.get('deadline_seconds', BATCH_DEADLINE_SECONDS)), BATCH_DEADLINE_SECONDS)
+        except (TypeError, ValueError):
+            deadline = BATCH_DEADLINE_SECONDS
+
+        print(f"Received batch analysis request: {len(images)} images, deadline {deadline}s")
+
+        results = [None] * len(images)
+        futures = {}
+        executor = ThreadPoolExecutor(max_workers=min(BATCH_MAX_WORKERS, len(images)))
+        try:
+            for index, image in enumerate(images):
+                image = image if isinstance(image, dict) else {}
+                image_url = image.get('image_url')
+                image_base64 = image.get('image_base64')
+
+                # Invalid entries fail individually instead of failing the batch
+                if not image_url and not image_base64:
+                    results[index] = {'index': index, 'status': 'error', 'error': 'Either image_url or image_base64 must be provided'}
+                    continue
+                if image_url and not image_url.startswith(('http://', 'https://')):
+                    results[index] = {'index': index, 'status': 'error', 'error': 'Invalid image URL format. Must start with http:// or https://'}
+                    continue
+
+                future = executor.submit(run_meal_analysis, image_url=image_url, image_base64=image_base64,
+                                         locales=locales, user_id=user_id)
+                futures[future] = index
+
+            done, not_done = wait(futures, timeout=deadline)
+        finally:
+            # Drop queued work for stragglers; running calls finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            index = futures[future]
+            try:
+                payload_str, cache_status = future.result()
+                analysis = json.loads(payload_str)
+                if isinstance(analysis, dict) and 'error' in analysis:
+                    results[index] = {'index': index, 'status': 'error', 'error': analysis['error']}
+                else:
+                    results[index] = {'index': index, 'status': 'ok', 'cache': cache_status, 'analysis': analysis}
+            except Exception as e:
+                print(f"Batch item {index} failed: {str(e)}")
+                results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+
+        for future in not_done:
+            index = futures[future]
+            results[index] = {'index': index, 'status': 'timeout', 'error': f'Analysis did not finish within {deadline}s'}
+
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        print(f"✅ Batch analysis finished: {succeeded}/{len(images)} succeeded")
+
+        return https_fn.Response(
+            json.dumps({
+                'results': results,
+                'succeeded': succeeded,
+                'failed': len(images) - succeeded
+            }),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    except Exception as e:
+        print(f"Error in analyze_meal_images_batch: {str(e)}")
+        return https_fn.Response(
+            json.dumps({'error': 'General error occurred', 'message': str(e)}),
+            status=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+# Submit-and-poll variant of analyze_meal_image for clients on unreliable networks
+@https_fn.on_request()
+def submit_meal_analysis(req: https_fn.Request) -> https_fn.Response:
+    """
+    Validate an image and enqueue its analysis, returning a job id immediately
+
+    Accepts the same bodies as analyze_meal_image. Poll get_analysis_job
+    with the returned jobId, or listen to the job's Firestore document.
+    """
+    metrics.increment('job_submit_requests')
+    try:
+        inputs, error_response = read_analysis_request(req)
+        if error_response is not None:
+            return error_response
+        image_url = inputs['image_url']
+        image_base64 = inputs['image_base64']
+        image_bytes = inputs['image_bytes']
+        image_mime_type = inputs['image_mime_type']
+        user_id = inputs['user_id']
+        # Base64 images are stored as bytes alongside uploads rather than carried in the
+        # task payload; undecodable ones are rejected now rather than after the client has gone away
+        if image_base64 and not image_url and image_bytes is None:
+            try:
+                image_bytes = base64.b64decode(image_base64, validate=False)
+                image_mime_type = sniff_image_mime(image_bytes)
+                if image_mime_type is None:
+                    raise ValueError('Unsupported image format')
+            except (binascii.Error, ValueError):
+                return https_fn.Response(
+                    json.dumps({'error': 'image_base64 is not a supported image'}),
+                    status=400,
+                    headers={'Content-Type': 'application/json'}
+                )
+        if image_bytes is not None:
+            image_url = None
+
+        try:
+            job_id = analysis_jobs.submit(
+                {
+                    'image_url': image_url,
+                    'image_mime_type': image_mime_type or 'image/jpeg',
+                    'locales': inputs['locales'],
+                    'user_id': user_id,
+                },
+                image_bytes=image_bytes,
+                user_id=user_id
+            )
+        except JobQueueFullError as full_error:
+            print(f"⚠️ {str(full_error)}")
+            return https_fn.Response(
+                json.dumps({'error': 'Too many pending analyses, retry shortly'}),
+                status=503,
+                headers={'Content-Type': 'application/json', 'Retry-After': '5'}
+            )
+
+        log_json('submit_meal_analysis', status=202, job_id=job_id)
+        return https_fn.Response(
+            json.dumps({'jobId': job_id, 'status': 'queued'}),
+            status=202,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    except Exception as e:
+        print(f"Error in submit_meal_analysis: {str(e)}")
+        metrics.increment('job_submit_failures')
+        return https_fn.Response(
+            json.dumps({'error': 'General error occurred', 'message': str(e)}),
+            status=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+# Cloud Tasks worker for jobs created by submit_meal_analysis; the queue's rate
+# limit bounds how many analyses run at once across all instances
+@tasks_fn.on_task_dispatched(
+    retry_config=RetryConfig(max_attempts=JOB_MAX_ATTEMPTS, min_backoff_seconds=10),
+    rate_limits=RateLimits(max_concurrent_dispatches=JOB_MAX_CONCURRENT_DISPATCHES),
+)
+def run_analysis_job(req: tasks_fn.CallableRequest) -> None:
+    """Run one queued analysis job and publish its outcome to the job's record"""
+    with metrics.timer('job_run'):
+        analysis_jobs.run(req.data)
+    log_json('run_analysis_job', job_id=req.data.get('id'))
+
+# Status endpoint for jobs created by submit_meal_analysis
+@https_fn.on_request()
+def get_analysis_job(req: https_fn.Request) -> https_fn.Response:
+    """Return a job's status and, once done, its analysis under 'result'"""
+    try:
+        job_id = req.args.get('job_id') or (req.get_json(silent=True) or {}).get('job_id')
+        if not job_id:
+            return https_fn.Response(
+                json.dumps({'error': 'job_id must be provided'}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        with metrics.timer('job_status_read'):
+            record = analysis_jobs.store.get(job_id)
+        if record is None:
+            return https_fn.Response(
+                json.dumps({'error': 'Job not found'}),
+                status=404,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        record['jobId'] = job_id
+        return https_fn.Response(
+            json.dumps(record),
+            status=200,
+            headers={'Content-Type': 'application/json', 'Cache-Control': 'no-store'}
+        )
+
+    except Exception as e:
+        print(f"Error in get_analysis_job: {str(e)}")
+        return https_fn.Response(
+            json.dumps({'error': 'General error occurred', 'message': str(e)}),
+            status=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+# Text-only meal logging, answered from the local USDA index without a vision call
+@https_fn.on_request()
+def log_meal_text(req: https_fn.Request) -> https_fn.Response:
+    """Estimate calories and macros for a typed meal such as '2 eggs and 150g rice'"""
+    request_started = time.perf_counter()
+    metrics.increment('text_requests')
+    try:
+        data = req.get_json(silent=True) or {}
+        text = data.get('text')
+        if not isinstance(text, str) or not text.strip():
+            return https_fn.Response(
+                json.dumps({'error': 'text must be provided'}),
+                status=400,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        nutrient_index = get_nutrient_index()
+        if nutrient_index is None:
+            return https_fn.Response(
+                json.dumps({'error': 'Nutrient index not available'}),
+                status=503,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        with metrics.timer('nutrient_lookup'):
+            analysis, items, unmatched = estimate_meal(text, nutrient_index)
+        if analysis is None:
+            metrics.increment('text_unmatched')
+            return https_fn.Response(
+                json.dumps({'error': 'No logged item matched a known food', 'unmatched': unmatched}),
+                status=422,
+                headers={'Content-Type': 'application/json'}
+            )
+
+        response = analysis.to_response()
+        response['items'] = items
+        response['unmatched'] = unmatched
+        duration = time.perf_counter() - request_started
+        metrics.observe('text_total', duration)
+        log_json('log_meal_text', status=200, items=len(items), unmatched=len(unmatched),
+                 duration_ms=round(duration * 1000, 2))
+        return https_fn.Response(
+            json.dumps(response),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    except Exception as e:
+        print(f"Error in log_meal_text: {str(e)}")
+        metrics.increment('text_failures')
+        return https_fn.Response(
+            json.dumps({'error': 'General error occurred', 'message': str(e)}),
+            status=500,
+            headers={'Content-Type': 'application/json'}
+        )
+
+
+def payment_idempotency_key(uid, amount, currency, nonce):
+    """
+    Stripe idempotency key for one checkout attempt
+
+    Retries of the same attempt (same signed-in caller, amount, currency
+    and client nonce) map to one PaymentIntent; a fresh nonce starts a new
+    payment. Only use it with a verified auth UID, since callers sharing a
+    key share the cached client secret.
+
+    Returns:
+        str: Key of at most 255 characters, as Stripe requires
+    """
+    digest = hashlib.sha256('\0'.join((uid, str(amount), currency, nonce)).encode('utf-8'))
+    return f"pi-{digest.hexdigest()}"
+
+
+def _issue_payment_intent(stripe, amount, currency, idempotency_key=None):
+    with metrics.timer('stripe_call'):
+        payment_intent = stripe.PaymentIntent.create(
+            amount=amount,
+            currency=currency,
+            automatic_payment_methods={
+                'enabled': True,
+            },
+            idempotency_key=idempotency_key,
+        )
+    metrics.increment('stripe_calls')
+    print(f"✅ Payment intent created successfully: {payment_intent.id}")
+
+    issued = {'clientSecret': payment_intent['client_secret']}
+    if idempotency_key:
+        issued_payment_intents.set(idempotency_key, issued)
+    return issued
+
+
 # Simple Stripe payment function (from backend.txt)
 @https_fn.on_call()
 def create_payment_intent(req: https_fn.CallableRequest) -> any:
-    """Create a Stripe payment intent - simple version"""
+    """
+    Create a Stripe payment intent - simple version
+
+    Signed-in clients should send a 'nonce' that stays the same across
+    retries of one checkout; retries then return the same PaymentIntent
+    instead of a new one.
+    """
+    request_started = time.perf_counter()
+    metrics.increment('payment_requests')
     try:
+        stripe = get_stripe()
+
         # Extract amount and currency from the request
         data = req.data
-        print(f"🔍 Request data: {data}")
+        log_debug(f"🔍 Request data: {data}")
         
         amount = data.get('amount')
-        currency = data.get('currency', 'usd')  # Default to 'usd' if not provided
+        currency = str(data.get('currency', 'usd')).lower()  # Default to 'usd' if not provided
+        nonce = data.get('nonce')
+        uid = req.auth.uid if req.auth else None
         
         print(f"Creating payment intent: amount={amount}, currency={currency}")
         
         # Validate amount
-        print(f"🔍 Amount validation: amount={amount}, type={type(amount)}")
+        log_debug(f"🔍 Amount validation: amount={amount}, type={type(amount)}")
         if amount is None:
             raise https_fn.HttpsError(
                 code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
@@ -264,7 +1105,7 @@ def create_payment_intent(req: https_fn.CallableRequest) -> any:
         # Convert to int if it's a string or float
         try:
             amount_int = int(float(amount))
-            print(f"🔍 Converted amount: {amount_int}")
+            log_debug(f"🔍 Converted amount: {amount_int}")
         except (ValueError, TypeError) as e:
             raise https_fn.HttpsError(
                 code=https_fn.FunctionsErrorCode.INVALID_ARGUMENT,
@@ -279,22 +1120,35 @@ def create_payment_intent(req: https_fn.CallableRequest) -> any:
         
         # Create a PaymentIntent with automatic payment methods (includes cards, Apple Pay, Google Pay)
         try:
-            print(f"🔍 About to create Stripe PaymentIntent with amount={amount_int}, currency={currency}")
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount_int,
-                currency=currency,
-                automatic_payment_methods={
-                    'enabled': True,
-                },
-            )
-            
-            print(f"✅ Payment intent created successfully: {payment_intent.id}")
+            log_debug(f"🔍 About to create Stripe PaymentIntent with amount={amount_int}, currency={currency}")
+            if nonce and uid:
+                idempotency_key = payment_idempotency_key(uid, amount_int, currency, str(nonce))
+                issued = issued_payment_intents.get(idempotency_key)
+                if issued is not None:
+                    cache_status = 'HIT'
+                else:
+                    issued, shared = in_flight_payments.do(
+                        idempotency_key, _issue_payment_intent, stripe, amount_int, currency, idempotency_key
+                    )
+                    cache_status = 'COALESCED' if shared else 'MISS'
+            else:
+                # Without a nonce retries cannot be told apart from new payments, and
+                # anonymous callers have no identity to keep their keys apart
+                metrics.increment('payment_without_idempotency')
+                issued = _issue_payment_intent(stripe, amount_int, currency)
+                cache_status = 'MISS'
+
+            duration = time.perf_counter() - request_started
+            metrics.observe('payment_total', duration)
+            log_json('create_payment_intent', status=200, cache=cache_status,
+                     stripe_calls=int(cache_status == 'MISS'), duration_ms=round(duration * 1000, 1))
             
             # Return the client secret - this will be wrapped in a 'data' field automatically
-            return {'clientSecret': payment_intent['client_secret']}
+            return dict(issued)
             
         except stripe.error.StripeError as stripe_error:
             print(f"❌ Stripe error: {str(stripe_error)}")
+            metrics.increment('stripe_errors')
             raise https_fn.HttpsError(
                 code=https_fn.FunctionsErrorCode.INTERNAL,
                 message=f'Stripe error: {str(stripe_error)}'
@@ -309,3 +1163,33 @@ def create_payment_intent(req: https_fn.CallableRequest) -> any:
             code=https_fn.FunctionsErrorCode.INTERNAL,
             message=f'Server error: {str(e)}'
         )
+
+
+# Metrics export for the functions package
+@https_fn.on_request()
+def functions_metrics(req: https_fn.Request) -> https_fn.Response:
+    """
+    Expose counters and per-stage latency as Prometheus text, or JSON with ?format=json
+
+    Requires 'Authorization: Bearer <METRICS_TOKEN>'; the endpoint is
+    disabled while METRICS_TOKEN is unset.
+    """
+    authorization = req.headers.get('Authorization', '')
+    if not METRICS_TOKEN or not hmac.compare_digest(authorization.encode('utf-8'),
+                                                    f'Bearer {METRICS_TOKEN}'.encode('utf-8')):
+        return https_fn.Response(
+            json.dumps({'error': 'Unauthorized'}),
+            status=401,
+            headers={'Content-Type': 'application/json', 'WWW-Authenticate': 'Bearer'}
+        )
+    if req.args.get('format') == 'json':
+        return https_fn.Response(
+            json.dumps(metrics.snapshot()),
+            status=200,
+            headers={'Content-Type': 'application/json'}
+        )
+    return https_fn.Response(
+        metrics.to_prometheus(),
+        status=200,
+        headers={'Content-Type': 'text/plain; version=0.0.4'}
+    )
@@ -0,0 +1,234 @@
+import json
+import threading
+from dataclasses import dataclass, field
+
+LANGUAGES = ("en", "he", "ru")
+HEALTHINESS_VALUES = ("healthy", "medium", "unhealthy", "N/A")
+DEFAULT_SOURCE = "https://fdc.nal.usda.gov/"
+
+
+def _localized(item_schema, languages):
+    return {
+        "type": "object",
+        "properties": {language: item_schema for language in languages},
+        "required": list(languages),
+        "additionalProperties": False,
+    }
+
+
+def build_json_schema(languages=LANGUAGES):
+    """Build the MealAnalysis JSON schema for the given output languages"""
+    return {
+        "type": "object",
+        "properties": {
+            "mealName": _localized({"type": "string"}, languages),
+            "estimatedCalories": {"type": "number"},
+            "macros": {
+                "type": "object",
+                "properties": {
+                    "proteins": {"type": "number", "description": "grams"},
+                    "carbohydrates": {"type": "number", "description": "grams"},
+                    "fats": {"type": "number", "description": "grams"},
+                },
+                "required": ["proteins", "carbohydrates", "fats"],
+                "additionalProperties": False,
+            },
+            "ingredients": _localized({"type": "array", "items": {"type": "string"}}, languages),
+            "healthiness": {"type": "string", "enum": list(HEALTHINESS_VALUES)},
+            "health_assessment": {"type": "string"},
+            "source": {"type": "string"},
+        },
+        "required": [
+            "mealName", "estimatedCalories", "macros", "ingredients",
+            "healthiness", "health_assessment", "source",
+        ],
+        "additionalProperties": False,
+    }
+
+
+def build_response_format(languages=LANGUAGES):
+    """Wrap the schema as a strict OpenAI structured-output response format"""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "meal_analysis_" + "_".join(languages),
+            "strict": True,
+            "schema": build_json_schema(languages),
+        },
+    }
+
+
+# JSON schema sent to OpenAI as a strict structured-output response format
+MEAL_ANALYSIS_JSON_SCHEMA = build_json_schema()
+MEAL_ANALYSIS_RESPONSE_FORMAT = build_response_format()
+
+
+class MealAnalysisValidationError(ValueError):
+    """Raised when model output does not match the MealAnalysis schema"""
+
+
+def _grams(value, name):
+    # Accept "30g" style strings from older prompts alongside plain numbers
+    if isinstance(value, str):
+        value = value.strip().lower().rstrip("g").strip()
+        try:
+            value = float(value)
+        except ValueError:
+            raise MealAnalysisValidationError(f"macros.{name} is not a number of grams")
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise MealAnalysisValidationError(f"macros.{name} must be a non-negative number")
+    return value
+
+
+def _localized_value(data, name, validate_item):
+    value = data.get(name)
+    if not isinstance(value, dict) or not isinstance(value.get("en"), (str, list)):
+        raise MealAnalysisValidationError(f"{name} must be an object with at least an 'en' entry")
+    result = {}
+    for language, item in value.items():
+        result[language] = validate_item(item, f"{name}.{language}")
+    return result
+
+
+def _string(item, name):
+    if not isinstance(item, str):
+        raise MealAnalysisValidationError(f"{name} must be a string")
+    return item
+
+
+def _string_list(item, name):
+    if not isinstance(item, list) or not all(isinstance(entry, str) for entry in item):
+        raise MealAnalysisValidationError(f"{name} must be a list of strings")
+    return item
+
+
+def _format_grams(value):
+    return f"{value:g}g"
+
+
+@dataclass
+class MealAnalysis:
+    """Typed meal analysis with numeric macros and localized name and ingredients"""
+
+    meal_name: dict
+    estimated_calories: float
+    proteins: float
+    carbohydrates: float
+    fats: float
+    ingredients: dict
+    healthiness: str = "N/A"
+    health_assessment: str = ""
+    source: str = DEFAULT_SOURCE
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Validate a decoded model response
+
+        Args:
+            data (dict): Decoded JSON object
+
+        Returns:
+            MealAnalysis: The validated analysis
+
+        Raises:
+            MealAnalysisValidationError: If a field is missing or has the wrong type
+        """
+        if not isinstance(data, dict):
+            raise MealAnalysisValidationError("analysis must be a JSON object")
+
+        calories = data.get("estimatedCalories")
+        if isinstance(calories, bool) or not isinstance(calories, (int, float)) or calories < 0:
+            raise MealAnalysisValidationError("estimatedCalories must be a non-negative number")
+
+        macros = data.get("macros")
+        if not isinstance(macros, dict):
+            raise MealAnalysisValidationError("macros must be an object")
+
+        healthiness = data.get("healthiness", "N/A")
+        if healthiness not in HEALTHINESS_VALUES:
+            healthiness = "N/A"
+
+        source = data.get("source")
+        if not isinstance(source, str) or not source.startswith(("http://", "https://")):
+            source = DEFAULT_SOURCE
+
+        health_assessment = data.get("health_assessment", "")
+        if not isinstance(health_assessment, str):
+            raise MealAnalysisValidationError("health_assessment must be a string")
+
+        return cls(
+            meal_name=_localized_value(data, "mealName", _string),
+            estimated_calories=calories,
+            proteins=_grams(macros.get("proteins"), "proteins"),
+            carbohydrates=_grams(macros.get("carbohydrates"), "carbohydrates"),
+            fats=_grams(macros.get("fats"), "fats"),
+            ingredients=_localized_value(data, "ingredients", _string_list),
+            healthiness=healthiness,
+            health_assessment=health_assessment,
+            source=source,
+        )
+
+    def to_response(self):
+        """Return the wire format the app expects, with macros as 'Xg' strings"""
+        return {
+            "mealName": self.meal_name,
+            "estimatedCalories": self.estimated_calories,
+            "macros": {
+                "proteins": _format_grams(self.proteins),
+                "carbohydrates": _format_grams(self.carbohydrates),
+                "fats": _format_grams(self.fats),
+            },
+            "ingredients": self.ingredients,
+            "healthiness": self.healthiness,
+            "health_assessment": self.health_assessment,
+            "source": self.source,
+        }
+
+
+def decode_meal_analysis(text):
+    """
+    Decode and validate structured model output in one pass
+
+    Raises:
+        MealAnalysisValidationError: If the text is not valid JSON or fails validation
+    """
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise MealAnalysisValidationError(f"invalid JSON: {str(e)}") from e
+    return MealAnalysis.from_dict(data)
+
+
+@dataclass
+class ParseMetrics:
+    """Counters and timings for how analysis output was parsed"""
+
+    outcomes: dict = field(default_factory=dict)
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, outcome, seconds):
+        """Record one parse: 'structured', 'repaired', 'legacy' or 'failed'"""
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def snapshot(self):
+        """Return counters, failed-parse rate and parse times in milliseconds"""
+        with self._lock:
+            total = sum(self.outcomes.values())
+            failed = self.outcomes.get("failed", 0)
+            return {
+                "outcomes": dict(self.outcomes),
+                "total": total,
+                "failed_rate": failed / total if total else 0.0,
+                "avg_ms": self.total_seconds * 1000 / total if total else 0.0,
+                "max_ms": self.max_seconds * 1000,
+            }
+
+
+parse_metrics = ParseMetrics()
+
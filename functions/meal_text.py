@@ -0,0 +1,133 @@
+import re
+
+from meal_schema import DEFAULT_SOURCE, MealAnalysis
+
+# Units converted straight to grams (liquids at roughly 1 g/ml); other units
+# such as cups or slices use the food's typical USDA portion
+UNIT_GRAMS = {
+    "g": 1.0, "gram": 1.0, "grams": 1.0, "kg": 1000.0,
+    "ml": 1.0, "l": 1000.0,
+    "oz": 28.35, "ounce": 28.35, "ounces": 28.35,
+    "lb": 453.6, "lbs": 453.6, "pound": 453.6, "pounds": 453.6,
+}
+PORTION_UNITS = (
+    "cups", "cup", "tbsp", "tablespoons", "tablespoon", "tsp", "teaspoons", "teaspoon",
+    "slices", "slice", "pieces", "piece", "servings", "serving", "bowls", "bowl", "glasses", "glass",
+)
+WORD_NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "half": 0.5}
+
+# Portion assumed when neither the entry nor the index gives one
+DEFAULT_PORTION_GRAMS = 100.0
+
+_SEPARATORS = re.compile(r"(?<!\d),|,(?!\d)|;|\n|\+|\band\b|\bwith\b", re.IGNORECASE)
+_NUMBER = r"\d+/\d+|\d+(?:[.,]\d+)?"
+_UNITS = "|".join(sorted(list(UNIT_GRAMS) + list(PORTION_UNITS), key=len, reverse=True))
+_ITEM = re.compile(
+    r"^(?P<quantity>" + _NUMBER + "|" + "|".join(WORD_NUMBERS) + r")?\s*"
+    r"(?P<unit>" + _UNITS + r")?\b\s*"
+    r"(?:of\s+)?(?P<name>.*)$",
+    re.IGNORECASE,
+)
+# Quantity after the name, e.g. 'grilled chicken breast 200g' or 'eggs x2'
+_TRAILING_QUANTITY = re.compile(
+    r"^(?P<name>.+?)(?:\s+(?:x\s*)?|\s*[:-]\s*)(?P<quantity>" + _NUMBER + r")\s*(?P<unit>" + _UNITS + r")?$",
+    re.IGNORECASE,
+)
+
+
+def _quantity(text):
+    if not text:
+        return 1.0
+    text = text.lower()
+    if text in WORD_NUMBERS:
+        return float(WORD_NUMBERS[text])
+    if "/" in text:
+        numerator, denominator = text.split("/")
+        return float(numerator) / float(denominator) if float(denominator) else 1.0
+    return float(text.replace(",", "."))
+
+
+def parse_meal_text(text):
+    """
+    Split a free-text meal entry into items with quantities
+
+    Args:
+        text (str): e.g. '2 eggs, 150g rice and a slice of toast' or 'chicken breast 200g'
+
+    Returns:
+        list: dicts with 'name', 'quantity' and 'unit' (None for plain counts)
+    """
+    items = []
+    for part in _SEPARATORS.split(text):
+        part = part.strip(" .-\t")
+        if not part:
+            continue
+        match = _ITEM.match(part)
+        if not match.group("quantity") and not match.group("unit"):
+            match = _TRAILING_QUANTITY.match(part) or match
+        name = match.group("name").strip()
+        if not name:
+            continue
+        unit = match.group("unit")
+        items.append({
+            "name": name,
+            "quantity": _quantity(match.group("quantity")),
+            "unit": unit.lower() if unit else None,
+        })
+    return items
+
+
+def _grams(item, food):
+    if item["unit"] in UNIT_GRAMS:
+        return item["quantity"] * UNIT_GRAMS[item["unit"]]
+    portion = food.get("portion")
+    return item["quantity"] * (portion["grams"] if portion else DEFAULT_PORTION_GRAMS)
+
+
+def estimate_meal(text, nutrient_index):
+    """
+    Estimate calories and macros for a text meal entry from the nutrient index
+
+    Args:
+        text (str): Free-text meal description
+        nutrient_index (NutrientIndex): Index used to resolve each item
+
+    Returns:
+        tuple: (MealAnalysis or None if no item matched, list of per-item
+        results, list of unmatched item names)
+    """
+    items = parse_meal_text(text)
+    resolved = []
+    unmatched = []
+    for item, food in zip(items, nutrient_index.lookup_many([item["name"] for item in items])):
+        if food is None:
+            unmatched.append(item["name"])
+            continue
+        grams = _grams(item, food)
+        scale = grams / 100.0
+        per_100g = food["per_100g"]
+        resolved.append({
+            "name": item["name"],
+            "grams": round(grams, 1),
+            "fdc_id": food["fdc_id"],
+            "description": food["description"],
+            "calories": round(per_100g["calories"] * scale, 1),
+            "proteins": round(per_100g["proteins"] * scale, 1),
+            "carbohydrates": round(per_100g["carbohydrates"] * scale, 1),
+            "fats": round(per_100g["fats"] * scale, 1),
+        })
+
+    if not resolved:
+        return None, resolved, unmatched
+
+    analysis = MealAnalysis(
+        meal_name={"en": text.strip()},
+        estimated_calories=round(sum(item["calories"] for item in resolved)),
+        proteins=round(sum(item["proteins"] for item in resolved), 1),
+        carbohydrates=round(sum(item["carbohydrates"] for item in resolved), 1),
+        fats=round(sum(item["fats"] for item in resolved), 1),
+        ingredients={"en": [item["name"] for item in resolved]},
+        health_assessment="Estimated from USDA FoodData Central values for the logged items.",
+        source=DEFAULT_SOURCE,
+    )
+    return analysis, resolved, unmatched
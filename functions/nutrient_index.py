@@ -0,0 +1,291 @@
+import os
+import re
+import csv
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Location of the prebuilt index; build it with `python nutrient_index.py build <export dir>`
+NUTRIENT_INDEX_DB = os.environ.get(
+    "NUTRIENT_INDEX_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrients.sqlite")
+)
+NUTRIENT_LOOKUP_CACHE_SIZE = int(os.environ.get("NUTRIENT_LOOKUP_CACHE_SIZE", "4096"))
+
+# FoodData Central nutrient ids; Foundation foods report energy under the
+# Atwater ids instead of 1008
+ENERGY_NUTRIENT_IDS = (1008, 2047, 2048)
+PROTEIN_NUTRIENT_ID = 1003
+FAT_NUTRIENT_ID = 1004
+CARBOHYDRATE_NUTRIENT_ID = 1005
+
+# Generic foods only; branded products are millions of rows and rarely what a meal photo shows.
+# Lower priority wins when several foods match equally well.
+DATA_TYPE_PRIORITY = {"foundation_food": 0, "sr_legacy_food": 1, "survey_fndds_food": 2}
+
+_SCHEMA = """
+CREATE TABLE foods (
+    fdc_id INTEGER PRIMARY KEY,
+    description TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    calories REAL,
+    protein REAL,
+    carbohydrates REAL,
+    fat REAL,
+    portion_grams REAL,
+    portion_label TEXT
+);
+CREATE VIRTUAL TABLE foods_fts USING fts5(
+    description, content='foods', content_rowid='fdc_id', tokenize='porter unicode61'
+);
+"""
+
+
+def _read_csv(export_dir, name):
+    with open(os.path.join(export_dir, name), newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def build_nutrient_index(export_dir, db_path=NUTRIENT_INDEX_DB, data_types=tuple(DATA_TYPE_PRIORITY)):
+    """
+    Build the SQLite nutrient index from a FoodData Central CSV export
+
+    Reads food.csv, food_nutrient.csv and, if present, food_portion.csv from
+    the unzipped "Full Download of All Data Types" (or a subset such as SR
+    Legacy), keeping per-100g energy and macros plus one typical portion.
+
+    Args:
+        export_dir (str): Directory holding the FDC CSV files
+        db_path (str): Output SQLite file, replaced if it exists
+        data_types (tuple): FDC data_type values to include
+
+    Returns:
+        int: Number of foods written
+    """
+    started = time.perf_counter()
+    foods = {}
+    for row in _read_csv(export_dir, "food.csv"):
+        if row["data_type"] in data_types:
+            foods[int(row["fdc_id"])] = {
+                "description": row["description"],
+                "priority": DATA_TYPE_PRIORITY.get(row["data_type"], len(DATA_TYPE_PRIORITY)),
+            }
+
+    wanted = {PROTEIN_NUTRIENT_ID: "protein", FAT_NUTRIENT_ID: "fat", CARBOHYDRATE_NUTRIENT_ID: "carbohydrates"}
+    for row in _read_csv(export_dir, "food_nutrient.csv"):
+        food = foods.get(int(row["fdc_id"]))
+        if food is None:
+            continue
+        nutrient_id = int(row["nutrient_id"])
+        amount = _float(row["amount"])
+        if nutrient_id in wanted:
+            food[wanted[nutrient_id]] = amount
+        elif nutrient_id in ENERGY_NUTRIENT_IDS and amount is not None:
+            # Prefer the id listed first when a food reports several energy values
+            rank = ENERGY_NUTRIENT_IDS.index(nutrient_id)
+            if rank < food.get("_energy_rank", len(ENERGY_NUTRIENT_IDS)):
+                food["calories"] = amount
+                food["_energy_rank"] = rank
+
+    if os.path.exists(os.path.join(export_dir, "food_portion.csv")):
+        first_seq = {}
+        for row in _read_csv(export_dir, "food_portion.csv"):
+            fdc_id = int(row["fdc_id"])
+            food = foods.get(fdc_id)
+            grams = _float(row["gram_weight"])
+            if food is None or not grams:
+                continue
+            seq = _float(row.get("seq_num")) or 0
+            if fdc_id in first_seq and first_seq[fdc_id] <= seq:
+                continue
+            first_seq[fdc_id] = seq
+            amount = _float(row.get("amount"))
+            label = row.get("portion_description") or " ".join(
+                part for part in (f"{amount:g}" if amount else "", row.get("modifier", "")) if part
+            )
+            food["portion_grams"] = grams
+            food["portion_label"] = label or None
+
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    temporary_path = db_path + ".building"
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    connection = sqlite3.connect(temporary_path)
+    with connection:
+        connection.executescript(_SCHEMA)
+        connection.executemany(
+            "INSERT INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (fdc_id, food["description"], food["priority"], food.get("calories"), food.get("protein"),
+                 food.get("carbohydrates"), food.get("fat"), food.get("portion_grams"), food.get("portion_label"))
+                for fdc_id, food in foods.items()
+                if food.get("calories") is not None
+            ),
+        )
+        connection.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+        connection.execute("INSERT INTO foods_fts(foods_fts) VALUES ('optimize')")
+        count = connection.execute("SELECT COUNT(*) FROM foods").fetchone()[0]
+    connection.execute("VACUUM")
+    connection.close()
+    os.replace(temporary_path, db_path)
+    print(f"🥗 Nutrient index built: {count} foods -> {db_path} ({time.perf_counter() - started:.1f}s)")
+    return count
+
+
+def normalize_ingredient(name):
+    """Lowercase an ingredient name and keep only its word characters"""
+    return " ".join(re.findall(r"[^\W_]+", name.lower()))
+
+
+class NutrientIndex:
+    """
+    Read-only lookups of per-100g macros by ingredient name
+
+    Each thread gets its own memory-mapped connection to the immutable
+    SQLite file; resolved names are memoized in a bounded LRU so repeated
+    ingredients cost a dict lookup.
+    """
+
+    def __init__(self, db_path=NUTRIENT_INDEX_DB, cache_size=NUTRIENT_LOOKUP_CACHE_SIZE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._local = threading.local()
+        self._memo = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.memo_hits = 0
+        self.unmatched = 0
+        self.query_seconds = 0.0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"file:{self.db_path}?mode=ro&immutable=1", uri=True,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA mmap_size = 268435456")
+            self._local.connection = connection
+        return connection
+
+    def lookup(self, name):
+        """
+        Resolve one ingredient name to the best matching food
+
+        Args:
+            name (str): Ingredient name, e.g. 'grilled chicken breast'
+
+        Returns:
+            dict or None: fdc_id, description, per_100g macros and a typical
+            portion, or None if nothing matches
+        """
+        key = normalize_ingredient(name)
+        with self._lock:
+            self.lookups += 1
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.memo_hits += 1
+                return self._memo[key]
+
+        started = time.perf_counter()
+        food = self._query(key) if key else None
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.query_seconds += elapsed
+            self.unmatched += food is None
+            self._memo[key] = food
+            if len(self._memo) > self.cache_size:
+                self._memo.popitem(last=False)
+        return food
+
+    def lookup_many(self, names):
+        """Resolve a list of ingredient names, keeping None for names without a match"""
+        return [self.lookup(name) for name in names]
+
+    def _query(self, key):
+        words = key.split()
+        match = self._match(words)
+        if match is None:
+            # Words no food description contains (typos, brands, stray quantities) fail
+            # every query, so drop them; then try ever shorter runs of the remaining
+            # words ('organic chicken breast fresh' -> 'chicken breast') and keep the
+            # best-ranked food among the longest runs that match
+            known = [word for word in words if self._contains(word)]
+            for size in range(len(known), 0, -1):
+                runs = [known[start:start + size] for start in range(len(known) - size + 1)]
+                matches = [found for found in map(self._match, runs) if found is not None]
+                if matches:
+                    match = min(matches, key=lambda found: found[0])
+                    break
+        return match[1] if match is not None else None
+
+    def _contains(self, word):
+        return self._connection().execute(
+            "SELECT 1 FROM foods_fts WHERE foods_fts MATCH ? LIMIT 1", (f'"{word}"',)
+        ).fetchone() is not None
+
+    def _match(self, words):
+        """Return (rank score, food) for the best food containing every word, or None"""
+        match = " ".join(f'"{word}"' for word in words)
+        row = self._connection().execute(
+            "SELECT bm25(foods_fts) + priority * 0.5 AS score, foods.fdc_id, foods.description, calories, protein, "
+            "carbohydrates, fat, portion_grams, portion_label "
+            "FROM foods_fts JOIN foods ON foods.fdc_id = foods_fts.rowid "
+            "WHERE foods_fts MATCH ? ORDER BY score LIMIT 1",
+            (match,),
+        ).fetchone()
+        if row is None:
+            return None
+        score, row = row[0], row[1:]
+        return score, {
+            "fdc_id": row[0],
+            "description": row[1],
+            "per_100g": {
+                "calories": row[2],
+                "proteins": row[3] or 0.0,
+                "carbohydrates": row[4] or 0.0,
+                "fats": row[5] or 0.0,
+            },
+            "portion": {"grams": row[6], "label": row[7]} if row[6] else None,
+        }
+
+    def stats(self):
+        """Return lookup counts, memo hit rate and average query time in microseconds"""
+        with self._lock:
+            queries = self.lookups - self.memo_hits
+            return {
+                "lookups": self.lookups,
+                "memo_hits": self.memo_hits,
+                "memo_hit_rate": self.memo_hits / self.lookups if self.lookups else 0.0,
+                "unmatched": self.unmatched,
+                "avg_query_us": self.query_seconds * 1e6 / queries if queries else 0.0,
+            }
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_nutrient_index():
+    """Return the per-instance NutrientIndex, or None if no index file has been deployed"""
+    global _default_index
+    if _default_index is None and os.path.exists(NUTRIENT_INDEX_DB):
+        with _default_index_lock:
+            if _default_index is None:
+                _default_index = NutrientIndex()
+    return _default_index
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (3, 4) or sys.argv[1] != "build":
+        print("Usage: python nutrient_index.py build <FDC CSV export dir> [output.sqlite]")
+        sys.exit(1)
+    build_nutrient_index(sys.argv[2], *sys.argv[3:])
@@ -1,158 +1,572 @@
 import os
 import json
+import base64
+import time
+import threading
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from instrumentation import log_debug
+from resilience import (
+    RETRYABLE_STATUS_CODES,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryBudget,
+    RetryPolicy,
+    parse_retry_after,
+)
 
-# Load environment variables
-load_dotenv()
+# Vision model used for meal analysis
+VISION_MODEL = "gpt-4o-mini"
 
-# Get API key from environment variables
-api_key = os.environ.get("OPENAI_API_KEY", "")
+# Default connection settings for the pooled OpenAI session; the
+# OPENAI_BASE_URL, OPENAI_POOL_MAXSIZE, OPENAI_CONNECT_TIMEOUT and
+# OPENAI_READ_TIMEOUT environment variables override them
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
 
-if api_key and len(api_key) > 10:
-    print("🔑 OpenAI API key loaded successfully")
-else:
-    print("❌ OpenAI API key not configured or invalid")
-    print("📝 Please set OPENAI_API_KEY in your .env file")
-    print("📝 Get your key from: https://platform.openai.com/api-keys")
+# Stands in for the data: URL of raw image bytes until the request body is
+# serialized, so the image is base64-encoded once, straight into the body
+IMAGE_BYTES_PLACEHOLDER = "__meal_tracker_image_bytes__"
 
-def analyze_image_with_vision(image_url=None, prompt=None, image_base64=None):
+_environment_loaded = False
+
+
+def load_environment():
     """
-    Analyze an image using OpenAI's Vision capabilities
-    
+    Load .env and report whether the OpenAI key is configured
+
+    Runs once, on first client creation rather than at import, so entry
+    points that never call OpenAI do not pay for it on cold start.
+    """
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    _environment_loaded = True
+
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    api_key = os.environ.get("OPENAI_API_KEY", "")
+    if api_key and len(api_key) > 10:
+        print("🔑 OpenAI API key loaded successfully")
+    else:
+        print("❌ OpenAI API key not configured or invalid")
+        print("📝 Please set OPENAI_API_KEY in your .env file")
+        print("📝 Get your key from: https://platform.openai.com/api-keys")
+
+
+def encode_request_body(payload, image_bytes=None, image_mime_type="image/jpeg"):
+    """
+    Serialize a request payload to JSON bytes
+
     Args:
-        image_url (str, optional): URL of the image to analyze
-        prompt (str): Instructions for the analysis
-        image_base64 (str, optional): Base64 encoded image data
-        
+        payload (dict): Request body, with IMAGE_BYTES_PLACEHOLDER as the image
+            URL when image_bytes is given
+        image_bytes (bytes-like, optional): Raw image, base64-encoded directly
+            into the serialized body instead of into an intermediate string
+        image_mime_type (str): MIME type for the data: URL
+
     Returns:
-        str or dict: The analysis result from OpenAI
+        bytes: The UTF-8 JSON body
     """
-    try:
-        print(f"🔍 Starting OpenAI Vision API call...")
-        print(f"🔍 API key configured: {'Yes' if api_key and len(api_key) > 10 else 'No/Invalid'}")
-        print(f"🔍 API key length: {len(api_key) if api_key else 0}")
-        
-        if image_url:
-            print(f"🔍 Image URL: {image_url[:100]}..." if len(image_url) > 100 else f"🔍 Image URL: {image_url}")
-        if image_base64:
-            print(f"🔍 Image base64: {len(image_base64)} characters")
-        
-        if not api_key:
-            error_msg = "OpenAI API key not configured in environment variables"
-            print(f"❌ {error_msg}")
-            return {"error": error_msg}
-        
-        if len(api_key) < 20:  # OpenAI keys are typically much longer
-            error_msg = f"OpenAI API key appears to be invalid (too short: {len(api_key)} characters)"
-            print(f"❌ {error_msg}")
-            return {"error": error_msg}
-        
-        # Validate image input
-        if not image_url and not image_base64:
-            error_msg = "Either image_url or image_base64 must be provided"
-            print(f"❌ {error_msg}")
-            return {"error": error_msg}
-        
-        if image_url and not image_url.startswith(('http://', 'https://')):
-            error_msg = f"Invalid image URL format: {image_url}"
-            print(f"❌ {error_msg}")
-            return {"error": error_msg}
-        
-        # Manually construct the API request instead of using the client library
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
+    body = json.dumps(payload).encode("utf-8")
+    if image_bytes is None:
+        return body
+    head, _, tail = body.partition(IMAGE_BYTES_PLACEHOLDER.encode("ascii"))
+    return b"".join((head, f"data:{image_mime_type};base64,".encode("ascii"), base64.b64encode(image_bytes), tail))
+
+
+def build_vision_payload(model, max_tokens, prompt, image_url=None, image_base64=None, image_mime_type="image/jpeg",
+                         stream=False, response_format=None, image_bytes=None):
+    """
+    Build the chat completions request body for a single image
+
+    Raw image_bytes are not embedded here: the image URL is left as
+    IMAGE_BYTES_PLACEHOLDER and filled in by encode_request_body().
+    """
+    # Prepare image content based on input type
+    if image_bytes is not None:
+        image_content = {
+            "type": "image_url",
+            "image_url": {"url": IMAGE_BYTES_PLACEHOLDER}
+        }
+        log_debug(f"🔍 Using raw image bytes ({len(image_bytes)} bytes)")
+    elif image_base64:
+        image_content = {
+            "type": "image_url",
+            "image_url": {"url": f"data:{image_mime_type};base64,{image_base64}"}
+        }
+        log_debug(f"🔍 Using base64 image data")
+    else:
+        image_content = {
+            "type": "image_url",
+            "image_url": {"url": image_url}
         }
-        
-        # Prepare image content based on input type
-        if image_base64:
-            image_content = {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}
+        log_debug(f"🔍 Using image URL")
+
+    payload = {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    image_content
+                ]
             }
-            print(f"🔍 Using base64 image data")
-        else:
-            image_content = {
-                "type": "image_url",
-                "image_url": {"url": image_url}
+        ],
+        "max_tokens": max_tokens
+    }
+    if stream:
+        payload["stream"] = True
+        payload["stream_options"] = {"include_usage": True}
+    if response_format is not None:
+        payload["response_format"] = response_format
+    return payload
+
+
+class VisionClient:
+    """
+    Reusable OpenAI Vision client holding a pooled keep-alive HTTP session
+
+    Create one per instance and reuse it across invocations so warm requests
+    skip the TCP and TLS handshake to the API host.
+    """
+
+    def __init__(self, api_key=None, base_url=None, model=VISION_MODEL, max_tokens=1000,
+                 pool_connections=1, pool_maxsize=None, connect_timeout=None, read_timeout=None,
+                 retry_policy=None, retry_budget=None, circuit_breaker=None):
+        """
+        Args:
+            api_key (str, optional): OpenAI API key, defaults to OPENAI_API_KEY
+            base_url (str, optional): API base URL, e.g. a local stub server for benchmarks
+            model (str): Vision model name
+            max_tokens (int): Completion token limit
+            pool_connections (int): Number of host pools to cache
+            pool_maxsize (int): Maximum keep-alive connections per host
+            connect_timeout (float): Seconds allowed to establish a connection
+            read_timeout (float): Seconds allowed between bytes of the response
+            retry_policy (RetryPolicy, optional): Backoff settings for retryable failures
+            retry_budget (RetryBudget, optional): Limits retries to a share of traffic
+            circuit_breaker (CircuitBreaker, optional): Fails fast while OpenAI is unhealthy
+        """
+        load_environment()
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY", "")
+        self.base_url = (base_url or os.environ.get("OPENAI_BASE_URL", DEFAULT_BASE_URL)).rstrip("/")
+        self.model = model
+        self.max_tokens = max_tokens
+        if pool_maxsize is None:
+            pool_maxsize = int(os.environ.get("OPENAI_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+        self.connect_timeout = connect_timeout or float(os.environ.get("OPENAI_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT))
+        self.read_timeout = read_timeout or float(os.environ.get("OPENAI_READ_TIMEOUT", DEFAULT_READ_TIMEOUT))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}",
+            "Connection": "keep-alive",
+        })
+
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self.retries = 0
+        self.retries_exhausted = 0
+        self.budget_denied = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def completions_url(self):
+        return f"{self.base_url}/chat/completions"
+
+    def close(self):
+        """Release pooled connections"""
+        self.session.close()
+
+    def resilience_stats(self):
+        """Return retry counters and circuit breaker state"""
+        with self._stats_lock:
+            stats = {
+                "retries": self.retries,
+                "retries_exhausted": self.retries_exhausted,
+                "budget_denied": self.budget_denied,
+                "budget_tokens": self.retry_budget.tokens,
             }
-            print(f"🔍 Using image URL")
+        stats["breaker"] = self.circuit_breaker.stats()
+        return stats
+
+    def _count(self, counter):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def send(self, payload, stream=False, image_bytes=None, image_mime_type="image/jpeg"):
+        """
+        POST a completion request through the circuit breaker and retry policy
+
+        Timeouts, connection errors and retryable statuses (429, 5xx) are
+        retried with jittered exponential backoff, honoring Retry-After, as
+        long as the retry budget allows. The body is serialized once and
+        reused across attempts.
+
+        Args:
+            payload (dict): Request body
+            stream (bool): Whether to stream the response body
+            image_bytes (bytes-like, optional): Raw image for the placeholder image URL
+            image_mime_type (str): MIME type of image_bytes
+
+        Returns:
+            requests.Response: The final response, which may still be an error status
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            requests.exceptions.RequestException: If the last attempt failed to connect or timed out
+        """
+        if not self.circuit_breaker.allow_request():
+            raise CircuitOpenError("OpenAI circuit breaker is open; failing fast")
+
+        body = encode_request_body(payload, image_bytes, image_mime_type)
+        self.retry_budget.deposit()
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.post(
+                    self.completions_url,
+                    data=body,
+                    stream=stream,
+                    timeout=(self.connect_timeout, self.read_timeout)
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                self.circuit_breaker.record_failure()
+                delay = self.retry_policy.delay(attempt)
+                if not self._may_retry(attempt, started, delay):
+                    raise
+                print(f"🔁 OpenAI request failed to complete, retrying in {delay:.2f}s (attempt {attempt})")
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                # Non-retryable 4xx responses mean a bad request, not an unhealthy upstream
+                self.circuit_breaker.record_success()
+                return response
+
+            self.circuit_breaker.record_failure()
+            delay = self.retry_policy.delay(attempt, parse_retry_after(response.headers.get("Retry-After")))
+            if not self._may_retry(attempt, started, delay):
+                return response
+            print(f"🔁 OpenAI returned {response.status_code}, retrying in {delay:.2f}s (attempt {attempt})")
+            response.close()
+            time.sleep(delay)
+
+    def _may_retry(self, attempt, started, delay):
+        if not self.retry_policy.can_retry(attempt, started, delay):
+            self._count("retries_exhausted")
+            return False
+        if not self.circuit_breaker.allow_request():
+            return False
+        if not self.retry_budget.try_spend():
+            self._count("budget_denied")
+            return False
+        self._count("retries")
+        return True
+
+    def build_payload(self, prompt, image_url=None, image_base64=None, image_mime_type="image/jpeg",
+                      stream=False, response_format=None, image_bytes=None):
+        """Build the chat completions request body for a single image"""
+        return build_vision_payload(self.model, self.max_tokens, prompt, image_url=image_url,
+                                    image_base64=image_base64, image_mime_type=image_mime_type, stream=stream,
+                                    response_format=response_format, image_bytes=image_bytes)
+
+    def stream_analyze(self, image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                       response_format=None, usage_callback=None, image_bytes=None):
+        """
+        Stream an image analysis as content deltas
+
+        Consumes the server-sent events of a streaming chat completion.
+
+        Args:
+            image_url (str, optional): URL of the image to analyze
+            prompt (str): Instructions for the analysis
+            image_base64 (str, optional): Base64 encoded image data
+            image_mime_type (str): MIME type of the base64 image data or image bytes
+            response_format (dict, optional): OpenAI response_format, e.g. a JSON schema
+            usage_callback (callable, optional): Called with the OpenAI usage dict
+            image_bytes (bytes-like, optional): Raw image data, used instead of image_base64
+
+        Yields:
+            str: Content text as it arrives
+
+        Raises:
+            Exception: If the key is missing or the API returns an error
+        """
+        if not self.api_key:
+            raise Exception("OpenAI API key not configured in environment variables")
+
+        payload = self.build_payload(prompt, image_url=image_url, image_base64=image_base64,
+                                     image_mime_type=image_mime_type, stream=True,
+                                     response_format=response_format, image_bytes=image_bytes)
+
+        print(f"🚀 Making streaming OpenAI API request...")
+        with self.send(payload, stream=True, image_bytes=image_bytes, image_mime_type=image_mime_type) as response:
+            print(f"📥 OpenAI streaming response status: {response.status_code}")
+            if response.status_code != 200:
+                raise Exception(f"API call failed with status {response.status_code}: {response.text[:200]}")
 
+            for raw_line in response.iter_lines():
+                line = raw_line.decode("utf-8")
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if usage_callback is not None and event.get("usage"):
+                    usage_callback(event["usage"])
+                for choice in event.get("choices", []):
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+
+    def analyze(self, image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                response_format=None, usage_callback=None, image_bytes=None):
+        """
+        Analyze an image using OpenAI's Vision capabilities
+
+        Args:
+            image_url (str, optional): URL of the image to analyze
+            prompt (str): Instructions for the analysis
+            image_base64 (str, optional): Base64 encoded image data
+            image_mime_type (str): MIME type of the base64 image data or image bytes
+            response_format (dict, optional): OpenAI response_format, e.g. a JSON schema
+            usage_callback (callable, optional): Called with the OpenAI usage dict
+            image_bytes (bytes-like, optional): Raw image data, used instead of image_base64
+
+        Returns:
+            str or dict: The analysis result from OpenAI
+        """
+        try:
+            log_debug(f"🔍 Starting OpenAI Vision API call...")
+            log_debug(f"🔍 API key configured: {'Yes' if self.api_key and len(self.api_key) > 10 else 'No/Invalid'}")
+            log_debug(f"🔍 API key length: {len(self.api_key) if self.api_key else 0}")
+
+            if image_url:
+                log_debug(f"🔍 Image URL: {image_url[:100]}..." if len(image_url) > 100 else f"🔍 Image URL: {image_url}")
+            if image_base64:
+                log_debug(f"🔍 Image base64: {len(image_base64)} characters")
+            if image_bytes is not None:
+                log_debug(f"🔍 Image bytes: {len(image_bytes)} bytes")
+
+            if not self.api_key:
+                error_msg = "OpenAI API key not configured in environment variables"
+                print(f"❌ {error_msg}")
+                return {"error": error_msg}
+
+            if len(self.api_key) < 20:  # OpenAI keys are typically much longer
+                error_msg = f"OpenAI API key appears to be invalid (too short: {len(self.api_key)} characters)"
+                print(f"❌ {error_msg}")
+                return {"error": error_msg}
+
+            # Validate image input
+            if not image_url and not image_base64 and not image_bytes:
+                error_msg = "Either image_url or image_base64 must be provided"
+                print(f"❌ {error_msg}")
+                return {"error": error_msg}
+
+            if image_url and not image_url.startswith(('http://', 'https://')):
+                error_msg = f"Invalid image URL format: {image_url}"
+                print(f"❌ {error_msg}")
+                return {"error": error_msg}
+
+            # Manually construct the API request instead of using the client library.
+            # Auth and content-type headers live on the pooled session.
+            payload = self.build_payload(prompt, image_url=image_url, image_base64=image_base64,
+                                         image_mime_type=image_mime_type, response_format=response_format,
+                                         image_bytes=image_bytes)
+            return self.post_completion(payload, usage_callback=usage_callback,
+                                        image_bytes=image_bytes, image_mime_type=image_mime_type)
+
+        except Exception as e:
+            error_msg = f"Unexpected error in OpenAI Vision API call: {str(e)}"
+            print(f"❌ {error_msg}")
+            print(f"❌ Error type: {type(e).__name__}")
+            return {"error": error_msg}
+
+    def repair_json(self, broken_output, validation_error, response_format=None):
+        """
+        Ask the model to fix output that failed validation, without resending the image
+
+        Args:
+            broken_output (str): The model output that failed validation
+            validation_error (str): Why it failed
+            response_format (dict, optional): OpenAI response_format to enforce
+
+        Returns:
+            str or dict: The repaired content, or {"error": ...} on failure
+        """
         payload = {
-            "model": "gpt-4o-mini",
+            "model": self.model,
             "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        image_content
-                    ]
+                    "content": (
+                        "The following JSON failed validation with this error: "
+                        f"{validation_error}\n\nReturn only the corrected JSON object.\n\n{broken_output}"
+                    )
                 }
             ],
-            "max_tokens": 1000
+            "max_tokens": self.max_tokens
         }
-        
-        print(f"🚀 Making OpenAI API request...")
-        print(f"🚀 Model: {payload['model']}")
-        print(f"🚀 Max tokens: {payload['max_tokens']}")
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=payload,
-            timeout=30  # Add timeout
-        )
-        
-        print(f"📥 OpenAI API response status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()
-            print(f"✅ OpenAI API call successful")
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-                print(f"✅ Got content from OpenAI (length: {len(content)})")
-                return content
+        if response_format is not None:
+            payload["response_format"] = response_format
+        return self.post_completion(payload)
+
+    def post_completion(self, payload, usage_callback=None, image_bytes=None, image_mime_type="image/jpeg"):
+        """
+        Send a chat completions request on the pooled session
+
+        Args:
+            payload (dict): Request body
+            usage_callback (callable, optional): Called with the OpenAI usage dict
+            image_bytes (bytes-like, optional): Raw image for the placeholder image URL
+            image_mime_type (str): MIME type of image_bytes
+
+        Returns:
+            str or dict: The message content, or {"error": ...} on failure
+        """
+        try:
+            print(f"🚀 Making OpenAI API request...")
+            log_debug(f"🚀 Model: {payload['model']}")
+            log_debug(f"🚀 Max tokens: {payload['max_tokens']}")
+
+            response = self.send(payload, image_bytes=image_bytes, image_mime_type=image_mime_type)
+
+            print(f"📥 OpenAI API response status: {response.status_code}")
+
+            if response.status_code == 200:
+                result = response.json()
+                log_debug(f"✅ OpenAI API call successful")
+                if usage_callback is not None and result.get("usage"):
+                    usage_callback(result["usage"])
+                if "choices" in result and len(result["choices"]) > 0:
+                    content = result["choices"][0]["message"]["content"]
+                    log_debug(f"✅ Got content from OpenAI (length: {len(content)})")
+                    return content
+                else:
+                    error_msg = "No content in OpenAI response"
+                    print(f"❌ {error_msg}")
+                    log_debug(f"❌ Full response: {result}")
+                    return {"error": error_msg}
             else:
-                error_msg = "No content in OpenAI response"
+                error_msg = f"OpenAI API call failed with status {response.status_code}"
                 print(f"❌ {error_msg}")
-                print(f"❌ Full response: {result}")
-                return {"error": error_msg}
-        else:
-            error_msg = f"OpenAI API call failed with status {response.status_code}"
+                log_debug(f"❌ Response text: {response.text}")
+
+                # Parse common OpenAI errors
+                try:
+                    error_data = response.json()
+                    if "error" in error_data:
+                        openai_error = error_data["error"]
+                        if isinstance(openai_error, dict):
+                            error_type = openai_error.get("type", "unknown")
+                            error_message = openai_error.get("message", "Unknown error")
+                            error_code = openai_error.get("code", "unknown")
+
+                            print(f"❌ OpenAI Error Type: {error_type}")
+                            print(f"❌ OpenAI Error Message: {error_message}")
+                            print(f"❌ OpenAI Error Code: {error_code}")
+
+                            return {"error": f"OpenAI API Error ({error_type}): {error_message}"}
+                except:
+                    pass
+
+                return {"error": f"API call failed with status {response.status_code}: {response.text[:200]}"}
+
+        except CircuitOpenError as e:
+            error_msg = str(e)
+            print(f"❌ {error_msg}: {self.resilience_stats()}")
+            return {"error": error_msg}
+        except requests.exceptions.Timeout:
+            error_msg = f"OpenAI API request timed out (connect {self.connect_timeout}s, read {self.read_timeout}s)"
             print(f"❌ {error_msg}")
-            print(f"❌ Response text: {response.text}")
-            
-            # Parse common OpenAI errors
-            try:
-                error_data = response.json()
-                if "error" in error_data:
-                    openai_error = error_data["error"]
-                    if isinstance(openai_error, dict):
-                        error_type = openai_error.get("type", "unknown")
-                        error_message = openai_error.get("message", "Unknown error")
-                        error_code = openai_error.get("code", "unknown")
-                        
-                        print(f"❌ OpenAI Error Type: {error_type}")
-                        print(f"❌ OpenAI Error Message: {error_message}")
-                        print(f"❌ OpenAI Error Code: {error_code}")
-                        
-                        return {"error": f"OpenAI API Error ({error_type}): {error_message}"}
-            except:
-                pass
-            
-            return {"error": f"API call failed with status {response.status_code}: {response.text[:200]}"}
-        
-    except requests.exceptions.Timeout:
-        error_msg = "OpenAI API request timed out after 30 seconds"
-        print(f"❌ {error_msg}")
-        return {"error": error_msg}
-    except requests.exceptions.ConnectionError:
-        error_msg = "Failed to connect to OpenAI API - network connection error"
-        print(f"❌ {error_msg}")
-        return {"error": error_msg}
-    except Exception as e:
-        error_msg = f"Unexpected error in OpenAI Vision API call: {str(e)}"
-        print(f"❌ {error_msg}")
-        print(f"❌ Error type: {type(e).__name__}")
-        return {"error": error_msg} 
\ No newline at end of file
+            return {"error": error_msg}
+        except requests.exceptions.ConnectionError:
+            error_msg = "Failed to connect to OpenAI API - network connection error"
+            print(f"❌ {error_msg}")
+            return {"error": error_msg}
+        except Exception as e:
+            error_msg = f"Unexpected error in OpenAI Vision API call: {str(e)}"
+            print(f"❌ {error_msg}")
+            print(f"❌ Error type: {type(e).__name__}")
+            return {"error": error_msg}
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_vision_client():
+    """Return the per-instance VisionClient, creating it on first use"""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = VisionClient()
+    return _default_client
+
+
+def stream_image_analysis(image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                          response_format=None, usage_callback=None, image_bytes=None):
+    """Stream content deltas for an image analysis from the shared VisionClient"""
+    return get_vision_client().stream_analyze(
+        image_url=image_url,
+        prompt=prompt,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        response_format=response_format,
+        usage_callback=usage_callback,
+        image_bytes=image_bytes
+    )
+
+
+def repair_analysis_output(broken_output, validation_error, response_format=None):
+    """Make one repair attempt for invalid analysis output using the shared VisionClient"""
+    return get_vision_client().repair_json(broken_output, validation_error, response_format=response_format)
+
+
+def analyze_image_with_vision(image_url=None, prompt=None, image_base64=None, image_mime_type="image/jpeg",
+                              response_format=None, usage_callback=None, image_bytes=None):
+    """
+    Analyze an image using OpenAI's Vision capabilities
+
+    Thin wrapper over the shared VisionClient kept for existing callers.
+
+    Args:
+        image_url (str, optional): URL of the image to analyze
+        prompt (str): Instructions for the analysis
+        image_base64 (str, optional): Base64 encoded image data
+        image_mime_type (str): MIME type of the base64 image data or image bytes
+        response_format (dict, optional): OpenAI response_format, e.g. a JSON schema
+        usage_callback (callable, optional): Called with the OpenAI usage dict
+        image_bytes (bytes-like, optional): Raw image data, used instead of image_base64
+
+    Returns:
+        str or dict: The analysis result from OpenAI
+    """
+    return get_vision_client().analyze(
+        image_url=image_url,
+        prompt=prompt,
+        image_base64=image_base64,
+        image_mime_type=image_mime_type,
+        response_format=response_format,
+        usage_callback=usage_callback,
+        image_bytes=image_bytes
+    )
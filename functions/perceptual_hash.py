@@ -0,0 +1,234 @@
+import io
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+# Near-duplicate settings, overridable through environment variables
+PHASH_ENABLED = os.environ.get("PHASH_ENABLED", "true").lower() in ("1", "true", "yes")
+PHASH_MAX_DISTANCE = int(os.environ.get("PHASH_MAX_DISTANCE", "8"))
+PHASH_MAX_SCOPES = int(os.environ.get("PHASH_MAX_SCOPES", "500"))
+PHASH_MAX_ENTRIES_PER_SCOPE = int(os.environ.get("PHASH_MAX_ENTRIES_PER_SCOPE", "20"))
+PHASH_TTL_SECONDS = int(os.environ.get("PHASH_TTL_SECONDS", str(6 * 60 * 60)))
+
+# The hash keeps the 8x8 lowest frequencies of a 32x32 DCT
+_SAMPLE_SIZE = 32
+_HASH_SIZE = 8
+
+# DCT-II basis rows for the kept frequencies, computed once
+_DCT_BASIS = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _SAMPLE_SIZE)) for x in range(_SAMPLE_SIZE)]
+    for u in range(_HASH_SIZE)
+]
+
+
+def phash(image_bytes):
+    """
+    Compute a 64-bit perceptual hash of an encoded image
+
+    Reduces the image to 32x32 grayscale, takes the 8x8 lowest-frequency DCT
+    coefficients and sets one bit per coefficient above their median (the
+    DC term is excluded from the median). Small crops, re-encodes and
+    lighting changes move only a few bits.
+
+    Args:
+        image_bytes (bytes-like): Encoded image
+
+    Returns:
+        int or None: The hash, or None if Pillow is missing or the image cannot be decoded
+    """
+    from image_preprocess import _pil
+
+    Image, ImageOps = _pil()
+    if Image is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Let the JPEG decoder downscale while decoding instead of inflating a full-size photo
+            image.draft("L", (_SAMPLE_SIZE * 2, _SAMPLE_SIZE * 2))
+            image = ImageOps.exif_transpose(image)
+            pixels = list(image.convert("L").resize((_SAMPLE_SIZE, _SAMPLE_SIZE), Image.BILINEAR).tobytes())
+    except Exception as e:
+        print(f"⚠️ Perceptual hash skipped: {str(e)}")
+        return None
+
+    rows = [pixels[y * _SAMPLE_SIZE:(y + 1) * _SAMPLE_SIZE] for y in range(_SAMPLE_SIZE)]
+    # Separable 2D DCT restricted to the kept frequencies: rows first, then columns
+    row_dct = [[sum(b * p for b, p in zip(basis, row)) for basis in _DCT_BASIS] for row in rows]
+    coefficients = [
+        sum(_DCT_BASIS[v][y] * row_dct[y][u] for y in range(_SAMPLE_SIZE))
+        for v in range(_HASH_SIZE)
+        for u in range(_HASH_SIZE)
+    ]
+    median = sorted(coefficients[1:])[len(coefficients[1:]) // 2]
+
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes under Hamming distance
+
+    Search only descends into children whose edge distance is within
+    max_distance of the query's distance to the node, by the triangle
+    inequality.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, image_hash, value):
+        self.size += 1
+        node = [image_hash, value, {}]
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(image_hash, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, image_hash, max_distance):
+        """Return (distance, hash, value) for every entry within max_distance, closest first"""
+        matches = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_hash, value, children = stack.pop()
+            distance = hamming_distance(image_hash, node_hash)
+            if distance <= max_distance:
+                matches.append((distance, node_hash, value))
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class _Bucket:
+    def __init__(self):
+        self.entries = OrderedDict()  # hash -> (value, stored_at), oldest first
+        self.tree = BKTree()
+        self.stale = False
+
+    def rebuild(self):
+        # BK-trees cannot delete; scopes are small, so evictions rebuild
+        self.tree = BKTree()
+        for image_hash, (value, _) in self.entries.items():
+            self.tree.add(image_hash, value)
+        self.stale = False
+
+
+class NearDuplicateIndex:
+    """
+    Recent perceptual hashes per scope (e.g. one user's photos) with their analyses
+
+    Memory is bounded by max_scopes least-recently-used scopes times
+    max_entries_per_scope entries each; entries also expire after ttl_seconds.
+    """
+
+    def __init__(self, max_distance=PHASH_MAX_DISTANCE, max_scopes=PHASH_MAX_SCOPES,
+                 max_entries_per_scope=PHASH_MAX_ENTRIES_PER_SCOPE, ttl_seconds=PHASH_TTL_SECONDS):
+        self.max_distance = max_distance
+        self.max_scopes = max_scopes
+        self.max_entries_per_scope = max_entries_per_scope
+        self.ttl_seconds = ttl_seconds
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+        self.max_lookup_seconds = 0.0
+
+    def lookup(self, scope, image_hash):
+        """
+        Find the closest recent entry within max_distance
+
+        Args:
+            scope (str): Index partition, e.g. a user id
+            image_hash (int): Perceptual hash of the new image
+
+        Returns:
+            tuple or None: (value, distance) of the closest match
+        """
+        started = time.perf_counter()
+        with self._lock:
+            match = None
+            bucket = self._scopes.get(scope)
+            if bucket is not None:
+                self._scopes.move_to_end(scope)
+                self._expire(bucket, time.time())
+                if bucket.stale:
+                    bucket.rebuild()
+                found = bucket.tree.search(image_hash, self.max_distance)
+                if found:
+                    distance, _, value = found[0]
+                    match = (value, distance)
+
+            elapsed = time.perf_counter() - started
+            self.lookups += 1
+            self.matches += match is not None
+            self.lookup_seconds += elapsed
+            self.max_lookup_seconds = max(self.max_lookup_seconds, elapsed)
+        return match
+
+    def add(self, scope, image_hash, value):
+        """Remember value for image_hash in scope, evicting the oldest entries and scopes over the limits"""
+        with self._lock:
+            bucket = self._scopes.get(scope)
+            if bucket is None:
+                bucket = self._scopes[scope] = _Bucket()
+            self._scopes.move_to_end(scope)
+
+            if image_hash in bucket.entries:
+                bucket.entries.pop(image_hash)
+                bucket.stale = True
+            bucket.entries[image_hash] = (value, time.time())
+            while len(bucket.entries) > self.max_entries_per_scope:
+                bucket.entries.popitem(last=False)
+                bucket.stale = True
+                self.evictions += 1
+            if bucket.stale:
+                bucket.rebuild()
+            else:
+                bucket.tree.add(image_hash, value)
+
+            while len(self._scopes) > self.max_scopes:
+                _, evicted = self._scopes.popitem(last=False)
+                self.evictions += len(evicted.entries)
+
+    def _expire(self, bucket, now):
+        while bucket.entries:
+            _, (_, stored_at) = next(iter(bucket.entries.items()))
+            if now - stored_at <= self.ttl_seconds:
+                break
+            bucket.entries.popitem(last=False)
+            bucket.stale = True
+            self.evictions += 1
+
+    def stats(self):
+        """Return entry counts, match rate and lookup latency"""
+        with self._lock:
+            return {
+                "scopes": len(self._scopes),
+                "entries": sum(len(bucket.entries) for bucket in self._scopes.values()),
+                "lookups": self.lookups,
+                "matches": self.matches,
+                "match_rate": self.matches / self.lookups if self.lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_lookup_ms": self.lookup_seconds * 1000 / self.lookups if self.lookups else 0.0,
+                "max_lookup_ms": self.max_lookup_seconds * 1000,
+            }
@@ -0,0 +1,121 @@
+import threading
+from itertools import combinations
+
+from meal_schema import LANGUAGES, build_response_format
+
+LANGUAGE_NAMES = {"en": "English", "he": "Hebrew", "ru": "Russian"}
+
+# English is always produced: the app and the server-side tooling key on it
+REQUIRED_LANGUAGE = "en"
+
+MEAL_ANALYSIS_TEMPLATE = """
+Analyze this meal image and return nutritional information as JSON:
+{{
+  'mealName': {{{name_example}}},
+  'estimatedCalories': number (e.g., 670),
+  'macros': {{'proteins': grams as a number (e.g., 30), 'carbohydrates': grams as a number (e.g., 50), 'fats': grams as a number (e.g., 40)}},
+  'ingredients': {{{ingredients_example}}},
+  'healthiness': 'healthy' | 'medium' | 'unhealthy' | 'N/A',
+  'health_assessment': 'Detailed health assessment of the meal',
+  'source': 'A valid URL for more information about this meal'
+}}
+
+Rules:
+- Give the meal name and ingredients in {language_list}{translation_note}.
+- Base calories and macros on visible portions; 'estimatedCalories' and macros are numbers.
+- 'source' MUST start with http or https, defaulting to https://fdc.nal.usda.gov/ if needed.
+"""
+
+
+class PromptVariant:
+    """A prebuilt prompt and matching response format for one set of output languages"""
+
+    def __init__(self, languages):
+        self.languages = languages
+        self.name = "+".join(languages)
+        language_names = [LANGUAGE_NAMES[language] for language in languages]
+        self.text = MEAL_ANALYSIS_TEMPLATE.format(
+            name_example=", ".join(f"'{language}': '...'" for language in languages),
+            ingredients_example=", ".join(f"'{language}': ['...']" for language in languages),
+            language_list=" and ".join(filter(None, [", ".join(language_names[:-1]), language_names[-1]])),
+            translation_note=" (accurate, food-appropriate translations)" if len(languages) > 1 else "",
+        )
+        self.response_format = build_response_format(languages)
+
+
+def _build_registry():
+    others = [language for language in LANGUAGES if language != REQUIRED_LANGUAGE]
+    registry = {}
+    for size in range(len(others) + 1):
+        for extra in combinations(others, size):
+            languages = tuple(language for language in LANGUAGES if language == REQUIRED_LANGUAGE or language in extra)
+            registry[languages] = PromptVariant(languages)
+    return registry
+
+
+# Every supported language combination, built once at import
+PROMPT_VARIANTS = _build_registry()
+DEFAULT_VARIANT = PROMPT_VARIANTS[LANGUAGES]
+
+
+def valid_locales(locales):
+    """Return True if locales is None, a comma-separated string or a list of strings"""
+    if locales is None or isinstance(locales, str):
+        return True
+    return isinstance(locales, list) and all(isinstance(locale, str) for locale in locales)
+
+
+def get_prompt_variant(locales=None):
+    """
+    Select the prompt variant for a request's locales
+
+    Args:
+        locales (list or str, optional): Requested language codes such as
+            ['en', 'he'] or 'en,he'. Unknown codes are ignored and English
+            is always included. None, or a value of any other type, selects
+            all supported languages.
+
+    Returns:
+        PromptVariant: The prebuilt variant
+    """
+    if not locales or not valid_locales(locales):
+        return DEFAULT_VARIANT
+    if isinstance(locales, str):
+        locales = locales.split(",")
+    requested = {str(locale).strip().lower().split("-")[0] for locale in locales}
+    languages = tuple(language for language in LANGUAGES if language == REQUIRED_LANGUAGE or language in requested)
+    return PROMPT_VARIANTS[languages]
+
+
+class PromptUsageTracker:
+    """Per-variant token usage from the OpenAI 'usage' field"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = {}
+
+    def record(self, variant_name, usage):
+        """Add one completion's usage dict to the variant's totals"""
+        if not isinstance(usage, dict):
+            return
+        with self._lock:
+            totals = self._usage.setdefault(variant_name, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            totals["calls"] += 1
+            totals["prompt_tokens"] += usage.get("prompt_tokens", 0) or 0
+            totals["completion_tokens"] += usage.get("completion_tokens", 0) or 0
+
+    def snapshot(self):
+        """Return totals and per-call averages for every variant seen"""
+        with self._lock:
+            result = {}
+            for variant_name, totals in self._usage.items():
+                calls = totals["calls"]
+                result[variant_name] = dict(
+                    totals,
+                    avg_prompt_tokens=totals["prompt_tokens"] / calls,
+                    avg_completion_tokens=totals["completion_tokens"] / calls,
+                )
+            return result
+
+
+prompt_usage = PromptUsageTracker()
@@ -0,0 +1,190 @@
+import os
+import time
+import base64
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+# Default cache settings, overridable through environment variables
+DEFAULT_MAX_ENTRIES = int(os.environ.get("ANALYSIS_CACHE_MAX_ENTRIES", "512"))
+DEFAULT_TTL_SECONDS = int(os.environ.get("ANALYSIS_CACHE_TTL_SECONDS", str(24 * 60 * 60)))
+DEFAULT_DB_PATH = os.environ.get("ANALYSIS_CACHE_DB", "")
+
+
+def normalize_image_url(image_url):
+    """
+    Normalize an image URL so trivially different spellings share a cache entry
+
+    Lowercases the scheme and host and drops the fragment. The path and query
+    string are kept as-is because signed storage URLs depend on them.
+    """
+    parts = urlsplit(image_url.strip())
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, ""))
+
+
+def make_cache_key(prompt, model, image_url=None, image_base64=None, image_bytes=None):
+    """
+    Build a content-addressed cache key for an analysis request
+
+    Args:
+        prompt (str): Prompt sent to the vision model
+        model (str): Model name used for the analysis
+        image_url (str, optional): URL of the image
+        image_base64 (str, optional): Base64 encoded image data
+        image_bytes (bytes, optional): Raw image bytes, used instead of image_base64
+
+    Returns:
+        str: Hex digest identifying the image, prompt and model combination
+    """
+    digest = hashlib.sha256()
+    digest.update(model.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(hashlib.sha256(prompt.encode("utf-8")).digest())
+    digest.update(b"\0")
+
+    if image_bytes is None and image_base64:
+        try:
+            image_bytes = base64.b64decode(image_base64, validate=False)
+        except (ValueError, TypeError):
+            # Undecodable payloads still get a stable key from the raw text
+            image_bytes = image_base64.encode("utf-8")
+
+    if image_bytes is not None:
+        digest.update(b"bytes:")
+        digest.update(hashlib.sha256(image_bytes).digest())
+    elif image_url:
+        digest.update(b"url:")
+        digest.update(normalize_image_url(image_url).encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class CacheStorage:
+    """Interface for the persistent cache tier"""
+
+    def get(self, key):
+        """Return the stored value for key, or None if missing or expired"""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl_seconds):
+        """Store value under key for ttl_seconds"""
+        raise NotImplementedError
+
+
+class SQLiteCacheStorage(CacheStorage):
+    """Persistent cache tier backed by a local SQLite file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at <= time.time():
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return value
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl_seconds),
+            )
+            self._conn.commit()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache for serialized analysis results
+
+    The first tier is an in-process LRU with a TTL. The optional second tier
+    is any CacheStorage implementation; hits there are promoted to memory.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, storage=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.storage = storage
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.storage_hits = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.storage is not None:
+            try:
+                value = self.storage.get(key)
+            except Exception as e:
+                print(f"⚠️ Analysis cache storage read failed: {str(e)}")
+                value = None
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.storage_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Store value under key in every tier"""
+        self._remember(key, value)
+        if self.storage is not None:
+            try:
+                self.storage.set(key, value, self.ttl_seconds)
+            except Exception as e:
+                print(f"⚠️ Analysis cache storage write failed: {str(e)}")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "storage_hits": self.storage_hits,
+                "entries": len(self._entries),
+            }
+
+
+def create_default_cache():
+    """Create the cache configured by the ANALYSIS_CACHE_* environment variables"""
+    storage = SQLiteCacheStorage(DEFAULT_DB_PATH) if DEFAULT_DB_PATH else None
+    return AnalysisCache(storage=storage)
@@ -0,0 +1,87 @@
+import os
+import threading
+
+# How long a duplicate request waits on the in-flight call before running its own
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.environ.get("SINGLE_FLIGHT_WAIT_SECONDS", "35"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls that share a key
+
+    The first caller for a key runs the function; callers arriving while it
+    is in flight wait for and share its result or exception.
+    """
+
+    def __init__(self, wait_seconds=SINGLE_FLIGHT_WAIT_SECONDS):
+        self.wait_seconds = wait_seconds
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.wait_timeouts = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn once per key among concurrent callers
+
+        Args:
+            key (str): Deduplication key, e.g. the analysis cache key
+            fn (callable): Function to run; extra arguments are passed through
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result came
+            from another caller's in-flight call
+
+        Raises:
+            Exception: Whatever fn raised, for the leader and its waiters
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if call.done.wait(self.wait_seconds):
+                with self._lock:
+                    self.coalesced += 1
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            # The leader is taking too long; stop waiting and make our own call
+            with self._lock:
+                self.wait_timeouts += 1
+            return fn(*args, **kwargs), False
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        """Return leader, coalesced and timeout counters plus in-flight keys"""
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "wait_timeouts": self.wait_timeouts,
+                "in_flight": len(self._calls),
+            }
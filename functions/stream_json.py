@@ -0,0 +1,84 @@
+import json
+
+
+class IncrementalObjectParser:
+    """
+    Incremental parser for a single top-level JSON object arriving in chunks
+
+    Each top-level member is decoded as soon as its value is complete, so
+    early fields like mealName can be forwarded before the model has finished
+    writing the rest. Text before the opening brace, such as a markdown
+    fence, is ignored.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.done = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._member = []
+
+    def feed(self, chunk):
+        """
+        Consume the next chunk of model output
+
+        Args:
+            chunk (str): Text delta from the stream
+
+        Returns:
+            list: (key, value) pairs for members completed by this chunk
+        """
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+
+            if not self._started:
+                if char == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._member.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+
+            # A comma or the closing brace at the top level ends a member
+            if self._depth == 1 and char == ",":
+                self._finish_member(completed)
+            elif self._depth == 0:
+                self._finish_member(completed)
+                self.done = True
+            else:
+                self._member.append(char)
+
+        return completed
+
+    def _finish_member(self, completed):
+        text = "".join(self._member).strip()
+        self._member = []
+        if not text:
+            return
+        try:
+            member = json.loads("{" + text + "}")
+        except json.JSONDecodeError:
+            # Leave malformed members to the full-text fallback parser
+            return
+        for key, value in member.items():
+            self.fields[key] = value
+            completed.append((key, value))
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The functions are deployed as flat modules, so tests import them from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Tests that import main run analysis jobs in-process instead of through Cloud Tasks and Firestore
+os.environ.setdefault("JOB_DISPATCH", "local")
+os.environ.setdefault("JOB_RESULT_STORE", "memory")
@@ -0,0 +1,156 @@
+import json
+import time
+
+import pytest
+from firebase_admin import functions
+
+import dependencies
+from analysis_jobs import (
+    CloudTasksJobs,
+    InMemoryImageStore,
+    InMemoryJobQueue,
+    InMemoryResultStore,
+    JobQueueFullError,
+    JobWorkerPool,
+)
+
+
+class FakeTaskQueue:
+    def __init__(self):
+        self.tasks = []
+
+    def enqueue(self, data, opts=None):
+        # Cloud Tasks carries the payload as JSON
+        self.tasks.append(json.loads(json.dumps(data)))
+        return opts.task_id
+
+
+@pytest.fixture
+def task_queue(monkeypatch):
+    fake = FakeTaskQueue()
+    monkeypatch.setattr(functions, "task_queue", lambda name, app=None: fake)
+    monkeypatch.setattr(dependencies, "get_firebase_app", lambda: None)
+    return fake
+
+
+def handler_returning(payload, calls=None):
+    def handler(**kwargs):
+        if calls is not None:
+            calls.append(kwargs)
+        return json.dumps(payload), "MISS"
+    return handler
+
+
+def test_cloud_tasks_payload_carries_image_path_not_bytes(task_queue):
+    images = InMemoryImageStore()
+    jobs = CloudTasksJobs(InMemoryResultStore(), images, handler_returning({"mealName": "x"}))
+
+    job_id = jobs.submit({"locales": ["en"]}, image_bytes=memoryview(b"\x89PNG data"), user_id="u1")
+
+    task = task_queue.tasks[0]
+    assert task["id"] == job_id
+    assert task["image_path"] == job_id
+    assert "image_bytes" not in task
+    assert images.get(task["image_path"]) == b"\x89PNG data"
+    assert jobs.store.get(job_id)["status"] == "queued"
+    assert jobs.store.get(job_id)["userId"] == "u1"
+
+
+def test_run_stores_result_and_deletes_image(task_queue):
+    calls = []
+    images = InMemoryImageStore()
+    jobs = CloudTasksJobs(InMemoryResultStore(), images, handler_returning({"mealName": "x"}, calls))
+    job_id = jobs.submit({"locales": ["en"]}, image_bytes=b"img")
+
+    jobs.run(task_queue.tasks[0])
+
+    record = jobs.store.get(job_id)
+    assert record["status"] == "done"
+    assert record["result"] == {"mealName": "x"}
+    assert calls[0]["image_bytes"] == b"img"
+    assert calls[0]["locales"] == ["en"]
+    assert "enqueued_at" not in calls[0]
+    with pytest.raises(KeyError):
+        images.get(job_id)
+
+
+def test_redelivered_finished_job_is_skipped(task_queue):
+    calls = []
+    jobs = CloudTasksJobs(InMemoryResultStore(), InMemoryImageStore(), handler_returning({"mealName": "x"}, calls))
+    jobs.submit({"image_url": "https://example.com/a.jpg"})
+
+    jobs.run(task_queue.tasks[0])
+    jobs.run(task_queue.tasks[0])
+
+    assert len(calls) == 1
+    assert jobs.stats()["skipped"] == 1
+
+
+def test_error_payload_marks_job_failed(task_queue):
+    jobs = CloudTasksJobs(InMemoryResultStore(), InMemoryImageStore(), handler_returning({"error": "upstream down"}))
+    job_id = jobs.submit({"image_url": "https://example.com/a.jpg"})
+
+    jobs.run(task_queue.tasks[0])
+
+    record = jobs.store.get(job_id)
+    assert record["status"] == "failed"
+    assert record["error"] == "upstream down"
+    assert jobs.stats()["failed"] == 1
+
+
+def test_outcome_store_failure_is_raised_for_redelivery(task_queue):
+    class FlakyStore(InMemoryResultStore):
+        def update(self, job_id, fields):
+            if fields["status"] == "done":
+                raise RuntimeError("firestore unavailable")
+            super().update(job_id, fields)
+
+    images = InMemoryImageStore()
+    jobs = CloudTasksJobs(FlakyStore(), images, handler_returning({"mealName": "x"}))
+    job_id = jobs.submit({}, image_bytes=b"img")
+
+    with pytest.raises(RuntimeError):
+        jobs.run(task_queue.tasks[0])
+    # The image is kept so the redelivered task can run again
+    assert images.get(job_id) == b"img"
+
+
+def test_dispatch_failure_marks_job_failed(monkeypatch):
+    class BrokenQueue:
+        def enqueue(self, data, opts=None):
+            raise RuntimeError("cloud tasks unavailable")
+
+    monkeypatch.setattr(functions, "task_queue", lambda name, app=None: BrokenQueue())
+    monkeypatch.setattr(dependencies, "get_firebase_app", lambda: None)
+    store = InMemoryResultStore()
+    jobs = CloudTasksJobs(store, InMemoryImageStore(), handler_returning({}))
+
+    with pytest.raises(RuntimeError):
+        jobs.submit({})
+    assert jobs.stats()["submitted"] == 0
+    assert [record["status"] for record, _ in store._records.values()] == ["failed"]
+
+
+def test_worker_pool_rejects_when_queue_is_full():
+    def slow_handler(**kwargs):
+        time.sleep(0.5)
+        return json.dumps({}), "MISS"
+
+    pool = JobWorkerPool(InMemoryJobQueue(), InMemoryResultStore(), slow_handler, workers=1, max_depth=1)
+    pool.submit({})
+
+    with pytest.raises(JobQueueFullError):
+        pool.submit({})
+    assert pool.stats()["rejected"] == 1
+
+
+def test_worker_pool_runs_jobs():
+    pool = JobWorkerPool(InMemoryJobQueue(), InMemoryResultStore(), handler_returning({"mealName": "x"}), workers=2)
+    job_id = pool.submit({}, image_bytes=b"img")
+
+    deadline = time.monotonic() + 5
+    while pool.store.get(job_id)["status"] != "done" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert pool.store.get(job_id)["result"] == {"mealName": "x"}
+    assert pool.stats()["depth"] == 0
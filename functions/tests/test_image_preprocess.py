@@ -0,0 +1,73 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from image_preprocess import fetch_and_preprocess_url, sniff_image_mime
+
+
+def png_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 50, 50)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    routes = {}
+
+    def do_GET(self):
+        status, headers, body = self.routes.get(self.path, (404, {}, b""))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ImageHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{httpd.server_port}"
+    ImageHandler.routes = {
+        "/meal.png": (200, {"Content-Type": "image/png"}, png_bytes()),
+        "/page.html": (200, {"Content-Type": "image/jpeg"}, b"<html>not an image</html>"),
+        "/redirect": (302, {"Location": f"{base}/meal.png"}, b""),
+    }
+    yield base
+    httpd.shutdown()
+
+
+def test_sniff_image_mime_recognizes_signatures():
+    assert sniff_image_mime(png_bytes()) == "image/png"
+    assert sniff_image_mime(b"\xff\xd8\xff\xe0rest") == "image/jpeg"
+    assert sniff_image_mime(b"RIFF\0\0\0\0WEBPVP8 ") == "image/webp"
+    assert sniff_image_mime(memoryview(b"GIF89a...")) == "image/gif"
+    assert sniff_image_mime(b"<html>") is None
+
+
+def test_fetched_image_is_returned_inline(server):
+    fetched = fetch_and_preprocess_url(f"{server}/meal.png")
+
+    assert fetched is not None
+    image_bytes, mime_type = fetched
+    assert sniff_image_mime(image_bytes) is not None
+
+
+def test_non_image_response_forwards_the_url(server):
+    assert fetch_and_preprocess_url(f"{server}/page.html") is None
+
+
+def test_redirect_is_not_followed(server):
+    assert fetch_and_preprocess_url(f"{server}/redirect") is None
+
+
+def test_http_error_forwards_the_url(server):
+    assert fetch_and_preprocess_url(f"{server}/missing.png") is None
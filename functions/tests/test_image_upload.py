@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from firebase_functions import https_fn
+from werkzeug.test import EnvironBuilder
+
+from main import read_analysis_request, read_image_upload
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 32
+
+
+def request(**kwargs):
+    return https_fn.Request(EnvironBuilder(method="POST", **kwargs).get_environ())
+
+
+def test_raw_body_type_comes_from_the_bytes():
+    data, image_bytes, mime_type = read_image_upload(
+        request(data=PNG, content_type="application/octet-stream", query_string={"locales": "en"}))
+
+    assert bytes(image_bytes) == PNG
+    assert mime_type == "image/png"
+    assert data == {"locales": "en"}
+
+
+def test_multipart_upload_is_read_from_the_image_field():
+    data, image_bytes, mime_type = read_image_upload(request(
+        data={"image": (io.BytesIO(PNG), "meal.jpg", "image/jpeg"), "stream": "true"},
+        content_type="multipart/form-data",
+    ))
+
+    assert bytes(image_bytes) == PNG
+    # The declared image/jpeg is ignored in favor of the sniffed format
+    assert mime_type == "image/png"
+    assert data == {"stream": "true"}
+
+
+@pytest.mark.parametrize("content_type", ["image/jpeg", "image/heic", "application/octet-stream"])
+def test_unrecognized_bytes_are_rejected_whatever_the_declared_type(content_type):
+    with pytest.raises(ValueError, match="Unsupported image format"):
+        read_image_upload(request(data=b"<html>not an image</html>", content_type=content_type))
+
+
+def test_empty_upload_is_rejected():
+    with pytest.raises(ValueError, match="empty"):
+        read_image_upload(request(data=b"", content_type="image/png"))
+
+
+def test_json_body_has_no_upload():
+    data, image_bytes, mime_type = read_image_upload(request(json={"image_url": "https://example.com/a.jpg"}))
+
+    assert data == {"image_url": "https://example.com/a.jpg"}
+    assert image_bytes is None
+    assert mime_type is None
+
+
+@pytest.mark.parametrize("locales", [5, {"en": True}, ["en", 5]])
+def test_analysis_request_with_invalid_locales_is_rejected(locales):
+    inputs, error_response = read_analysis_request(
+        request(json={"image_url": "https://example.com/a.jpg", "locales": locales}))
+
+    assert inputs is None
+    assert error_response.status_code == 400
+
+
+def test_analysis_request_inputs():
+    inputs, error_response = read_analysis_request(
+        request(json={"image_url": "https://example.com/a.jpg", "locales": ["en", "he"]}))
+
+    assert error_response is None
+    assert inputs["image_url"] == "https://example.com/a.jpg"
+    assert inputs["locales"] == ["en", "he"]
+    assert inputs["user_id"] is None
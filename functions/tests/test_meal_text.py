@@ -0,0 +1,113 @@
+import csv
+
+import pytest
+
+from meal_text import estimate_meal, parse_meal_text
+from nutrient_index import NutrientIndex, build_nutrient_index
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2 eggs", [("eggs", 2.0, None)]),
+    ("150g rice", [("rice", 150.0, "g")]),
+    ("a slice of toast", [("toast", 1.0, "slice")]),
+    ("1/2 cup oatmeal", [("oatmeal", 0.5, "cup")]),
+    ("1.5 banana", [("banana", 1.5, None)]),
+    ("0,5 l orange juice", [("orange juice", 0.5, "l")]),
+    ("half avocado", [("avocado", 0.5, None)]),
+    ("apple", [("apple", 1.0, None)]),
+    ("grilled chicken breast 200g", [("grilled chicken breast", 200.0, "g")]),
+    ("coke zero 330 ml", [("coke zero", 330.0, "ml")]),
+    ("eggs x2", [("eggs", 2.0, None)]),
+    ("oatmeal - 50 g", [("oatmeal", 50.0, "g")]),
+    ("vitamin b12", [("vitamin b12", 1.0, None)]),
+])
+def test_parse_single_item(text, expected):
+    items = parse_meal_text(text)
+    assert [(item["name"], item["quantity"], item["unit"]) for item in items] == expected
+
+
+def test_parse_splits_items_on_separators():
+    items = parse_meal_text("2 eggs, 150g rice and a slice of toast; coffee with milk + 1 banana")
+    assert [item["name"] for item in items] == ["eggs", "rice", "toast", "coffee", "milk", "banana"]
+
+
+def test_parse_keeps_decimal_commas_inside_numbers():
+    items = parse_meal_text("0,5 l milk,2 eggs")
+    assert [(item["name"], item["quantity"]) for item in items] == [("milk", 0.5), ("eggs", 2.0)]
+
+
+def test_parse_skips_empty_parts():
+    assert parse_meal_text(" , ; and ") == []
+
+
+def _write_csv(path, header, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def nutrient_index(tmp_path):
+    export = tmp_path / "export"
+    export.mkdir()
+    _write_csv(export / "food.csv", ["fdc_id", "data_type", "description"], [
+        (1, "sr_legacy_food", "Egg, whole, raw, fresh"),
+        (2, "sr_legacy_food", "Rice, white, long-grain, regular, cooked"),
+        (3, "foundation_food", "Chicken, breast, boneless, skinless, raw"),
+        (4, "sr_legacy_food", "Bananas, raw"),
+        (5, "branded_food", "Brand rice"),
+    ])
+    _write_csv(export / "food_nutrient.csv", ["id", "fdc_id", "nutrient_id", "amount"], [
+        (1, 1, 1008, 143), (2, 1, 1003, 12.6), (3, 1, 1004, 9.5), (4, 1, 1005, 0.7),
+        (5, 2, 1008, 130), (6, 2, 1003, 2.7), (7, 2, 1004, 0.3), (8, 2, 1005, 28.2),
+        (9, 3, 2047, 120), (10, 3, 1003, 22.5), (11, 3, 1004, 2.6),
+        (12, 4, 1008, 89), (13, 4, 1005, 22.8), (14, 4, 1003, 1.1),
+        (15, 5, 1008, 999),
+    ])
+    _write_csv(export / "food_portion.csv",
+               ["id", "fdc_id", "seq_num", "amount", "portion_description", "modifier", "gram_weight"], [
+                   (1, 1, 1, 1, "", "large", 50),
+                   (2, 4, 2, 1, "", "cup sliced", 150),
+                   (3, 4, 1, 1, "", "medium", 118),
+               ])
+    db_path = str(tmp_path / "nutrients.sqlite")
+    assert build_nutrient_index(str(export), db_path) == 4
+    return NutrientIndex(db_path)
+
+
+def test_lookup_uses_first_portion_and_skips_branded_foods(nutrient_index):
+    banana = nutrient_index.lookup("banana")
+    assert banana["description"] == "Bananas, raw"
+    assert banana["portion"] == {"grams": 118.0, "label": "1 medium"}
+    assert nutrient_index.lookup("brand") is None
+
+
+def test_lookup_drops_unknown_words_and_modifiers(nutrient_index):
+    assert nutrient_index.lookup("grilled chicken breast")["fdc_id"] == 3
+    assert nutrient_index.lookup("organic banana fresh")["fdc_id"] == 4
+    assert nutrient_index.lookup("unicorn") is None
+
+
+def test_lookup_memoizes_results(nutrient_index):
+    nutrient_index.lookup("Eggs")
+    nutrient_index.lookup("eggs!")
+    stats = nutrient_index.stats()
+    assert stats["lookups"] == 2
+    assert stats["memo_hits"] == 1
+
+
+def test_estimate_meal_scales_per_100g_values(nutrient_index):
+    analysis, items, unmatched = estimate_meal("2 eggs, grilled chicken breast 200g and unicorn", nutrient_index)
+    assert unmatched == ["unicorn"]
+    assert [(item["name"], item["grams"]) for item in items] == [("eggs", 100.0), ("grilled chicken breast", 200.0)]
+    assert analysis.estimated_calories == round(143 + 240)
+    assert analysis.proteins == round(12.6 + 45.0, 1)
+    assert analysis.to_response()["ingredients"] == {"en": ["eggs", "grilled chicken breast"]}
+
+
+def test_estimate_meal_without_matches(nutrient_index):
+    analysis, items, unmatched = estimate_meal("unicorn steak", nutrient_index)
+    assert analysis is None
+    assert items == []
+    assert unmatched == ["unicorn steak"]
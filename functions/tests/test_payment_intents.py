@@ -0,0 +1,121 @@
+import threading
+import time
+
+import flask
+import pytest
+from firebase_functions.private import util
+
+import main
+from result_cache import AnalysisCache
+from single_flight import SingleFlight
+
+
+class FakeStripeError(Exception):
+    pass
+
+
+class FakeStripe:
+    """Stands in for the stripe module; PaymentIntent.create records each call"""
+
+    class error:
+        StripeError = FakeStripeError
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self._lock = threading.Lock()
+        self.PaymentIntent = self
+
+    def create(self, **kwargs):
+        time.sleep(self.delay)
+        with self._lock:
+            self.calls.append(kwargs)
+            number = len(self.calls)
+
+        class PaymentIntent(dict):
+            id = f"pi_{number}"
+
+        return PaymentIntent(client_secret=f"pi_{number}_secret")
+
+
+@pytest.fixture
+def stripe(monkeypatch):
+    fake = FakeStripe()
+    monkeypatch.setattr(main, "get_stripe", lambda: fake)
+    monkeypatch.setattr(main, "issued_payment_intents", AnalysisCache(max_entries=16, ttl_seconds=600))
+    monkeypatch.setattr(main, "in_flight_payments", SingleFlight())
+    # Bearer tokens name the signed-in uid directly
+    monkeypatch.setattr(util._auth, "verify_id_token", lambda token, *args, **kwargs: {"uid": token})
+    return fake
+
+
+@pytest.fixture
+def pay():
+    app = flask.Flask("payment_tests")
+    app.add_url_rule("/pay", "pay", lambda: main.create_payment_intent(flask.request), methods=["POST"])
+
+    def call(data, uid=None):
+        headers = {"Authorization": f"Bearer {uid}"} if uid else {}
+        response = app.test_client().post("/pay", json={"data": data}, headers=headers)
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_json()["result"]["clientSecret"]
+
+    return call
+
+
+def test_retry_of_same_checkout_reuses_intent(stripe, pay):
+    first = pay({"amount": 500, "currency": "usd", "nonce": "n1"}, uid="alice")
+    second = pay({"amount": 500, "currency": "USD", "nonce": "n1"}, uid="alice")
+
+    assert first == second
+    assert len(stripe.calls) == 1
+    assert stripe.calls[0]["idempotency_key"] == main.payment_idempotency_key("alice", 500, "usd", "n1")
+
+
+@pytest.mark.parametrize("retry", [
+    {"amount": 500, "nonce": "n2"},
+    {"amount": 700, "nonce": "n1"},
+    {"amount": 500, "currency": "eur", "nonce": "n1"},
+])
+def test_new_nonce_amount_or_currency_creates_new_intent(stripe, pay, retry):
+    first = pay({"amount": 500, "nonce": "n1"}, uid="alice")
+    second = pay(retry, uid="alice")
+
+    assert first != second
+    assert len(stripe.calls) == 2
+    assert stripe.calls[0]["idempotency_key"] != stripe.calls[1]["idempotency_key"]
+
+
+def test_different_users_never_share_a_key(stripe, pay):
+    assert pay({"amount": 500, "nonce": "n1"}, uid="alice") != pay({"amount": 500, "nonce": "n1"}, uid="bob")
+    assert len(stripe.calls) == 2
+
+
+@pytest.mark.parametrize("data,uid", [
+    ({"amount": 500, "nonce": "n1"}, None),
+    ({"amount": 500}, "alice"),
+])
+def test_anonymous_or_nonce_less_requests_are_not_deduplicated(stripe, pay, data, uid):
+    first = pay(data, uid=uid)
+    second = pay(data, uid=uid)
+
+    assert first != second
+    assert [call["idempotency_key"] for call in stripe.calls] == [None, None]
+    assert main.issued_payment_intents.stats()["entries"] == 0
+
+
+def test_concurrent_retries_share_one_stripe_call(stripe, pay):
+    stripe.delay = 0.2
+    secrets = []
+    threads = [
+        threading.Thread(target=lambda: secrets.append(pay({"amount": 500, "nonce": "n1"}, uid="alice")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(stripe.calls) == 1
+    assert secrets == ["pi_1_secret"] * 5
+    assert main.in_flight_payments.stats()["coalesced"] == 4
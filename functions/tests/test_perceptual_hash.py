@@ -0,0 +1,116 @@
+import io
+import random
+
+import pytest
+
+import perceptual_hash
+from perceptual_hash import BKTree, NearDuplicateIndex, hamming_distance, phash
+
+
+def test_hamming_distance():
+    assert hamming_distance(0, 0) == 0
+    assert hamming_distance(0b1011, 0b0001) == 2
+    assert hamming_distance(0, (1 << 64) - 1) == 64
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(300)]
+    # Near neighbours of a few entries so small radii have matches
+    hashes += [hashes[i] ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for i in range(20)]
+    tree = BKTree()
+    for index, value in enumerate(hashes):
+        tree.add(value, index)
+    assert tree.size == len(hashes)
+
+    for query in hashes[:25] + [rng.getrandbits(64) for _ in range(5)]:
+        for radius in (0, 4, 12):
+            expected = sorted(
+                (hamming_distance(query, value), index) for index, value in enumerate(hashes)
+                if hamming_distance(query, value) <= radius
+            )
+            found = tree.search(query, radius)
+            assert sorted((distance, index) for distance, _, index in found) == expected
+            assert [distance for distance, _, _ in found] == sorted(distance for distance, _, _ in found)
+
+
+def test_bk_tree_empty_search():
+    assert BKTree().search(123, 10) == []
+
+
+def test_index_returns_closest_match_within_distance():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add("u1", 0b0000, "zero")
+    index.add("u1", 0b1111, "fifteen")
+    assert index.lookup("u1", 0b0001) == ("zero", 1)
+    assert index.lookup("u1", 0b0111) == ("fifteen", 1)
+    assert index.lookup("u1", 0b11111 << 20) is None
+
+
+def test_index_scopes_are_isolated():
+    index = NearDuplicateIndex(max_distance=4)
+    index.add("u1", 42, "mine")
+    assert index.lookup("u2", 42) is None
+    assert index.lookup("u1", 42) == ("mine", 0)
+
+
+def test_index_evicts_oldest_entries_per_scope():
+    index = NearDuplicateIndex(max_distance=0, max_entries_per_scope=2)
+    for value in (1, 2, 3):
+        index.add("u1", value, str(value))
+    assert index.lookup("u1", 1) is None
+    assert index.lookup("u1", 3) == ("3", 0)
+    assert index.stats()["entries"] == 2
+    assert index.stats()["evictions"] == 1
+
+
+def test_index_re_adding_a_hash_replaces_its_value():
+    index = NearDuplicateIndex(max_distance=0)
+    index.add("u1", 5, "old")
+    index.add("u1", 5, "new")
+    assert index.lookup("u1", 5) == ("new", 0)
+    assert index.stats()["entries"] == 1
+
+
+def test_index_evicts_least_recently_used_scope():
+    index = NearDuplicateIndex(max_distance=0, max_scopes=2)
+    index.add("a", 1, "a")
+    index.add("b", 1, "b")
+    index.lookup("a", 1)
+    index.add("c", 1, "c")
+    assert index.lookup("b", 1) is None
+    assert index.lookup("a", 1) == ("a", 0)
+    assert index.stats()["scopes"] == 2
+
+
+def test_index_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(perceptual_hash.time, "time", lambda: now[0])
+    index = NearDuplicateIndex(max_distance=0, ttl_seconds=60)
+    index.add("u1", 1, "old")
+    now[0] += 30
+    index.add("u1", 2, "new")
+    now[0] += 31
+    assert index.lookup("u1", 1) is None
+    assert index.lookup("u1", 2) == ("new", 0)
+
+
+def _jpeg(image, quality=90):
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def test_phash_is_stable_across_re_encoding_and_distinguishes_images():
+    Image = pytest.importorskip("PIL.Image")
+    ImageFilter = pytest.importorskip("PIL.ImageFilter")
+    plate = Image.effect_noise((400, 300), 80).convert("RGB").filter(ImageFilter.GaussianBlur(10))
+    original = phash(_jpeg(plate))
+    assert original is not None
+    assert hamming_distance(original, phash(_jpeg(plate.resize((320, 240)), quality=60))) <= 4
+    assert hamming_distance(original, phash(_jpeg(plate.rotate(90, expand=True)))) > 8
+
+
+def test_phash_returns_none_for_undecodable_bytes():
+    pytest.importorskip("PIL")
+    assert phash(b"not an image") is None
@@ -0,0 +1,27 @@
+import pytest
+
+from prompts import DEFAULT_VARIANT, REQUIRED_LANGUAGE, get_prompt_variant, valid_locales
+
+
+def test_requested_languages_always_include_english():
+    variant = get_prompt_variant(["he"])
+
+    assert REQUIRED_LANGUAGE in variant.languages
+    assert "he" in variant.languages
+    assert get_prompt_variant("he-IL, en") is variant
+
+
+def test_missing_locales_select_every_language():
+    assert get_prompt_variant(None) is DEFAULT_VARIANT
+    assert get_prompt_variant([]) is DEFAULT_VARIANT
+
+
+@pytest.mark.parametrize("locales", [5, {"en": True}, ["en", 5], 1.5])
+def test_invalid_locales_fall_back_to_default_variant(locales):
+    assert not valid_locales(locales)
+    assert get_prompt_variant(locales) is DEFAULT_VARIANT
+
+
+@pytest.mark.parametrize("locales", [None, "en,he", ["en", "he"]])
+def test_valid_locales(locales):
+    assert valid_locales(locales)
@@ -0,0 +1,140 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, RetryBudget, RetryPolicy, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", fake)
+    return fake
+
+
+def test_parse_retry_after_seconds():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-3") == 0.0
+
+
+def test_parse_retry_after_http_date():
+    delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+    assert 28 <= delay <= 31
+
+
+@pytest.mark.parametrize("value", [None, "", "soon"])
+def test_parse_retry_after_invalid(value):
+    assert parse_retry_after(value) is None
+
+
+def test_delay_uses_jittered_exponential_backoff():
+    policy = RetryPolicy(base_delay=0.5, max_delay=8)
+    for attempt in range(1, 8):
+        assert 0 <= policy.delay(attempt) <= min(8, 0.5 * 2 ** (attempt - 1))
+
+
+def test_delay_returns_retry_after_hint_unchanged():
+    policy = RetryPolicy(max_delay=8)
+    assert policy.delay(1, retry_after=3.0) == 3.0
+    assert policy.delay(1, retry_after=30.0) == 30.0
+
+
+def test_can_retry_refuses_retry_after_longer_than_max_delay(clock):
+    policy = RetryPolicy(max_attempts=3, max_delay=8, max_elapsed=45)
+    started = clock.now
+    assert policy.can_retry(1, started, policy.delay(1, retry_after=5.0))
+    assert not policy.can_retry(1, started, policy.delay(1, retry_after=30.0))
+
+
+def test_can_retry_respects_attempts_and_elapsed_time(clock):
+    policy = RetryPolicy(max_attempts=3, max_delay=8, max_elapsed=10)
+    started = clock.now
+    assert policy.can_retry(2, started, 1.0)
+    assert not policy.can_retry(3, started, 1.0)
+    clock.now += 9.5
+    assert not policy.can_retry(1, started, 1.0)
+
+
+def test_retry_budget_limits_retries_to_deposits():
+    budget = RetryBudget(ratio=0.5, max_tokens=2)
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    budget.deposit()
+    assert not budget.try_spend()
+    budget.deposit()
+    assert budget.try_spend()
+
+
+def test_retry_budget_caps_tokens():
+    budget = RetryBudget(ratio=1, max_tokens=2)
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+def test_breaker_stays_closed_below_min_calls(clock):
+    breaker = CircuitBreaker(window=10, min_calls=5, error_rate=0.5, open_seconds=30)
+    for _ in range(4):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_breaker_opens_at_error_rate_and_rejects(clock):
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, open_seconds=30)
+    breaker.record_success()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    assert breaker.stats()["rejected"] == 1
+    assert breaker.stats()["times_opened"] == 1
+
+
+def test_breaker_half_open_allows_a_single_probe(clock):
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, open_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_breaker_probe_success_closes_and_resets_window(clock):
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, open_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    # The failures that opened the circuit no longer count
+    assert breaker.stats()["window_calls"] == 1
+    assert breaker.stats()["window_error_rate"] == 0.0
+
+
+def test_breaker_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(window=4, min_calls=2, error_rate=0.5, open_seconds=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["times_opened"] == 2
+    clock.now += 29
+    assert not breaker.allow_request()
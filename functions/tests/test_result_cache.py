@@ -0,0 +1,123 @@
+import base64
+
+import pytest
+
+import result_cache
+from result_cache import AnalysisCache, CacheStorage, SQLiteCacheStorage, make_cache_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(result_cache.time, "monotonic", fake)
+    monkeypatch.setattr(result_cache.time, "time", fake)
+    return fake
+
+
+class FailingStorage(CacheStorage):
+    def get(self, key):
+        raise OSError("disk unavailable")
+
+    def set(self, key, value, ttl_seconds):
+        raise OSError("disk unavailable")
+
+
+def test_get_returns_stored_value_and_counts_hits_and_misses():
+    cache = AnalysisCache()
+
+    assert cache.get("k") is None
+    cache.set("k", "v")
+
+    assert cache.get("k") == "v"
+    assert cache.stats() == {"hits": 1, "misses": 1, "storage_hits": 0, "entries": 1}
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = AnalysisCache(ttl_seconds=60)
+    cache.set("k", "v")
+
+    clock.now += 59
+    assert cache.get("k") == "v"
+    clock.now += 2
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnalysisCache(max_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    # Reading 'a' makes 'b' the least recently used
+    cache.get("a")
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+
+
+def test_storage_hit_is_promoted_to_memory(tmp_path):
+    storage = SQLiteCacheStorage(str(tmp_path / "cache.sqlite"))
+    AnalysisCache(storage=storage).set("k", "v")
+    # A fresh instance, as after a cold start, only has the SQLite tier
+    cache = AnalysisCache(storage=storage)
+
+    assert cache.get("k") == "v"
+    assert cache.stats()["storage_hits"] == 1
+    assert cache.stats()["entries"] == 1
+
+    cache.get("k")
+    assert cache.stats()["storage_hits"] == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_sqlite_entries_expire_after_ttl(tmp_path, clock):
+    storage = SQLiteCacheStorage(str(tmp_path / "cache.sqlite"))
+    storage.set("k", "v", ttl_seconds=60)
+
+    assert storage.get("k") == "v"
+    clock.now += 61
+    assert storage.get("k") is None
+
+
+def test_failing_storage_is_tolerated():
+    cache = AnalysisCache(storage=FailingStorage())
+
+    cache.set("k", "v")
+    assert cache.get("k") == "v"
+    assert cache.get("missing") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_base64_and_raw_bytes_share_a_key():
+    image = b"\x89PNG\r\n\x1a\n image data"
+    encoded = base64.b64encode(image).decode()
+
+    assert make_cache_key("prompt", "gpt-4o", image_base64=encoded) == \
+        make_cache_key("prompt", "gpt-4o", image_bytes=image)
+    assert make_cache_key("prompt", "gpt-4o", image_bytes=image) == \
+        make_cache_key("prompt", "gpt-4o", image_bytes=memoryview(image))
+
+
+def test_key_depends_on_prompt_and_model():
+    image = b"image data"
+    key = make_cache_key("prompt", "gpt-4o", image_bytes=image)
+
+    assert make_cache_key("other prompt", "gpt-4o", image_bytes=image) != key
+    assert make_cache_key("prompt", "gpt-4o-mini", image_bytes=image) != key
+    assert make_cache_key("prompt", "gpt-4o", image_bytes=b"other image") != key
+
+
+def test_url_key_ignores_scheme_and_host_case_and_fragment():
+    key = make_cache_key("prompt", "gpt-4o", image_url="https://example.com/a.jpg?sig=1")
+
+    assert make_cache_key("prompt", "gpt-4o", image_url="HTTPS://Example.COM/a.jpg?sig=1#top") == key
+    assert make_cache_key("prompt", "gpt-4o", image_url="https://example.com/a.jpg?sig=2") != key
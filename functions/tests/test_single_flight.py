@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class BlockingCall:
+    """Function that blocks until released, counting how often it runs"""
+
+    def __init__(self, result="value", error=None):
+        self.result = result
+        self.error = error
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run_concurrently(flight, key, fn, waiters):
+    """Start a leader, then waiters once the leader is in flight; return outcomes per thread"""
+    outcomes = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            outcome = flight.do(key, fn)
+        except Exception as e:
+            outcome = e
+        with lock:
+            outcomes.append(outcome)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    fn.started.wait(5)
+    threads = [threading.Thread(target=call) for _ in range(waiters)]
+    for thread in threads:
+        thread.start()
+    # Give the waiters time to attach to the in-flight call
+    time.sleep(0.05)
+    fn.release.set()
+    for thread in [leader] + threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_waiters_share_the_leaders_result():
+    flight = SingleFlight()
+    fn = BlockingCall(result={"mealName": "x"})
+
+    outcomes = run_concurrently(flight, "k", fn, waiters=3)
+
+    assert fn.calls == 1
+    assert sorted(shared for _, shared in outcomes) == [False, True, True, True]
+    assert all(result is fn.result for result, _ in outcomes)
+
+
+def test_waiters_share_the_leaders_exception():
+    flight = SingleFlight()
+    error = RuntimeError("upstream down")
+    fn = BlockingCall(error=error)
+
+    outcomes = run_concurrently(flight, "k", fn, waiters=2)
+
+    assert fn.calls == 1
+    assert outcomes == [error, error, error]
+
+
+def test_key_is_removed_after_the_call_finishes():
+    flight = SingleFlight()
+
+    assert flight.do("k", lambda: 1) == (1, False)
+    assert flight.stats()["in_flight"] == 0
+    # A later call with the same key runs again instead of reusing the old result
+    assert flight.do("k", lambda: 2) == (2, False)
+
+
+def test_key_is_removed_after_the_call_raises():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do("k", lambda: 1) == (1, False)
+
+
+def test_waiter_past_wait_seconds_runs_its_own_call():
+    flight = SingleFlight(wait_seconds=0.05)
+    slow = BlockingCall(result="leader")
+    leader = threading.Thread(target=flight.do, args=("k", slow))
+    leader.start()
+    slow.started.wait(5)
+
+    result = flight.do("k", lambda: "own")
+
+    slow.release.set()
+    leader.join(5)
+    assert result == ("own", False)
+    assert flight.stats()["wait_timeouts"] == 1
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: "a") == ("a", False)
+    assert flight.do("b", lambda: "b") == ("b", False)
+    assert flight.stats()["leaders"] == 2
+
+
+def test_stats_count_leaders_coalesced_and_in_flight():
+    flight = SingleFlight()
+    fn = BlockingCall()
+    leader = threading.Thread(target=flight.do, args=("k", fn))
+    leader.start()
+    fn.started.wait(5)
+
+    assert flight.stats()["in_flight"] == 1
+
+    waiter = threading.Thread(target=flight.do, args=("k", fn))
+    waiter.start()
+    time.sleep(0.05)
+    fn.release.set()
+    leader.join(5)
+    waiter.join(5)
+
+    assert flight.stats() == {"leaders": 1, "coalesced": 1, "wait_timeouts": 0, "in_flight": 0}
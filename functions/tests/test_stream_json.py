@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from stream_json import IncrementalObjectParser
+
+ANALYSIS = {
+    "mealName": {"en": "Shakshuka, \"spicy\"", "he": "שקשוקה"},
+    "estimatedCalories": 420,
+    "macros": {"proteins": "18g", "carbohydrates": "22g", "fats": "27g"},
+    "ingredients": {"en": ["eggs", "tomatoes {crushed}", "peppers, red"]},
+    "healthiness": "healthy",
+}
+
+
+def feed_all(parser, chunks):
+    completed = []
+    for chunk in chunks:
+        completed.extend(parser.feed(chunk))
+    return completed
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1000])
+def test_members_decoded_for_any_chunking(chunk_size):
+    text = json.dumps(ANALYSIS, ensure_ascii=False)
+    parser = IncrementalObjectParser()
+    completed = feed_all(parser, [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)])
+    assert parser.done
+    assert parser.fields == ANALYSIS
+    assert [key for key, _ in completed] == list(ANALYSIS)
+
+
+def test_member_is_emitted_as_soon_as_it_completes():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"mealName": {"en": "Toast"}') == []
+    assert parser.feed(', "estimatedCalories": 1') == [("mealName", {"en": "Toast"})]
+    assert parser.feed("50}") == [("estimatedCalories", 150)]
+
+
+def test_text_before_the_object_is_ignored():
+    parser = IncrementalObjectParser()
+    completed = feed_all(parser, ["```json\n", '{"a": 1}', "\n```"])
+    assert completed == [("a", 1)]
+    assert parser.done
+
+
+def test_escaped_quotes_and_backslashes_inside_strings():
+    parser = IncrementalObjectParser()
+    feed_all(parser, ['{"a": "say \\"hi\\", ', 'ok\\\\", "b": "}"}'])
+    assert parser.fields == {"a": 'say "hi", ok\\', "b": "}"}
+
+
+def test_input_after_the_closing_brace_is_ignored():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": 1} {"b": 2}') == [("a", 1)]
+    assert parser.feed('{"c": 3}') == []
+
+
+def test_malformed_member_is_skipped():
+    parser = IncrementalObjectParser()
+    completed = parser.feed('{"a": tru, "b": 2}')
+    assert completed == [("b", 2)]
+    assert parser.done
+
+
+def test_truncated_object_is_not_done():
+    parser = IncrementalObjectParser()
+    completed = parser.feed('{"a": 1, "b": [1, 2')
+    assert completed == [("a", 1)]
+    assert not parser.done